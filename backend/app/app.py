@@ -1,17 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query, UploadFile, File, Header
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
+from typing import List, Literal, Optional
+from decimal import Decimal
+from datetime import date, datetime
 
 from database import Database
-from auth import AuthService
+from auth import AuthService, USER_CHANGES_CHANNEL
 from logger import DatabaseLogger
-from models import UserReg, User, Token, Product, PurchaseOrderMain, PurchaseOrderOut, UpdateValueData, DeleteRowData, InsertRowData, BackupIn
-from prepare import prepare_token, prepare_user, prepare_product, prepare_orders, prepare_products
+from models import UserReg, User, Token, Product, ProductSuggestion, LogTable, PurchaseOrderMain, PurchaseOrderOut, UpdateValueData, DeleteRowData, InsertRowData, BatchData, BatchResult, BackupIn, CheckoutIn, CheckoutOut, ProfilingSettingsIn
+from prepare import prepare_token, prepare_user, prepare_product, prepare_orders, prepare_products, prepare_product_summaries, prepare_log, prepare_checkout
 import os
-from utils import authorize, check_admin_permission, check_column_name, check_table_name, deserialize_json_objects
-from backup_service import BackupService
-from exceptions import UnexpectedErrorHTTP, BackupNotFoundHTTP, NonUniqueBackupNameHTTP
+from utils import authorize, check_admin_permission, check_column_name, check_table_name, encode_cursor, decode_cursor, to_naive_utc, resolve_date_range
+from backup_service import BackupService, InvalidBackupNameError
+from backup_store import BackupStore
+from exceptions import UnexpectedErrorHTTP, BackupNotFoundHTTP, NonUniqueBackupNameHTTP, ServiceBusyHTTP, InvalidCursorHTTP, ImportRejectedHTTP, BackupBusyHTTP, BackupJobNotFoundHTTP, InvalidBackupNameHTTP, CheckoutItemNotFoundHTTP, IdempotencyKeyReusedHTTP, ProfileNotFoundHTTP, StatementStatsUnavailableHTTP, TablePagingUnsupportedHTTP
+from password_hasher import HasherBusyError
+from notifier import DatabaseNotifier
+from catalog import CatalogSnapshot, PRODUCT_CHANGES_CHANNEL
+from suggest import ProductSuggestIndex, PRODUCT_ROW_CHANGES_CHANNEL
+from table_export import TableExporter, EXPORT_FORMATS
+from schema_catalog import SchemaCatalog, SCHEMA_CHANGES_CHANNEL
+from batch import BatchExecutor
+from table_import import TableImporter, ImportRejectedError
+from log_partitions import LogPartitionManager
+from orders import OrderService
+from metrics import MetricsRegistry, MetricsMiddleware
+from profiler import RequestProfiler, ProfilingMiddleware
+import hmac
 app = FastAPI()
 
 origins = [
@@ -25,21 +43,115 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Next-After-Id", "X-Has-More", "Idempotent-Replayed", "X-Profile-Id"],
 )
 
 config_path = os.path.join(os.path.dirname(__file__), 'config.json')
 print(config_path, flush=True)
 db = Database(config_path=config_path)
 auth_service = AuthService(config_path=config_path, db=db)
-logger = DatabaseLogger(db)
+logger = DatabaseLogger(db, config_path=config_path)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
-backup_service = BackupService(None)
+backup_service = BackupService(db, config_path)
+backup_store = BackupStore(db, config_path)
+catalog = CatalogSnapshot(db)
+suggest_index = ProductSuggestIndex(db)
+table_exporter = TableExporter(db)
+schema_catalog = SchemaCatalog(db)
+batch_executor = BatchExecutor(db, schema_catalog)
+order_service = OrderService(db)
+table_importer = TableImporter(db, schema_catalog)
+log_partitions = LogPartitionManager(db, config_path)
+notifier = DatabaseNotifier(db)
+notifier.subscribe(USER_CHANGES_CHANNEL, auth_service.on_user_changed)
+notifier.subscribe(PRODUCT_CHANGES_CHANNEL, catalog.invalidate)
+notifier.subscribe(PRODUCT_CHANGES_CHANNEL, suggest_index.on_table_changed)
+notifier.subscribe(PRODUCT_ROW_CHANGES_CHANNEL, suggest_index.on_row_changed)
+notifier.subscribe(SCHEMA_CHANGES_CHANNEL, schema_catalog.on_schema_changed)
+notifier.on_reset(auth_service.user_cache.clear)
+notifier.on_reset(catalog.invalidate)
+notifier.on_reset(suggest_index.on_reset)
+notifier.on_reset(schema_catalog.on_schema_changed)
+
+metrics = MetricsRegistry(config_path)
+if metrics.enabled:
+    app.add_middleware(MetricsMiddleware, registry=metrics)
+    metrics.instrument(db, exclude=('switchover',))
+    db.pool_wait_observer = lambda seconds: metrics.pool_acquire_wait.observe((), seconds)
+    metrics.gauge('db_pool_connections', 'Pooled connections by state.', lambda: [] if db.pool is None else [
+        ({'state': 'open'}, db.pool.get_size()),
+        ({'state': 'idle'}, db.pool.get_idle_size()),
+        ({'state': 'in_use'}, db.pool.active),
+        ({'state': 'max'}, db.pool.get_max_size()),
+    ])
+    metrics.counter('password_hasher_calls_total', 'bcrypt hash and verify calls.', lambda: [
+        ({'operation': operation}, data['count'])
+        for operation, data in auth_service.hasher.stats()['latency'].items()
+    ])
+    metrics.counter('password_hasher_rejected_total', 'bcrypt calls rejected because the queue was full.',
+                    lambda: [({}, auth_service.hasher.rejected)])
+    metrics.gauge('password_hasher_queue_depth', 'bcrypt calls waiting or running.',
+                  lambda: [({}, auth_service.hasher.pending)])
+    metrics.counter('user_cache_requests_total', 'User cache lookups by result.', lambda: [
+        ({'result': 'hit'}, auth_service.user_cache.hits),
+        ({'result': 'miss'}, auth_service.user_cache.misses),
+    ])
+    metrics.counter('action_log_records_total', 'Action log records by outcome.', lambda: [
+        ({'outcome': outcome}, logger.stats()[outcome]) for outcome in ('flushed', 'dropped', 'spilled')
+    ])
+    metrics.counter('db_reads_total', 'Read-only connections handed out, by server.', lambda: [
+        ({'server': 'primary'}, db.replicas.primary_reads),
+        *(({'server': replica.name}, replica.reads) for replica in db.replicas.replicas),
+    ])
+    metrics.gauge('db_replica_healthy', 'Whether a replica currently serves reads.', lambda: [
+        ({'replica': replica.name}, int(replica.healthy)) for replica in db.replicas.replicas
+    ])
+    metrics.gauge('db_replica_lag_seconds', 'Replication lag seen by the last health check.', lambda: [
+        ({'replica': replica.name}, replica.lag_seconds)
+        for replica in db.replicas.replicas if replica.lag_seconds is not None
+    ])
+    metrics.counter('db_slow_queries_total', 'Statements slower than the slow query threshold.',
+                    lambda: [({}, db.slow_queries.total)])
+    metrics.gauge('action_log_queue_depth', 'Action log records waiting to be flushed.',
+                  lambda: [({}, logger.stats()['queued'])])
+
+profiler = RequestProfiler(config_path)
+
+async def is_admin_token(token: str) -> bool:
+    try:
+        user = await auth_service.get_user_by_token(token)
+    except (TimeoutError, ValueError, LookupError, RuntimeError):
+        return False
+    return auth_service.check_admin_permission(user)
+
+# added last so it wraps the metrics middleware and the profile covers the whole request
+app.add_middleware(ProfilingMiddleware, profiler=profiler, is_admin=is_admin_token)
 
 @app.on_event("startup")
 async def startup():
     print("Starting application...", flush=True)
+    auth_service.hasher.start()
     await db.create_connection_pool()
     print("Database connection pool created.", flush=True)
+    await logger.start()
+    await log_partitions.start()
+    await notifier.start()
+    print("Database notification listener started.", flush=True)
+    await schema_catalog.load()
+    print("Schema catalog loaded.", flush=True)
+    await catalog.rebuild()
+    print("Product catalog snapshot built.", flush=True)
+    await suggest_index.rebuild()
+    print("Product suggest index built.", flush=True)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await backup_service.shutdown()
+    await db.replicas.stop()
+    await notifier.stop()
+    await log_partitions.stop()
+    await logger.stop()
+    auth_service.hasher.shutdown()
 
 @app.post("/register")
 async def register(user: UserReg):
@@ -47,6 +159,8 @@ async def register(user: UserReg):
         await auth_service.register_user(user.username, user.password, user.email)
     except ValueError:
         raise HTTPException(status_code=409, detail="User with this username or email already exists.")
+    except HasherBusyError:
+        raise ServiceBusyHTTP()
     except RuntimeError:
         raise HTTPException(status_code=500, detail="An unexpected error occurred.")
 
@@ -56,6 +170,8 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         token = await auth_service.authenticate_user(form_data.username, form_data.password)
     except PermissionError:
         raise HTTPException(status_code=401, detail="Invalid credentials.")
+    except HasherBusyError:
+        raise ServiceBusyHTTP()
     except RuntimeError:
         raise HTTPException(status_code=500, detail="An unexpected error occurred.")
     return Token(
@@ -81,9 +197,6 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 async def get_current_user_role(token: str = Depends(oauth2_scheme)):
     try:
         user = await auth_service.get_user_by_token(token)
-        print('\n\n\n')
-        print(user)
-        print('\n\n\n')
     except TimeoutError:
         raise HTTPException(status_code=401, detail="Token has expired.")
     except ValueError:
@@ -95,30 +208,97 @@ async def get_current_user_role(token: str = Depends(oauth2_scheme)):
     return { 'role': user['role_name'] }
 
 @app.get("/products", response_model=List[Product])
-async def get_all_products():
+async def get_all_products(
+    request: Request,
+    min_price: Decimal = None,
+    max_price: Decimal = None,
+    sort: str = Query(None, regex="^(price|name)$"),
+    order: str = Query("asc", regex="^(asc|desc)$"),
+    limit: int = Query(None, ge=1, le=100),
+    cursor: str = None,
+    view: str = Query("full", regex="^(full|summary)$")
+):
+    paginated = any(param is not None for param in (min_price, max_price, sort, limit, cursor)) \
+        or order != "asc" or view != "full"
+    if not paginated:
+        try:
+            # Отдаём заранее сериализованный снимок каталога, пул не используется
+            return await catalog.response(request)
+        except Exception:
+            e = HTTPException(status_code=500, detail="An unexpected error occurred.")
+            await logger.log("GET_PRODUCTS_ERROR__" + str(e), -1, to_db=True)
+            raise e
+
+    sort_key = sort or "id"
+    limit = limit or 20
+    after_value, after_id = None, None
+    if cursor is not None:
+        position = decode_cursor(cursor, 'sort', 'value', 'id')
+        if position['sort'] != sort_key:
+            raise InvalidCursorHTTP()
+        try:
+            after_id = int(position['id'])
+            if sort_key == "price":
+                price = Decimal(position['value'])
+                if not price.is_finite():
+                    raise ValueError(position['value'])
+                after_value = str(price)
+            elif sort_key == "name":
+                if not isinstance(position['value'], str):
+                    raise TypeError(position['value'])
+                after_value = position['value']
+        except (TypeError, ValueError, ArithmeticError):
+            raise InvalidCursorHTTP()
     try:
-        async with db.pool.acquire() as conn:
-            records = await db.fetch_cars(conn)  # Получаем список Record
-            products = [dict(record) for record in records]  # Преобразуем Record в словари
-            print('\n\n\n')
-            print(products)
-            print('\n\n\n')
+        async with db.acquire_read() as conn:
+            products = await db.fetch_cars_page(
+                conn,
+                min_price=min_price,
+                max_price=max_price,
+                sort_key=sort_key,
+                sort_desc=order == "desc",
+                limit=limit,
+                after_value=after_value,
+                after_id=after_id,
+                with_description=view == "full"
+            )
     except Exception:
         e = HTTPException(status_code=500, detail="An unexpected error occurred.")
         await logger.log("GET_PRODUCTS_ERROR__" + str(e), -1, to_db=True)
         raise e
-    return prepare_products(products) 
 
+    headers = {}
+    if len(products) == limit:
+        last = products[-1]
+        last_value = {"id": None, "price": str(last['price']), "name": last['car_name']}[sort_key]
+        headers["X-Next-Cursor"] = encode_cursor({'sort': sort_key, 'value': last_value, 'id': last['car_id']})
+    items = prepare_products(products) if view == "full" else prepare_product_summaries(products)
+    return JSONResponse(content=jsonable_encoder(items), headers=headers)
+
+
+@app.get("/products/suggest", response_model=List[ProductSuggestion])
+async def suggest_products(prefix: str = '', limit: int = Query(10, ge=1, le=50)):
+    return suggest_index.suggest(prefix, limit)
 
 @app.get("/products/search", response_model=List[Product])
-async def search_products(name: str = None):
+async def search_products(response: Response, name: str = None, limit: int = Query(20, ge=1, le=100), cursor: str = None):
+    after_rank, after_id = None, None
+    if cursor is not None:
+        position = decode_cursor(cursor, 'rank', 'id')
+        try:
+            after_rank, after_id = float(position['rank']), int(position['id'])
+        except (TypeError, ValueError, ArithmeticError):
+            raise InvalidCursorHTTP()
     try:
-        async with db.pool.acquire() as conn:
-            product = await db.search_cars(conn, name=name)
+        async with db.acquire_read() as conn:
+            products = await db.search_cars(conn, name=name, limit=limit, after_rank=after_rank, after_id=after_id)
     except Exception:
         e = HTTPException(status_code=500, detail="An unexpected error occurred.")
         raise e
-    return prepare_product(product)
+    if len(products) == limit:
+        last = products[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor({'rank': last['search_rank'], 'id': last['product_id']})
+    return [prepare_product(product) for product in products]
 
 @app.post("/order")
 async def create_order(order: PurchaseOrderMain, token: str = Depends(oauth2_scheme)):
@@ -131,6 +311,7 @@ async def create_order(order: PurchaseOrderMain, token: str = Depends(oauth2_sch
                 car_name= order.car_name,
                 shipment_method_name=order.shipment_method_name
             )
+            await db.record_write(conn, user["user_id"])
     except TimeoutError:
         e = HTTPException(status_code=401, detail="Token has expired.")
         await logger.log("CREATE_ORDER_ERROR__" + str(e), user["user_id"] ,to_db=True)
@@ -149,12 +330,63 @@ async def create_order(order: PurchaseOrderMain, token: str = Depends(oauth2_sch
         raise e
 
 
+@app.post("/checkout", response_model=CheckoutOut)
+async def checkout(checkout_in: CheckoutIn, response: Response, token: str = Depends(oauth2_scheme),
+                   idempotency_key: Optional[str] = Header(None, max_length=255)):
+    user = await authorize(auth_service, token)
+    try:
+        rows, replayed = await order_service.checkout(
+            user['user_id'],
+            checkout_in.product_ids,
+            checkout_in.shipment_method_id,
+            idempotency_key
+        )
+    except LookupError as ex:
+        e = CheckoutItemNotFoundHTTP(str(ex))
+        await logger.log("CHECKOUT_ERROR__" + str(e), user["user_id"], to_db=True)
+        raise e
+    except ValueError:
+        e = IdempotencyKeyReusedHTTP()
+        await logger.log("CHECKOUT_ERROR__" + str(e), user["user_id"], to_db=True)
+        raise e
+    except RuntimeError:
+        e = UnexpectedErrorHTTP()
+        await logger.log("CHECKOUT_ERROR__" + str(e), user["user_id"], to_db=True)
+        raise e
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return prepare_checkout(rows, replayed)
+
 @app.get("/orders", response_model=List[PurchaseOrderOut])
-async def get_orders(token: str = Depends(oauth2_scheme)):
+async def get_orders(
+    response: Response,
+    from_date: date = None,
+    to_date: date = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str = None,
+    token: str = Depends(oauth2_scheme)
+):
+    before_date, before_id = None, None
+    if cursor is not None:
+        position = decode_cursor(cursor, 'date', 'id')
+        try:
+            before_date, before_id = date.fromisoformat(position['date']), int(position['id'])
+        except (TypeError, ValueError):
+            raise InvalidCursorHTTP()
     try:
         user = await auth_service.get_user_by_token(token)
-        async with db.pool.acquire() as conn:
-            orders = await db.fetch_orders_by_user(conn, user["user_id"])
+        # the user's own reads wait for their latest order to reach a replica, or go to the primary
+        async with db.acquire_read(user["user_id"]) as conn:
+            # one extra row tells whether another page exists without counting the history
+            orders = await db.fetch_orders_by_user(
+                conn,
+                user["user_id"],
+                from_date=from_date,
+                to_date=to_date,
+                limit=limit + 1,
+                before_date=before_date,
+                before_id=before_id
+            )
     except TimeoutError:
         e = HTTPException(status_code=401, detail="Token has expired.")
         await logger.log("GET_ORDERS__" + str(e), user["user_id"] ,to_db=True)
@@ -171,35 +403,143 @@ async def get_orders(token: str = Depends(oauth2_scheme)):
         e = HTTPException(status_code=500, detail="An unexpected error occurred.")
         await logger.log("GET_ORDERS__" + str(e), user["user_id"] ,to_db=True)
         raise e
-    
+
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    if has_more:
+        last = orders[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor({'date': last['order_date'].isoformat(), 'id': last['order_id']})
     return prepare_orders(orders)
 
 
 # ADMIN TOOLS ROUTES ---
 
-@app.get("/database/{table_name}")
-async def get_full_table(table_name: str, token = Depends(oauth2_scheme)):    
+@app.get("/database/logs", response_model=List[LogTable])
+async def get_logs(
+    response: Response,
+    user_id: int = None,
+    action_type: str = None,
+    from_timestamp: datetime = None,
+    until_timestamp: datetime = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str = None,
+    token = Depends(oauth2_scheme)
+):
     user = await authorize(auth_service, token)
     check_admin_permission(auth_service, user)
-    await check_table_name(db, table_name)
 
+    before_timestamp, before_id = None, None
+    if cursor is not None:
+        position = decode_cursor(cursor, 'timestamp', 'id')
+        try:
+            before_timestamp, before_id = datetime.fromisoformat(position['timestamp']), int(position['id'])
+        except (TypeError, ValueError):
+            raise InvalidCursorHTTP()
     try:
         async with db.pool.acquire() as conn:
-            table = await db.get_full_table(conn, table_name)
+            logs = await db.get_logs(
+                conn,
+                user_id=user_id,
+                action_type=action_type,
+                from_timestamp=to_naive_utc(from_timestamp),
+                until_timestamp=to_naive_utc(until_timestamp),
+                limit=limit,
+                before_timestamp=before_timestamp,
+                before_id=before_id
+            )
     except RuntimeError:
         raise UnexpectedErrorHTTP()
-    if len(table) == 0:
-        async with db.pool.acquire() as conn:
-            columns = await db.get_columns_by_table_name(conn, table_name)
-        return [rec['column_name'] for rec in columns]
-    return deserialize_json_objects(table)
+
+    if len(logs) == limit:
+        last = logs[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor({'timestamp': last['action_timestamp'].isoformat(), 'id': last['log_id']})
+    return [prepare_log(log) for log in logs]
+
+@app.get("/database/replicas")
+async def get_replicas(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    return db.replicas.stats()
+
+@app.get("/database/{table_name}")
+async def get_full_table(
+    table_name: str,
+    after_id: int = None,
+    limit: int = Query(None, ge=1, le=10000),
+    stream: bool = False,
+    token = Depends(oauth2_scheme)
+):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+    check_table_name(schema_catalog, table_name)
+
+    # resolved up front: once a stream has started, errors can no longer change the status code
+    async with db.acquire_read() as conn:
+        primary_key = await db.get_table_primary_key(conn, table_name)
+    if primary_key is None and (after_id is not None or limit is not None):
+        raise TablePagingUnsupportedHTTP()
+    if stream:
+        return StreamingResponse(
+            stream_table_rows(table_name, primary_key, after_id), media_type="application/x-ndjson"
+        )
+
+    try:
+        async with db.acquire_read() as conn:
+            page = await db.get_full_table_json(conn, table_name, after_id, limit)
+    except RuntimeError:
+        raise UnexpectedErrorHTTP()
+    if page['row_count'] == 0 and after_id is None:
+        return schema_catalog.get_columns(table_name)
+    headers = {}
+    if limit is not None and page['row_count'] == limit:
+        headers["X-Next-After-Id"] = str(page['last_id'])
+    # Postgres already built the JSON array: forward it without parsing and re-encoding
+    return Response(content=page['rows_json'].encode('utf-8'), media_type="application/json", headers=headers)
+
+async def stream_table_rows(table_name: str, primary_key: Optional[str], after_id: int = None, chunk_size: int = 500):
+    async with db.acquire_read() as conn:
+        chunk = []
+        async for row in db.stream_full_table(conn, table_name, primary_key, after_id):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield ("\n".join(chunk) + "\n").encode("utf-8")
+                chunk = []
+        if chunk:
+            yield ("\n".join(chunk) + "\n").encode("utf-8")
+
+@app.get("/database/{table_name}/export")
+async def export_table(
+    table_name: str,
+    format: str = Query("csv", regex="^(csv|ndjson)$"),
+    gzip: bool = False,
+    columns: Optional[List[str]] = Query(None),
+    token = Depends(oauth2_scheme)
+):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+    check_table_name(schema_catalog, table_name)
+    for column_name in columns or []:
+        check_column_name(schema_catalog, table_name, column_name)
+
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"{table_name}.{extension}" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        media_type = "application/gzip"
+    return StreamingResponse(
+        table_exporter.export(table_name, columns, format, compress=gzip),
+        media_type=media_type,
+        headers=headers
+    )
 
 @app.patch("/database/update-value")
 async def update_value(data: UpdateValueData, token = Depends(oauth2_scheme)):
     user = await authorize(auth_service, token)
     check_admin_permission(auth_service, user)
-    await check_table_name(db, data.table_name)
-    await check_column_name(db, data.table_name, data.column_name)
+    check_table_name(schema_catalog, data.table_name)
+    check_column_name(schema_catalog, data.table_name, data.column_name)
     
     try:
         async with db.pool.acquire() as conn:
@@ -211,7 +551,7 @@ async def update_value(data: UpdateValueData, token = Depends(oauth2_scheme)):
 async def delete_row(data: DeleteRowData, token = Depends(oauth2_scheme)):
     user = await authorize(auth_service, token)
     check_admin_permission(auth_service, user)
-    await check_table_name(db, data.table_name)
+    check_table_name(schema_catalog, data.table_name)
     
     try:
         async with db.pool.acquire() as conn:
@@ -223,7 +563,7 @@ async def delete_row(data: DeleteRowData, token = Depends(oauth2_scheme)):
 async def insert_row(data: InsertRowData, token = Depends(oauth2_scheme)):
     user = await authorize(auth_service, token)
     check_admin_permission(auth_service, user)
-    await check_table_name(db, data.table_name)
+    check_table_name(schema_catalog, data.table_name)
 
     try:
         async with db.pool.acquire() as conn:
@@ -231,19 +571,56 @@ async def insert_row(data: InsertRowData, token = Depends(oauth2_scheme)):
     except RuntimeError:
         raise UnexpectedErrorHTTP()
 
+@app.post("/database/batch", response_model=BatchResult)
+async def apply_batch(data: BatchData, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        committed, results = await batch_executor.execute(data.operations, atomic=data.atomic)
+    except RuntimeError:
+        raise UnexpectedErrorHTTP()
+
+    return BatchResult(committed=committed, results=results)
+
+@app.post("/database/{table_name}/import")
+async def import_table(
+    table_name: str,
+    file: UploadFile = File(...),
+    format: str = Query(None, regex="^(csv|ndjson)$"),
+    token = Depends(oauth2_scheme)
+):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+    check_table_name(schema_catalog, table_name)
+
+    import_format = format or ("ndjson" if (file.filename or "").endswith((".ndjson", ".jsonl")) else "csv")
+    try:
+        report = await table_importer.import_file(table_name, file.file, import_format)
+    except ImportRejectedError as e:
+        raise ImportRejectedHTTP(str(e))
+    except RuntimeError:
+        raise UnexpectedErrorHTTP()
+    finally:
+        await file.close()
+
+    return report
+
 @app.post("/backup/create")
 async def create_backup(backup_in: BackupIn, token = Depends(oauth2_scheme)):
     user = await authorize(auth_service, token)
     check_admin_permission(auth_service, user)
 
     try:
-        backup_service.create_backup(backup_in.backup_name)
+        job = backup_service.create_backup(backup_in.backup_name, backup_in.backup_format)
+    except InvalidBackupNameError:
+        raise InvalidBackupNameHTTP()
     except ValueError:
         raise NonUniqueBackupNameHTTP()
     except RuntimeError:
-        raise UnexpectedErrorHTTP()
+        raise BackupBusyHTTP()
     
-    return {"message": "Backup created", "backup_name": backup_in.backup_name}
+    return {"message": "Backup started", "backup_name": backup_in.backup_name, "job_id": job.id}
 
 @app.delete("/backup/delete")
 async def delete_backup(backup_in: BackupIn, token = Depends(oauth2_scheme)):
@@ -254,6 +631,10 @@ async def delete_backup(backup_in: BackupIn, token = Depends(oauth2_scheme)):
         backup_service.delete_backup(backup_in.backup_name)
     except FileNotFoundError:
         raise BackupNotFoundHTTP()
+    except InvalidBackupNameError:
+        raise InvalidBackupNameHTTP()
+    except ValueError:
+        raise BackupBusyHTTP()
 
     return {"message": "Backup deleted", "backup_name": backup_in.backup_name}
 
@@ -263,13 +644,123 @@ async def restore_backup(backup_in: BackupIn, token = Depends(oauth2_scheme)):
     check_admin_permission(auth_service, user)
 
     try:
-        backup_service.restore_backup(backup_in.backup_name)
+        job = backup_service.restore_backup(backup_in.backup_name)
     except FileNotFoundError:
         raise BackupNotFoundHTTP()
+    except InvalidBackupNameError:
+        raise InvalidBackupNameHTTP()
     except RuntimeError:
-        raise UnexpectedErrorHTTP()
+        raise BackupBusyHTTP()
+
+    return {"message": "Restore started", "backup_name": backup_in.backup_name, "job_id": job.id}
+
+@app.get("/backup/jobs")
+async def get_backup_jobs(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
 
-    return {"message": "Backup restored", "backup_name": backup_in.backup_name}
+    return {"jobs": [job.to_dict() for job in backup_service.get_all_jobs()]}
+
+@app.get("/backup/jobs/{job_id}")
+async def get_backup_job(job_id: str, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        job = backup_service.get_job(job_id)
+    except LookupError:
+        raise BackupJobNotFoundHTTP()
+
+    return job.to_dict()
+
+@app.delete("/backup/jobs/{job_id}")
+async def cancel_backup_job(job_id: str, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        job = await backup_service.cancel_job(job_id)
+    except LookupError:
+        raise BackupJobNotFoundHTTP()
+
+    return job.to_dict()
+
+@app.post("/backup/snapshots")
+async def create_snapshot(backup_in: BackupIn, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        if backup_store.has_snapshot(backup_in.backup_name):
+            raise NonUniqueBackupNameHTTP()
+    except InvalidBackupNameError:
+        raise InvalidBackupNameHTTP()
+
+    async def work(job):
+        await backup_store.create_snapshot(backup_in.backup_name, progress=job.add_progress)
+
+    try:
+        job = backup_service.start_job('snapshot', backup_in.backup_name, work)
+    except RuntimeError:
+        raise BackupBusyHTTP()
+    return {"message": "Snapshot started", "backup_name": backup_in.backup_name, "job_id": job.id}
+
+@app.get("/backup/snapshots")
+async def get_snapshots(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    return backup_store.report()
+
+@app.post("/backup/snapshots/restore")
+async def restore_snapshot(backup_in: BackupIn, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        if not backup_store.has_snapshot(backup_in.backup_name):
+            raise BackupNotFoundHTTP()
+    except InvalidBackupNameError:
+        raise InvalidBackupNameHTTP()
+
+    async def work(job):
+        await backup_store.restore_snapshot(backup_in.backup_name, progress=job.add_progress)
+        # the restore runs with triggers off, so caches are rebuilt as after a lost listener
+        notifier.reset()
+
+    try:
+        job = backup_service.start_job('snapshot_restore', backup_in.backup_name, work)
+    except RuntimeError:
+        raise BackupBusyHTTP()
+    return {"message": "Restore started", "backup_name": backup_in.backup_name, "job_id": job.id}
+
+@app.post("/backup/snapshots/verify")
+async def verify_snapshot(backup_in: BackupIn, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        return await backup_store.verify_snapshot(backup_in.backup_name)
+    except FileNotFoundError:
+        raise BackupNotFoundHTTP()
+    except InvalidBackupNameError:
+        raise InvalidBackupNameHTTP()
+
+@app.delete("/backup/snapshots")
+async def delete_snapshot(backup_in: BackupIn, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        removed_chunks = backup_store.delete_snapshot(backup_in.backup_name)
+    except FileNotFoundError:
+        raise BackupNotFoundHTTP()
+    except InvalidBackupNameError:
+        raise InvalidBackupNameHTTP()
+    except ValueError:
+        raise BackupBusyHTTP()
+
+    return {"message": "Snapshot deleted", "backup_name": backup_in.backup_name, "removed_chunks": removed_chunks}
 
 @app.get("/backup/list")
 async def get_all_backups(token = Depends(oauth2_scheme)):
@@ -280,18 +771,196 @@ async def get_all_backups(token = Depends(oauth2_scheme)):
 
     return {"backups": backups}
 
+@app.get("/cache/stats")
+async def get_cache_stats(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    return {"user_cache": auth_service.user_cache.stats(), "log_queue": logger.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if metrics.scrape_token is not None and not hmac.compare_digest(
+            authorization or '', f"Bearer {metrics.scrape_token}"):
+        raise HTTPException(status_code=401, detail="Invalid scrape token.")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profiling")
+async def get_profiling_settings(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    return profiler.settings()
+
+@app.put("/debug/profiling")
+async def update_profiling_settings(settings: ProfilingSettingsIn, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    profiler.configure(settings.sample_rate, settings.path_prefix)
+    return profiler.settings()
+
+@app.get("/debug/profiles")
+async def get_profiles(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    return {"profiles": [profile.to_dict() for profile in profiler.get_all_profiles()]}
+
+@app.get("/debug/profiles/{profile_id}/collapsed", response_class=PlainTextResponse)
+async def get_profile_collapsed(profile_id: str, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        profile = profiler.get_profile(profile_id)
+    except LookupError:
+        raise ProfileNotFoundHTTP()
+    return PlainTextResponse(profile.collapsed())
+
+@app.get("/debug/profiles/{profile_id}/pstats")
+async def get_profile_pstats(profile_id: str, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        profile = profiler.get_profile(profile_id)
+    except LookupError:
+        raise ProfileNotFoundHTTP()
+    return Response(
+        content=profile.stats,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{profile.id}.pstats"'}
+    )
+
+@app.delete("/debug/profiles")
+async def clear_profiles(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    profiler.clear()
+    return {"message": "Profiles cleared"}
+
+@app.get("/auth/hasher/stats")
+async def get_hasher_stats(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    return {"password_hasher": auth_service.hasher.stats()}
+
 @app.get("/database/analytics/order-summary")
 async def get_all_backups(token = Depends(oauth2_scheme)):
     user = await authorize(auth_service, token)
     check_admin_permission(auth_service, user)
 
     try:
-        async with db.pool.acquire() as conn:
+        async with db.acquire_read() as conn:
             data = await db.get_order_summary(conn)
-            print('\n\n\n')
-            print(data)
-            print('\n\n\n')
     except RuntimeError:
         raise UnexpectedErrorHTTP()
 
     return {"data": data}
+
+@app.get("/database/analytics/sales")
+async def get_sales_series(
+    from_date: date = None,
+    to_date: date = None,
+    bucket: Literal['day', 'week', 'month'] = 'day',
+    shipment_method_id: int = None,
+    token = Depends(oauth2_scheme)
+):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    from_date, to_date = resolve_date_range(from_date, to_date)
+    async with db.acquire_read() as conn:
+        data = await db.get_sales_series(conn, from_date, to_date, bucket, shipment_method_id)
+
+    return {"from_date": from_date, "to_date": to_date, "bucket": bucket, "data": [dict(row) for row in data]}
+
+@app.get("/database/analytics/top-products")
+async def get_top_products(
+    from_date: date = None,
+    to_date: date = None,
+    limit: int = Query(10, ge=1, le=100),
+    order_by: Literal['revenue', 'orders'] = 'revenue',
+    token = Depends(oauth2_scheme)
+):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    from_date, to_date = resolve_date_range(from_date, to_date)
+    async with db.acquire_read() as conn:
+        data = await db.get_top_products(conn, from_date, to_date, limit, order_by)
+
+    return {"from_date": from_date, "to_date": to_date, "data": [dict(row) for row in data]}
+
+@app.get("/database/analytics/shipment-methods")
+async def get_shipment_breakdown(from_date: date = None, to_date: date = None, token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    from_date, to_date = resolve_date_range(from_date, to_date)
+    async with db.acquire_read() as conn:
+        data = await db.get_shipment_breakdown(conn, from_date, to_date)
+
+    return {"from_date": from_date, "to_date": to_date, "data": [dict(row) for row in data]}
+
+@app.post("/database/analytics/rebuild")
+async def rebuild_sales_rollups(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    async with db.pool.acquire() as conn:
+        await db.rebuild_sales_rollups(conn)
+
+    return {"message": "Sales rollups rebuilt"}
+
+@app.get("/database/queries/slow")
+async def get_slow_queries(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    return {
+        "threshold_ms": db.slow_queries.threshold * 1000,
+        "total": db.slow_queries.total,
+        "queries": db.slow_queries.get_all()
+    }
+
+@app.delete("/database/queries/slow")
+async def clear_slow_queries(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    db.slow_queries.clear()
+    return {"message": "Slow query log cleared"}
+
+@app.get("/database/queries/statements")
+async def get_statement_stats(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: Literal['total_time', 'mean_time', 'calls'] = 'total_time',
+    token = Depends(oauth2_scheme)
+):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        async with db.pool.acquire() as conn:
+            statements = await db.get_statement_stats(conn, limit, order_by)
+    except RuntimeError:
+        raise StatementStatsUnavailableHTTP()
+    return {"statements": [dict(statement) for statement in statements]}
+
+@app.delete("/database/queries/statements")
+async def reset_statement_stats(token = Depends(oauth2_scheme)):
+    user = await authorize(auth_service, token)
+    check_admin_permission(auth_service, user)
+
+    try:
+        async with db.pool.acquire() as conn:
+            await db.reset_statement_stats(conn)
+    except RuntimeError:
+        raise StatementStatsUnavailableHTTP()
+    return {"message": "Statement statistics reset"}
@@ -1,24 +1,54 @@
 import jwt
 import json
 from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
-from typing import Optional
+from typing import Optional, Tuple
 from asyncpg import exceptions
 
 from database import Database
+from cache import UserCache
+from password_hasher import PasswordHasher
+
+USER_CHANGES_CHANNEL = 'user_changes'
 
 class AuthService:
     def __init__(self, config_path: str, db: Database):
         with open(config_path, "r") as config_file:
-            self.config = json.load(config_file)['jwt']
+            config = json.load(config_file)
+        self.config = config['jwt']
+        cache_config = config.get('user_cache', {})
+        hashing_config = config.get('password_hashing', {})
         self.db = db
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self.hasher = PasswordHasher(
+            rounds=hashing_config.get('bcrypt_rounds', 12),
+            workers=hashing_config.get('workers', 2),
+            max_queue=hashing_config.get('max_queue', 64)
+        )
+        self.user_cache = UserCache(
+            max_size=cache_config.get('max_size', 10000),
+            ttl_seconds=cache_config.get('ttl_seconds', 60)
+        )
+
+    def on_user_changed(self, username: str):
+        # an empty payload means a role changed and any cached user may be stale
+        if username:
+            self.user_cache.invalidate_user(username)
+        else:
+            self.user_cache.clear()
+
+    async def __verify_password(self, plain_password: str, hashed_password: str) -> Tuple[bool, bool]:
+        return await self.hasher.verify(plain_password, hashed_password)
 
-    def __verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return self.pwd_context.verify(plain_password, hashed_password)
+    async def __hash_password(self, password: str) -> str:
+        return await self.hasher.hash(password)
 
-    def __hash_password(self, password: str) -> str:
-        return self.pwd_context.hash(password)
+    async def __rehash_password(self, user_id: int, password: str):
+        hashed_password = await self.__hash_password(password)
+        async with self.db.pool.acquire() as conn:
+            try:
+                await self.db.update_password_hash(conn, user_id, hashed_password)
+            except exceptions.PostgresError:
+                # the old hash is still valid, so the next login simply retries
+                pass
 
     def __create_jwt(self, user_id: int, username: str) -> str:
         expiration = datetime.now(timezone.utc) + timedelta(days=self.config["jwt_expiration_days"])
@@ -35,12 +65,17 @@ class AuthService:
                 user = await self.db.fetch_user_by_username(conn, username)
             except exceptions.PostgresError:
                 raise RuntimeError("An unexpected error occurred.")
-            if user and self.__verify_password(password, user['password_hash']):
-                return self.__create_jwt(user["user_id"], user["username"])
+        if user is None:
+            raise PermissionError("Invalid credentials.")
+        verified, needs_rehash = await self.__verify_password(password, user['password_hash'])
+        if not verified:
             raise PermissionError("Invalid credentials.")
+        if needs_rehash:
+            await self.__rehash_password(user["user_id"], password)
+        return self.__create_jwt(user["user_id"], user["username"])
 
     async def register_user(self, username: str, password: str, email: str, role_id: int = 1) -> None:
-        hashed_password = self.__hash_password(password)
+        hashed_password = await self.__hash_password(password)
         async with self.db.pool.acquire() as conn:
             try:
                 await self.db.add_user(conn, username, hashed_password, email, role_id)
@@ -60,15 +95,21 @@ class AuthService:
         username = payload.get("sub")
         if username is None:
             raise ValueError("Invalid token.")
-        
+
+        user = self.user_cache.get(username, token)
+        if user is not None:
+            return user
+
+        generation = self.user_cache.generation
         async with self.db.pool.acquire() as conn:
             try:
                 user = await self.db.fetch_user_by_username(conn, username)
-                if user is None:
-                    raise LookupError("User not found.")
-                return user
             except exceptions.PostgresError:
                 raise RuntimeError("An unexpected error occurred.")
+        if user is None:
+            raise LookupError("User not found.")
+        self.user_cache.put(username, token, user, generation)
+        return user
     
     def check_admin_permission(self, user):
         return user['role_name'] == 'admin'
@@ -1,75 +1,319 @@
+import asyncio
+import json
 import os
-import subprocess
-from typing import Dict
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from database import Database
+
+BACKUP_FORMATS = {
+    'custom': ('c', '.sql'),
+    'directory': ('d', '.dir'),
+}
+
+
+class InvalidBackupNameError(ValueError):
+    pass
+
+
+def resolve_inside(directory: str, name: str) -> str:
+    # the name is user input: after resolving links and '..' it must still point into directory
+    root = os.path.realpath(directory)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.dirname(path) != root:
+        raise InvalidBackupNameError(f"Backup name {name} leaves the backup directory.")
+    return path
+
+
+class BackupJob:
+    def __init__(self, kind: str, backup_name: str, backup_path: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.backup_name = backup_name
+        self.backup_path = backup_path
+        self.status = 'running'
+        self.error: Optional[str] = None
+        self.bytes_written = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.phase: Optional[str] = None
+        self.verification: Optional[dict] = None
+        self.drained: Optional[bool] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def add_progress(self, size: int):
+        self.bytes_written += size
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "backup_name": self.backup_name,
+            "status": self.status,
+            "phase": self.phase,
+            "error": self.error,
+            "bytes_written": self.bytes_written,
+            "elapsed_seconds": round(end - self.started_at, 1),
+            "verification": self.verification,
+            "drained": self.drained,
+        }
+
 
 class BackupService:
-    def __init__(self, config: Dict):
+    def __init__(self, db: Database, config_path: Optional[str] = None):
+        config = {}
+        if config_path is not None:
+            with open(config_path, 'r') as config_file:
+                config = json.load(config_file).get('backup', {})
+        self.db = db
         self.__POSTGRES_USER = 'admin'
         self.__POSTGRES_PASSWORD = 'admin'
         self.__POSTGRES_CONTAINER = 'db'
         self.__DATABASE_NAME = 'ultragedy'
         self.__BACKUP_DIR = './backups'
+        self.__PARALLEL_JOBS = config.get('parallel_jobs', 4)
+        self.__COMPRESSION = config.get('compression')
+        self.__PROGRESS_INTERVAL = config.get('progress_interval_seconds', 0.5)
+        self.__MAX_FINISHED_JOBS = config.get('max_finished_jobs', 100)
+        self.__DRAIN_TIMEOUT = config.get('drain_timeout_seconds', 10.0)
+        self.__KEEP_RETIRED_DATABASE = config.get('keep_retired_database', False)
+        self.__jobs: "OrderedDict[str, BackupJob]" = OrderedDict()
 
     def __create_backup_dir(self):
         os.makedirs(self.__BACKUP_DIR, exist_ok=True)
-    
-    def __get_backup_path(self, backup_name: str, extension_needed: bool = False):
-        return f"{self.__BACKUP_DIR}/{backup_name}" + extension_needed * '.sql'
-    
-    def __get_create_command(self, backup_path: str):
-        os.environ['PGPASSWORD'] = self.__POSTGRES_PASSWORD
-        return [
+
+    def __get_backup_path(self, backup_name: str, extension: str = ''):
+        return resolve_inside(self.__BACKUP_DIR, backup_name + extension)
+
+    def __get_env(self):
+        return {**os.environ, 'PGPASSWORD': self.__POSTGRES_PASSWORD}
+
+    def __get_create_command(self, backup_path: str, backup_format: str):
+        format_flag = BACKUP_FORMATS[backup_format][0]
+        command = [
             "pg_dump",
             "-h", self.__POSTGRES_CONTAINER,
             "-U", self.__POSTGRES_USER,
-            "-F", "c", "-f", backup_path,
-            self.__DATABASE_NAME
+            "-F", format_flag, "-f", backup_path
         ]
-    
-    def __get_restore_command(self, backup_path: str):
-        os.environ['PGPASSWORD'] = self.__POSTGRES_PASSWORD
+        if backup_format == 'directory':
+            command += ["-j", str(self.__PARALLEL_JOBS)]
+        if self.__COMPRESSION is not None:
+            command += ["-Z", str(self.__COMPRESSION)]
+        return command + [self.__DATABASE_NAME]
+
+    def __get_restore_command(self, backup_path: str, database_name: str):
+        format_flag = 'd' if os.path.isdir(backup_path) else 'c'
         return [
             "pg_restore",
-            "--clean",
             "-h", self.__POSTGRES_CONTAINER,
             "-U", self.__POSTGRES_USER,
-            "-d", self.__DATABASE_NAME,
-            "-F", "c", backup_path
+            "-d", database_name,
+            "-j", str(self.__PARALLEL_JOBS),
+            "-F", format_flag, backup_path
         ]
-    
-    def create_backup(self, backup_name: str):
-        try:
-            self.__create_backup_dir()
-            backup_path = self.__get_backup_path(backup_name, True)
-            if os.path.exists(backup_path):
-                raise ValueError("Backup with this name already exists.")
-            command = self.__get_create_command(backup_path)
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError:
-            raise RuntimeError("An unexpected error occurred.")
-    
+
+    def __check_not_busy(self, backup_path: str):
+        for job in self.__jobs.values():
+            if job.status == 'running' and job.backup_path == backup_path:
+                raise ValueError("Backup is in use by a running job.")
+
+    def __check_no_restore(self):
+        # a restore ends by disconnecting every session of the live database
+        if any(job.status == 'running' and job.kind == 'restore' for job in self.__jobs.values()):
+            raise RuntimeError("A restore is in progress.")
+
+    def create_backup(self, backup_name: str, backup_format: str = 'custom') -> BackupJob:
+        self.__create_backup_dir()
+        if any(os.path.exists(self.__get_backup_path(backup_name, extension)) for _, extension in BACKUP_FORMATS.values()):
+            raise ValueError("Backup with this name already exists.")
+        backup_path = self.__get_backup_path(backup_name, BACKUP_FORMATS[backup_format][1])
+        self.__check_not_busy(backup_path)
+        command = self.__get_create_command(backup_path, backup_format)
+        return self.start_job('create', backup_name, lambda job: self.__dump(job, command), backup_path)
+
     def delete_backup(self, backup_name: str):
+        backup_path = self.__get_backup_path(backup_name)
+        # only what get_all_backups lists can be deleted: .sql files and .dir directories
+        is_dump = backup_name.endswith('.sql') and os.path.isfile(backup_path)
+        is_directory = backup_name.endswith('.dir') and os.path.isdir(backup_path)
+        if not is_dump and not is_directory:
+            raise FileNotFoundError(f"Backup file {backup_name} does not exist.")
+        self.__check_not_busy(backup_path)
+        if is_directory:
+            shutil.rmtree(backup_path)
+        else:
+            os.remove(backup_path)
+
+    def restore_backup(self, backup_name: str) -> BackupJob:
         backup_path = self.__get_backup_path(backup_name)
         if not os.path.exists(backup_path):
             raise FileNotFoundError(f"Backup file {backup_name} does not exist.")
-        os.remove(backup_path)
-    
-    def restore_backup(self, backup_name: str):
-        try:
-            backup_path = self.__get_backup_path(backup_name)
-            if not os.path.exists(backup_path):
-                raise FileNotFoundError(f"Backup file {backup_name} does not exist.")
-            command = self.__get_restore_command(backup_path)
-            subprocess.run(command, check=True)
-        except FileNotFoundError as e:
-            raise e
-        except subprocess.CalledProcessError:
-            raise RuntimeError("An error occurred while restoring the backup.")
-    
+        if any(job.status == 'running' for job in self.__jobs.values()):
+            raise RuntimeError("Backup jobs are still running.")
+        return self.start_job('restore', backup_name, self.__restore, backup_path)
+
     def get_all_backups(self):
         self.__create_backup_dir()
 
         backups = os.listdir(self.__BACKUP_DIR)
-        backups = [file for file in backups if file.endswith(".sql")]
+        backups = [
+            file for file in backups
+            if file.endswith(".sql") or (file.endswith(".dir") and os.path.isdir(self.__get_backup_path(file)))
+        ]
 
         return backups
+
+    def get_job(self, job_id: str) -> BackupJob:
+        job = self.__jobs.get(job_id)
+        if job is None:
+            raise LookupError(f"Backup job {job_id} does not exist.")
+        return job
+
+    def get_all_jobs(self) -> List[BackupJob]:
+        return list(self.__jobs.values())
+
+    def start_job(self, kind: str, backup_name: str, work: Callable[[BackupJob], Awaitable],
+                  backup_path: Optional[str] = None) -> BackupJob:
+        self.__check_no_restore()
+        job = BackupJob(kind, backup_name, backup_path)
+        self.__jobs[job.id] = job
+        self.__forget_finished_jobs()
+        job.task = asyncio.ensure_future(self.__run_work(job, work))
+        return job
+
+    async def cancel_job(self, job_id: str) -> BackupJob:
+        job = self.get_job(job_id)
+        if job.status != 'running' or job.phase == 'switching':
+            return job
+        job.status = 'cancelled'
+        if job.process is not None and job.process.returncode is None:
+            job.process.terminate()
+        elif job.process is None and job.task is not None:
+            job.task.cancel()
+        if job.task is not None:
+            await asyncio.wait({job.task})
+        return job
+
+    async def shutdown(self):
+        for job in self.get_all_jobs():
+            if job.status == 'running':
+                await self.cancel_job(job.id)
+
+    async def __dump(self, job: BackupJob, command: List[str]):
+        try:
+            await self.__execute(job, command)
+        except BaseException:
+            self.__remove_path(job.backup_path)
+            raise
+
+    async def __restore(self, job: BackupJob):
+        live = self.db.config['dbname']
+        shadow = f"{live}_restore_{job.id[:8]}"
+        retired = f"{live}_retired_{job.id[:8]}"
+        conn = await self.db.create_maintenance_connection()
+        try:
+            job.phase = 'creating'
+            await self.db.create_database(conn, shadow)
+            switched = False
+            try:
+                job.phase = 'restoring'
+                await self.__execute(job, self.__get_restore_command(job.backup_path, shadow))
+                job.phase = 'verifying'
+                job.verification = await self.__verify(shadow)
+                job.phase = 'switching'
+                # the live database is only touched here, for the length of the drain and the rename
+                job.drained = await self.db.switchover(
+                    lambda: self.db.swap_databases(conn, live, shadow, retired),
+                    self.__DRAIN_TIMEOUT
+                )
+                switched = True
+            finally:
+                if not switched:
+                    await self.db.drop_database(conn, shadow)
+            job.phase = 'done'
+            if not self.__KEEP_RETIRED_DATABASE:
+                await self.db.drop_database(conn, retired)
+        finally:
+            await conn.close()
+
+    async def __verify(self, shadow: str) -> dict:
+        shadow_conn = await self.db.create_connection(shadow)
+        try:
+            restored = await self.db.get_table_overview(shadow_conn, count_rows=True)
+        finally:
+            await shadow_conn.close()
+        async with self.db.pool.acquire() as conn:
+            expected = await self.db.get_table_overview(conn, count_rows=False)
+        problems = []
+        for table_name, table in expected.items():
+            if table_name not in restored:
+                problems.append(f"missing table {table_name}")
+                continue
+            missing = [column for column in table['columns'] if column not in restored[table_name]['columns']]
+            if missing:
+                problems.append(f"{table_name} lacks {', '.join(missing)}")
+        if problems:
+            raise RuntimeError(f"Restored database does not match the live schema: {'; '.join(problems)}.")
+        return {table_name: table['rows'] for table_name, table in restored.items()}
+
+    async def __execute(self, job: BackupJob, command: List[str]):
+        job.process = await asyncio.create_subprocess_exec(
+            *command,
+            env=self.__get_env(),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stderr = asyncio.ensure_future(job.process.stderr.read())
+            while job.process.returncode is None:
+                try:
+                    await asyncio.wait_for(job.process.wait(), self.__PROGRESS_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                if job.kind == 'create':
+                    job.bytes_written = self.__get_size(job.backup_path)
+            error_output = (await stderr).decode(errors='replace').strip()
+        finally:
+            process, job.process = job.process, None
+            if process.returncode is None:
+                process.terminate()
+        if job.status == 'cancelled':
+            raise asyncio.CancelledError()
+        if process.returncode != 0:
+            raise RuntimeError(error_output or f"Exited with code {process.returncode}.")
+
+    async def __run_work(self, job: BackupJob, work: Callable[[BackupJob], Awaitable]):
+        try:
+            await work(job)
+            job.status = 'completed'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def __forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.__jobs.items() if job.status != 'running']
+        for job_id in finished[:max(0, len(finished) - self.__MAX_FINISHED_JOBS)]:
+            del self.__jobs[job_id]
+
+    @staticmethod
+    def __get_size(path: str) -> int:
+        if os.path.isdir(path):
+            return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    @staticmethod
+    def __remove_path(path: str):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
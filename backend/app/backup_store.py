@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from backup_service import resolve_inside
+from database import Database
+
+MANIFEST_VERSION = 1
+
+
+# content-defined chunks of a COPY stream: a chunk ends after a row whose checksum has the
+# low boundary_bits bits clear, so an inserted or deleted row only changes its own chunk
+class _Chunker:
+    def __init__(self, min_bytes: int, max_bytes: int, boundary_bits: int):
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.mask = (1 << boundary_bits) - 1
+        self.__rows: List[bytes] = []
+        self.__size = 0
+        self.__partial = b''
+
+    def feed(self, data: bytes) -> List[bytes]:
+        lines = (self.__partial + data).split(b'\n')
+        self.__partial = lines.pop()
+        chunks = []
+        for line in lines:
+            row = line + b'\n'
+            self.__rows.append(row)
+            self.__size += len(row)
+            if self.__size >= self.max_bytes or (
+                    self.__size >= self.min_bytes and zlib.crc32(row) & self.mask == 0):
+                chunks.append(self.__cut())
+        return chunks
+
+    def finish(self) -> List[bytes]:
+        if self.__partial:
+            self.__rows.append(self.__partial)
+            self.__size += len(self.__partial)
+            self.__partial = b''
+        return [self.__cut()] if self.__rows else []
+
+    def __cut(self) -> bytes:
+        chunk = b''.join(self.__rows)
+        self.__rows, self.__size = [], 0
+        return chunk
+
+
+# snapshots are per-table manifests over a shared, content-addressed chunk pool
+class BackupStore:
+    def __init__(self, db: Database, config_path: Optional[str] = None):
+        config = {}
+        if config_path is not None:
+            with open(config_path, 'r') as config_file:
+                config = json.load(config_file).get('backup', {})
+        self.db = db
+        self.root = config.get('store_dir', './backups/store')
+        self.chunk_min_bytes = config.get('chunk_min_bytes', 64 * 1024)
+        self.chunk_max_bytes = config.get('chunk_max_bytes', 4 * 1024 * 1024)
+        self.chunk_boundary_bits = config.get('chunk_boundary_bits', 10)
+        self.compression = config.get('compression') or 6
+        # chunks written by snapshots that have no manifest yet; garbage collection keeps them
+        self.__pending_chunks: Dict[str, Set[str]] = {}
+        self.__in_use: Set[str] = set()
+
+    def has_snapshot(self, snapshot_name: str) -> bool:
+        return os.path.exists(self.__manifest_path(snapshot_name)) or snapshot_name in self.__in_use
+
+    async def create_snapshot(self, snapshot_name: str, progress=None) -> dict:
+        if self.has_snapshot(snapshot_name):
+            raise ValueError("Snapshot with this name already exists.")
+        self.__in_use.add(snapshot_name)
+        pending = self.__pending_chunks[snapshot_name] = set()
+        try:
+            tables = []
+            async with self.db.pool.acquire() as conn:
+                # one snapshot of the whole database, so foreign keys between tables stay consistent
+                async with conn.transaction(isolation='repeatable_read', readonly=True):
+                    for record in await self.db.get_backup_tables(conn):
+                        tables.append(await self.__dump_table(
+                            conn, record['table_name'], list(record['column_names']), pending, progress
+                        ))
+            manifest = {
+                'version': MANIFEST_VERSION,
+                'snapshot_name': snapshot_name,
+                'created_at': time.time(),
+                'tables': tables,
+            }
+            await self.__run(self.__write_manifest, snapshot_name, manifest)
+            return self.__describe(manifest, self.__load_manifests())
+        finally:
+            del self.__pending_chunks[snapshot_name]
+            self.__in_use.discard(snapshot_name)
+
+    async def restore_snapshot(self, snapshot_name: str, progress=None):
+        manifest = self.__read_manifest(snapshot_name)
+        missing = [
+            chunk['hash'] for table in manifest['tables'] for chunk in table['chunks']
+            if not os.path.exists(self.__chunk_path(chunk['hash']))
+        ]
+        if missing:
+            raise RuntimeError(f"Snapshot {snapshot_name} is missing {len(missing)} chunks.")
+        self.__in_use.add(snapshot_name)
+        try:
+            async with self.db.pool.acquire() as conn:
+                async with conn.transaction():
+                    # no triggers and no foreign key checks while the tables are refilled in name order
+                    await conn.execute("SET LOCAL session_replication_role = 'replica'")
+                    await self.db.truncate_tables(conn, [table['table_name'] for table in manifest['tables']])
+                    for table in manifest['tables']:
+                        await self.__restore_table(conn, table, progress)
+                        await self.db.reset_table_sequences(conn, table['table_name'])
+        finally:
+            self.__in_use.discard(snapshot_name)
+
+    async def verify_snapshot(self, snapshot_name: str) -> dict:
+        manifest = self.__read_manifest(snapshot_name)
+        corrupted, checked = [], set()
+        for table in manifest['tables']:
+            for chunk in table['chunks']:
+                if chunk['hash'] in checked:
+                    continue
+                checked.add(chunk['hash'])
+                try:
+                    await self.__run(self.__read_chunk, chunk['hash'])
+                except (OSError, ValueError, zlib.error):
+                    corrupted.append({'table_name': table['table_name'], 'hash': chunk['hash']})
+        return {'snapshot_name': snapshot_name, 'ok': not corrupted, 'corrupted': corrupted}
+
+    def delete_snapshot(self, snapshot_name: str) -> int:
+        path = self.__manifest_path(snapshot_name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Snapshot {snapshot_name} does not exist.")
+        if snapshot_name in self.__in_use:
+            raise ValueError("Snapshot is in use by a running job.")
+        os.remove(path)
+        return self.__collect_garbage()
+
+    def get_all_snapshots(self) -> List[dict]:
+        manifests = self.__load_manifests()
+        return [self.__describe(manifest, manifests) for manifest in manifests]
+
+    def report(self) -> dict:
+        manifests = self.__load_manifests()
+        snapshots = [self.__describe(manifest, manifests) for manifest in manifests]
+        stored: Dict[str, int] = {}
+        for manifest in manifests:
+            for table in manifest['tables']:
+                for chunk in table['chunks']:
+                    stored[chunk['hash']] = chunk['stored']
+        logical = sum(snapshot['logical_bytes'] for snapshot in snapshots)
+        physical = sum(stored.values())
+        return {
+            'snapshots': snapshots,
+            'logical_bytes': logical,
+            'physical_bytes': physical,
+            'chunks': len(stored),
+            'dedup_ratio': round(logical / physical, 2) if physical else None,
+        }
+
+    async def __dump_table(self, conn, table_name: str, columns: List[str], pending: Set[str], progress) -> dict:
+        chunker = _Chunker(self.chunk_min_bytes, self.chunk_max_bytes, self.chunk_boundary_bits)
+        digest = hashlib.sha256()
+        entries = []
+        totals = {'bytes': 0, 'rows': 0}
+
+        async def store(chunks: List[bytes]):
+            for chunk in chunks:
+                digest.update(chunk)
+                totals['bytes'] += len(chunk)
+                totals['rows'] += chunk.count(b'\n')
+                chunk_hash = hashlib.sha256(chunk).hexdigest()
+                # registered before the write, so a concurrent delete cannot collect an existing copy
+                pending.add(chunk_hash)
+                stored = await self.__run(self.__write_chunk, chunk_hash, chunk)
+                entries.append({'hash': chunk_hash, 'size': len(chunk), 'stored': stored})
+                if progress is not None:
+                    progress(len(chunk))
+
+        async def output(data: bytes):
+            await store(chunker.feed(data))
+
+        await self.db.copy_table_rows(conn, table_name, columns, output)
+        await store(chunker.finish())
+        return {
+            'table_name': table_name,
+            'columns': columns,
+            'rows': totals['rows'],
+            'logical_bytes': totals['bytes'],
+            'sha256': digest.hexdigest(),
+            'chunks': entries,
+        }
+
+    async def __restore_table(self, conn, table: dict, progress):
+        digest = hashlib.sha256()
+
+        async def source() -> AsyncIterator[bytes]:
+            for chunk in table['chunks']:
+                data = await self.__run(self.__read_chunk, chunk['hash'])
+                digest.update(data)
+                if progress is not None:
+                    progress(len(data))
+                yield data
+
+        await self.db.restore_table_rows(conn, table['table_name'], table['columns'], source())
+        if digest.hexdigest() != table['sha256']:
+            raise RuntimeError(f"Checksum mismatch while restoring {table['table_name']}.")
+
+    @staticmethod
+    async def __run(function, *args):
+        # hashing, compression and file io stay off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def __write_chunk(self, chunk_hash: str, chunk: bytes) -> int:
+        path = self.__chunk_path(chunk_hash)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(chunk, self.compression)
+        temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temporary, 'wb') as chunk_file:
+            chunk_file.write(compressed)
+        os.replace(temporary, path)
+        return len(compressed)
+
+    def __read_chunk(self, chunk_hash: str) -> bytes:
+        with open(self.__chunk_path(chunk_hash), 'rb') as chunk_file:
+            data = zlib.decompress(chunk_file.read())
+        if hashlib.sha256(data).hexdigest() != chunk_hash:
+            raise ValueError(f"Chunk {chunk_hash} is corrupted.")
+        return data
+
+    def __write_manifest(self, snapshot_name: str, manifest: dict):
+        path = self.__manifest_path(snapshot_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temporary, path)
+
+    def __read_manifest(self, snapshot_name: str) -> dict:
+        try:
+            with open(self.__manifest_path(snapshot_name), 'r') as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Snapshot {snapshot_name} does not exist.")
+
+    def __load_manifests(self) -> List[dict]:
+        directory = os.path.join(self.root, 'manifests')
+        if not os.path.isdir(directory):
+            return []
+        manifests = []
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.json'):
+                with open(os.path.join(directory, file_name), 'r') as manifest_file:
+                    manifests.append(json.load(manifest_file))
+        return sorted(manifests, key=lambda manifest: manifest['created_at'])
+
+    def __collect_garbage(self) -> int:
+        referenced = {
+            chunk['hash']
+            for manifest in self.__load_manifests()
+            for table in manifest['tables']
+            for chunk in table['chunks']
+        }.union(*self.__pending_chunks.values())
+        removed = 0
+        chunks_dir = os.path.join(self.root, 'chunks')
+        if not os.path.isdir(chunks_dir):
+            return removed
+        for prefix in os.listdir(chunks_dir):
+            for file_name in os.listdir(os.path.join(chunks_dir, prefix)):
+                if file_name.endswith('.z') and file_name[:-2] not in referenced:
+                    os.remove(os.path.join(chunks_dir, prefix, file_name))
+                    removed += 1
+        return removed
+
+    @staticmethod
+    def __describe(manifest: dict, manifests: List[dict]) -> dict:
+        earlier = set()
+        for other in manifests:
+            if other['created_at'] >= manifest['created_at']:
+                break
+            earlier.update(chunk['hash'] for table in other['tables'] for chunk in table['chunks'])
+        referenced: Dict[str, int] = {}
+        for table in manifest['tables']:
+            for chunk in table['chunks']:
+                referenced[chunk['hash']] = chunk['stored']
+        return {
+            'snapshot_name': manifest['snapshot_name'],
+            'created_at': manifest['created_at'],
+            'tables': len(manifest['tables']),
+            'rows': sum(table['rows'] for table in manifest['tables']),
+            'logical_bytes': sum(table['logical_bytes'] for table in manifest['tables']),
+            # compressed size of every chunk the snapshot needs, shared or not
+            'referenced_bytes': sum(referenced.values()),
+            # compressed size of the chunks no earlier snapshot already had
+            'new_bytes': sum(size for chunk_hash, size in referenced.items() if chunk_hash not in earlier),
+        }
+
+    def __manifest_path(self, snapshot_name: str) -> str:
+        return resolve_inside(os.path.join(self.root, 'manifests'), f'{snapshot_name}.json')
+
+    def __chunk_path(self, chunk_hash: str) -> str:
+        return os.path.join(self.root, 'chunks', chunk_hash[:2], f'{chunk_hash}.z')
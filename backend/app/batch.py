@@ -0,0 +1,180 @@
+from itertools import groupby
+from typing import Dict, List, Optional, Set, Tuple
+
+from asyncpg import exceptions
+
+from database import Database, quote_ident
+from models import BatchOperation, BatchOperationResult
+from schema_catalog import SchemaCatalog
+
+Statement = Tuple[int, str, str, tuple]
+
+
+class BatchExecutor:
+    def __init__(self, db: Database, schema_catalog: SchemaCatalog):
+        self.db = db
+        self.schema_catalog = schema_catalog
+
+    async def execute(self, operations: List[BatchOperation], atomic: bool = True) -> Tuple[bool, List[BatchOperationResult]]:
+        results: List[Optional[BatchOperationResult]] = [None] * len(operations)
+        statements: List[Statement] = []
+        for index, operation in enumerate(operations):
+            error = self.__validate(operation)
+            if error is not None:
+                results[index] = BatchOperationResult(index=index, status='error', detail=error)
+            else:
+                statements.append((index, operation.op, *self.__build(operation)))
+
+        if atomic and len(statements) != len(operations):
+            for index, _, _, _ in statements:
+                results[index] = BatchOperationResult(index=index, status='skipped')
+            return False, results
+
+        async with self.db.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    if atomic:
+                        if not await self.__execute_atomic(conn, operations, statements, results):
+                            # leaving the block through an exception rolls the transaction back
+                            raise _Rollback()
+                    else:
+                        await self.__execute_each(conn, statements, results)
+            except _Rollback:
+                return False, results
+        return True, results
+
+    async def __execute_atomic(self, conn, operations: List[BatchOperation], statements: List[Statement], results) -> bool:
+        # consecutive operations sharing a statement go out as one round trip, so a batch keeps its
+        # order: inserts as an executemany, updates and deletes as one set-based statement over
+        # unnest()ed ids whose RETURNING keys show which rows were missing
+        runs = [list(run) for _, run in groupby(statements, key=lambda statement: statement[2])]
+        for run in runs:
+            op, query = run[0][1], run[0][2]
+            if op == 'insert':
+                try:
+                    await conn.executemany(query, [args for _, _, _, args in run])
+                except exceptions.PostgresError as e:
+                    self.__fail(statements, results, {index: str(e) for index, _, _, _ in run})
+                    return False
+                for index, _, _, _ in run:
+                    results[index] = BatchOperationResult(index=index, status='ok')
+                continue
+            set_query = self.__build_set(operations[run[0][0]])
+            for chunk in self.__split_repeated_ids(operations, run):
+                ids = [operations[index].id for index, _, _, _ in chunk]
+                arguments = (ids, [operations[index].new_value for index, _, _, _ in chunk]) if op == 'update' else (ids,)
+                try:
+                    found = {record[0] for record in await conn.fetch(set_query, *arguments)}
+                except exceptions.PostgresError as e:
+                    self.__fail(statements, results, {index: str(e) for index, _, _, _ in chunk})
+                    return False
+                missing = {index: "Row not found." for index, _, _, _ in chunk if operations[index].id not in found}
+                if missing:
+                    self.__fail(statements, results, missing, executed={index for index, _, _, _ in chunk})
+                    return False
+                for index, _, _, _ in chunk:
+                    results[index] = BatchOperationResult(index=index, status='ok')
+        return True
+
+    @staticmethod
+    def __split_repeated_ids(operations: List[BatchOperation], run: List[Statement]) -> List[List[Statement]]:
+        # a set-based statement touches each row once, so a repeated id starts a new statement
+        # and sees the earlier change, as it would when run one by one
+        chunks, seen = [[]], set()
+        for statement in run:
+            row_id = operations[statement[0]].id
+            if row_id in seen:
+                chunks.append([])
+                seen = set()
+            seen.add(row_id)
+            chunks[-1].append(statement)
+        return chunks
+
+    def __fail(self, statements: List[Statement], results, errors: Dict[int, str], executed: Set[int] = frozenset()):
+        # operations before the failure, and those that ran in the same statement, were rolled back
+        # with it; the ones after it never ran
+        failed = False
+        for index, _, _, _ in statements:
+            if index in errors:
+                results[index] = BatchOperationResult(index=index, status='error', detail=errors[index])
+                failed = True
+            elif failed and index not in executed:
+                results[index] = BatchOperationResult(index=index, status='skipped')
+            else:
+                results[index] = BatchOperationResult(index=index, status='rolled_back')
+
+    async def __execute_each(self, conn, statements: List[Statement], results):
+        prepared = {}
+        for index, _, query, args in statements:
+            try:
+                # each operation runs in its own savepoint so a failure does not abort the batch
+                async with conn.transaction():
+                    statement = prepared.get(query)
+                    if statement is None:
+                        statement = prepared[query] = await conn.prepare(query)
+                    await statement.fetch(*args)
+            except exceptions.PostgresError as e:
+                results[index] = BatchOperationResult(index=index, status='error', detail=str(e))
+                continue
+            if statement.get_statusmsg().endswith(' 0'):
+                results[index] = BatchOperationResult(index=index, status='error', detail="Row not found.")
+            else:
+                results[index] = BatchOperationResult(index=index, status='ok')
+
+    def __validate(self, operation: BatchOperation) -> Optional[str]:
+        catalog = self.schema_catalog
+        if not catalog.has_table(operation.table_name):
+            return "Table not found."
+        if operation.op == 'insert':
+            if not operation.columns or operation.values is None or len(operation.columns) != len(operation.values):
+                return "Insert requires matching columns and values."
+            if any(not catalog.has_column(operation.table_name, column) for column in operation.columns):
+                return "Column not found."
+            return None
+        if operation.id is None:
+            return "Operation requires id."
+        if len(catalog.primary_keys.get(operation.table_name, [])) != 1:
+            return "Table has no single-column primary key."
+        if operation.op == 'update' and not catalog.has_column(operation.table_name, operation.column_name or ''):
+            return "Column not found."
+        return None
+
+    def __build(self, operation: BatchOperation) -> Tuple[str, tuple]:
+        table = operation.table_name
+        column_types = self.schema_catalog.column_types[table]
+        if operation.op == 'insert':
+            columns = ', '.join(quote_ident(column) for column in operation.columns)
+            values = ', '.join(
+                f'${position}::text::{column_types[column]}'
+                for position, column in enumerate(operation.columns, start=1)
+            )
+            return f'INSERT INTO {quote_ident(table)} ({columns}) VALUES ({values})', tuple(operation.values)
+        primary_key = quote_ident(self.schema_catalog.primary_keys[table][0])
+        if operation.op == 'update':
+            column = operation.column_name
+            query = (
+                f'UPDATE {quote_ident(table)} SET {quote_ident(column)} = $1::text::{column_types[column]} '
+                f'WHERE {primary_key} = $2'
+            )
+            return query, (operation.new_value, operation.id)
+        return f'DELETE FROM {quote_ident(table)} WHERE {primary_key} = $1', (operation.id,)
+
+    def __build_set(self, operation: BatchOperation) -> str:
+        table = operation.table_name
+        primary_key = quote_ident(self.schema_catalog.primary_keys[table][0])
+        if operation.op == 'update':
+            column = operation.column_name
+            column_type = self.schema_catalog.column_types[table][column]
+            return (
+                f'UPDATE {quote_ident(table)} AS t SET {quote_ident(column)} = v.value::{column_type} '
+                f'FROM unnest($1::bigint[], $2::text[]) AS v(id, value) '
+                f'WHERE t.{primary_key} = v.id RETURNING t.{primary_key}'
+            )
+        return (
+            f'DELETE FROM {quote_ident(table)} AS t USING unnest($1::bigint[]) AS v(id) '
+            f'WHERE t.{primary_key} = v.id RETURNING t.{primary_key}'
+        )
+
+
+class _Rollback(Exception):
+    pass
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+class UserCache:
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 60.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.__entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self.__keys_by_username: Dict[str, Set[Tuple[str, str]]] = {}
+        self.__generation = 0
+
+    @property
+    def generation(self) -> int:
+        return self.__generation
+
+    def get(self, username: str, token: str) -> Optional[Any]:
+        key = (username, token)
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self.__remove(key)
+            self.misses += 1
+            return None
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return user
+
+    def put(self, username: str, token: str, user: Any, generation: Optional[int] = None):
+        # a fetch that raced with an invalidation must not repopulate stale data
+        if generation is not None and generation != self.__generation:
+            return
+        key = (username, token)
+        self.__entries[key] = (time.monotonic() + self.ttl_seconds, user)
+        self.__entries.move_to_end(key)
+        self.__keys_by_username.setdefault(username, set()).add(key)
+        while len(self.__entries) > self.max_size:
+            oldest = next(iter(self.__entries))
+            self.__remove(oldest)
+            self.evictions += 1
+
+    def invalidate_user(self, username: str):
+        self.__generation += 1
+        self.invalidations += 1
+        for key in self.__keys_by_username.pop(username, set()):
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        self.__generation += 1
+        self.invalidations += 1
+        self.__entries.clear()
+        self.__keys_by_username.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.__entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def __remove(self, key: Tuple[str, str]):
+        self.__entries.pop(key, None)
+        keys = self.__keys_by_username.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.__keys_by_username[key[0]]
@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from database import Database
+from prepare import prepare_products
+
+PRODUCT_CHANGES_CHANNEL = 'product_changes'
+
+
+class CatalogSnapshot:
+    def __init__(self, db: Database, gzip_level: int = 6):
+        self.db = db
+        self.gzip_level = gzip_level
+        self.body: Optional[bytes] = None
+        self.gzip_body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self.version = 0
+        self.rebuilds = 0
+        self.logger = logging.getLogger(__name__)
+        self.__built_version = -1
+        self.__lock = asyncio.Lock()
+        self.__rebuild_task: Optional[asyncio.Task] = None
+
+    @property
+    def stale(self) -> bool:
+        return self.__built_version != self.version
+
+    def invalidate(self, payload: str = None):
+        self.version += 1
+        self.__schedule_rebuild()
+
+    async def rebuild(self):
+        async with self.__lock:
+            # changes arriving mid-build are picked up by another pass
+            while self.body is None or self.stale:
+                version = self.version
+                async with self.db.pool.acquire() as conn:
+                    records = await self.db.fetch_cars(conn)
+                body = json.dumps(
+                    jsonable_encoder(prepare_products(records)),
+                    separators=(',', ':'),
+                    ensure_ascii=False
+                ).encode('utf-8')
+                self.body = body
+                self.gzip_body = gzip.compress(body, compresslevel=self.gzip_level)
+                self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+                self.__built_version = version
+                self.rebuilds += 1
+
+    def __schedule_rebuild(self):
+        if self.__rebuild_task is None or self.__rebuild_task.done():
+            self.__rebuild_task = asyncio.ensure_future(self.__rebuild_in_background())
+
+    async def __rebuild_in_background(self):
+        try:
+            await self.rebuild()
+        except Exception as e:
+            self.logger.error(f"Catalog snapshot rebuild failed: {e}")
+
+    async def response(self, request: Request) -> Response:
+        if self.body is None:
+            await self.rebuild()
+        elif self.stale:
+            # serve the previous snapshot while a failed or pending rebuild is retried
+            self.__schedule_rebuild()
+        body, gzip_body, etag = self.body, self.gzip_body, self.etag
+        use_gzip = 'gzip' in request.headers.get('accept-encoding', '')
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+        if self.__matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            return Response(content=gzip_body, media_type='application/json', headers=headers)
+        return Response(content=body, media_type='application/json', headers=headers)
+
+    @staticmethod
+    def __matches(if_none_match: Optional[str], etag: str) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        # proxies may weaken the tag or append an encoding suffix to it
+        candidates = (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+        return any(tag == etag or tag.replace('-gzip"', '"') == etag for tag in candidates)
@@ -1,24 +1,255 @@
-from asyncpg import Connection, create_pool
+from asyncpg import Connection, connect, create_pool, exceptions
+import asyncio
 import json
-from typing import List
-from datetime import datetime
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List
+from datetime import date, datetime
+from decimal import Decimal
 from typing import Optional
 
+from replicas import ReplicaSet
+
+
+# pg_stat_statements is not installed, or not loaded through shared_preload_libraries
+STATEMENT_STATS_ERRORS = (
+    exceptions.ObjectNotInPrerequisiteStateError,
+    exceptions.UndefinedTableError,
+    exceptions.UndefinedFunctionError,
+)
+
+
+def quote_ident(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+# front of the pool that can hold new acquisitions while the pool behind it is replaced
+class PoolGate:
+    def __init__(self, pool):
+        self.pool = pool
+        self.__open = asyncio.Event()
+        self.__open.set()
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+        self.__active = 0
+        self.wait_observer: Optional[Callable[[float], None]] = None
+
+    @property
+    def active(self) -> int:
+        return self.__active
+
+    def __getattr__(self, name: str):
+        return getattr(self.pool, name)
+
+    def acquire(self):
+        return _GatedAcquire(self)
+
+    async def enter(self):
+        while not self.__open.is_set():
+            await self.__open.wait()
+        self.__active += 1
+        self.__idle.clear()
+
+    def leave(self):
+        self.__active -= 1
+        if self.__active == 0:
+            self.__idle.set()
+
+    async def hold(self, timeout: float) -> bool:
+        self.__open.clear()
+        try:
+            await asyncio.wait_for(self.__idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def resume(self):
+        self.__open.set()
+
+
+class _GatedAcquire:
+    def __init__(self, gate: PoolGate):
+        self.gate = gate
+        self.context = None
+
+    async def __aenter__(self) -> Connection:
+        started = time.perf_counter()
+        await self.gate.enter()
+        try:
+            self.context = self.gate.pool.acquire()
+            conn = await self.context.__aenter__()
+        except BaseException:
+            self.gate.leave()
+            raise
+        if self.gate.wait_observer is not None:
+            self.gate.wait_observer(time.perf_counter() - started)
+        return conn
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self.context.__aexit__(*exc_info)
+        finally:
+            self.gate.leave()
+
+
+class SlowQueryLog:
+    def __init__(self, config: dict):
+        self.enabled = config.get('enabled', True)
+        self.threshold = config.get('threshold_ms', 200) / 1000
+        # parameters carry password hashes and emails, so they are kept only on request
+        self.log_parameters = config.get('log_parameters', False)
+        self.max_parameter_length = config.get('max_parameter_length', 200)
+        self.total = 0
+        self.logger = logging.getLogger(__name__)
+        self.__entries: deque = deque(maxlen=config.get('max_entries', 100))
+
+    def record(self, query: str, args: tuple, seconds: float, error: Optional[BaseException] = None):
+        entry = {
+            "query": ' '.join(query.split()),
+            "parameters": [self.__format_parameter(arg) for arg in args] if self.log_parameters else None,
+            "duration_ms": round(seconds * 1000, 3),
+            "error": type(error).__name__ if error is not None else None,
+            "timestamp": datetime.now().isoformat(),
+        }
+        self.total += 1
+        self.__entries.append(entry)
+        # the log line never includes parameters, they stay in the admin-only entries
+        self.logger.warning(f"Slow query ({entry['duration_ms']} ms): {entry['query']}")
+
+    def get_all(self) -> List[dict]:
+        return list(reversed(self.__entries))
+
+    def clear(self):
+        self.__entries.clear()
+
+    def __format_parameter(self, value) -> str:
+        text = repr(value)
+        if len(text) > self.max_parameter_length:
+            return text[:self.max_parameter_length] + '...'
+        return text
+
+
+class _TimedConnection(Connection):
+    slow_query_log: Optional[SlowQueryLog] = None
+
+    async def execute(self, query: str, *args, **kwargs):
+        return await self.__timed(super().execute, query, args, kwargs)
+
+    async def executemany(self, command: str, args, **kwargs):
+        return await self.__timed(super().executemany, command, (args,), kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        return await self.__timed(super().fetch, query, args, kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await self.__timed(super().fetchrow, query, args, kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await self.__timed(super().fetchval, query, args, kwargs)
+
+    async def __timed(self, method, query: str, args: tuple, kwargs: dict):
+        log = self.slow_query_log
+        if log is None or not log.enabled:
+            return await method(query, *args, **kwargs)
+        started = time.perf_counter()
+        error = None
+        try:
+            return await method(query, *args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if elapsed >= log.threshold:
+                log.record(query, args, elapsed, error)
+
+
 class Database:
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: str, replica_dsns: Optional[List[str]] = None):
         with open(config_path, 'r') as config_file:
-            self.config = json.load(config_file)['database']
+            config = json.load(config_file)
+        self.config = config['database']
         self.pool = None
+        self.pool_wait_observer: Optional[Callable[[float], None]] = None
+        self.slow_queries = SlowQueryLog(config.get('slow_queries', {}))
+        replica_config = config.get('replicas', {})
+        self.replica_pool_size = replica_config.get('pool_max_size', 10)
+        self.replicas = ReplicaSet(
+            replica_config.get('dsns', []) if replica_dsns is None else replica_dsns,
+            replica_config,
+            self.__create_replica_pool
+        )
 
     async def create_connection_pool(self):
-        self.pool = await create_pool(
+        self.pool = PoolGate(await self.__create_pool())
+        self.pool.wait_observer = self.pool_wait_observer
+        await self.replicas.start(self.pool)
+
+    def acquire_read(self, user_id: Optional[int] = None):
+        # pass the user whose data is read, so reads right after their own writes stay consistent
+        return self.replicas.acquire(user_id)
+
+    async def record_write(self, conn: Connection, user_id: int):
+        await self.replicas.record_write(conn, user_id)
+
+    async def __create_pool(self):
+        return await create_pool(
             user=self.config['user'],
             password=self.config['password'],
             database=self.config['dbname'],
             host=self.config['host'],
+            port=self.config['port'],
+            connection_class=_TimedConnection,
+            init=self.__init_connection
+        )
+
+    async def __create_replica_pool(self, dsn: str):
+        # no connections up front, so a replica that is down does not block startup
+        return await create_pool(
+            dsn,
+            min_size=0,
+            max_size=self.replica_pool_size,
+            connection_class=_TimedConnection,
+            init=self.__init_connection
+        )
+
+    async def __init_connection(self, conn: Connection):
+        conn.slow_query_log = self.slow_queries
+
+    async def create_connection(self, database: Optional[str] = None) -> Connection:
+        return await connect(
+            user=self.config['user'],
+            password=self.config['password'],
+            database=database or self.config['dbname'],
+            host=self.config['host'],
             port=self.config['port']
         )
 
+    async def create_maintenance_connection(self) -> Connection:
+        # CREATE/DROP/ALTER DATABASE cannot run while connected to the database they change
+        return await self.create_connection(self.config.get('maintenance_dbname', 'postgres'))
+
+    async def switchover(self, swap: Callable[[], Awaitable[None]], drain_timeout: float) -> bool:
+        # requests holding a connection finish first (up to drain_timeout), new ones wait at the
+        # gate; returns whether the drain completed in time
+        gate = self.pool
+        self.replicas.suspend()
+        drained = await gate.hold(drain_timeout)
+        try:
+            if drained:
+                await gate.pool.close()
+            else:
+                gate.pool.terminate()
+            try:
+                await swap()
+            finally:
+                gate.pool = await self.__create_pool()
+        finally:
+            gate.resume()
+            await self.replicas.resume()
+        return drained
+
     async def fetch_user_by_email(self, conn: Connection, email: str):
         return await conn.fetchrow(
             'SELECT * FROM get_user_by_email($1);', 
@@ -40,6 +271,13 @@ class Database:
             role_id
         )
 
+    async def update_password_hash(self, conn: Connection, user_id: int, hashed_password: str):
+        await conn.execute(
+            'SELECT update_password_hash($1, $2);',
+            user_id,
+            hashed_password
+        )
+
     async def add_action_log(self, conn: Connection, action_title: str, user_id: int):
         await conn.execute(
             'SELECT add_action_log($1, $2);',
@@ -47,11 +285,70 @@ class Database:
             user_id
         )
 
+    async def copy_action_logs(self, conn: Connection, records: List[tuple]):
+        await conn.copy_records_to_table(
+            'log',
+            records=records,
+            columns=['action_type', 'action_timestamp', 'user_id']
+        )
+
+    async def add_action_logs(self, conn: Connection, records: List[tuple]):
+        titles, timestamps, user_ids = zip(*records)
+        await conn.execute(
+            'SELECT add_action_logs($1, $2, $3);',
+            list(titles),
+            list(timestamps),
+            list(user_ids)
+        )
+
+    async def get_logs(self, conn: Connection, user_id: Optional[int] = None, action_type: Optional[str] = None,
+                       from_timestamp: Optional[datetime] = None, until_timestamp: Optional[datetime] = None,
+                       limit: int = 100, before_timestamp: Optional[datetime] = None, before_id: Optional[int] = None):
+        return await conn.fetch(
+            'SELECT * FROM get_logs($1, $2, $3, $4, $5, $6, $7);',
+            user_id,
+            action_type,
+            from_timestamp,
+            until_timestamp,
+            limit,
+            before_timestamp,
+            before_id
+        )
+
+    async def ensure_log_partitions(self, conn: Connection, months_ahead: int) -> int:
+        return await conn.fetchval(
+            'SELECT ensure_log_partitions($1);',
+            months_ahead
+        )
+
+    async def drop_expired_log_partitions(self, conn: Connection, retention_months: int, detach_only: bool):
+        return await conn.fetch(
+            'SELECT * FROM drop_expired_log_partitions($1, $2);',
+            retention_months,
+            detach_only
+        )
+
     async def fetch_cars(self, conn: Connection):
         return await conn.fetch(
             'SELECT * FROM get_cars();'
         )
 
+    async def fetch_cars_page(self, conn: Connection, min_price: Optional[Decimal] = None,
+                              max_price: Optional[Decimal] = None, sort_key: str = 'id', sort_desc: bool = False,
+                              limit: int = 20, after_value: Optional[str] = None, after_id: Optional[int] = None,
+                              with_description: bool = True):
+        return await conn.fetch(
+            'SELECT * FROM get_cars_page($1, $2, $3, $4, $5, $6, $7, $8);',
+            min_price,
+            max_price,
+            sort_key,
+            sort_desc,
+            limit,
+            after_value,
+            after_id,
+            with_description
+        )
+
     async def fetch_car_by_id(self, conn: Connection, car_id: int):
         return await conn.fetchrow(
             'SELECT * FROM get_car_by_id($1);',
@@ -66,10 +363,17 @@ class Database:
             price
         )
 
-    async def fetch_orders_by_user(self, conn: Connection, user_id: int):
+    async def fetch_orders_by_user(self, conn: Connection, user_id: int, from_date: Optional[date] = None,
+                                   to_date: Optional[date] = None, limit: Optional[int] = None,
+                                   before_date: Optional[date] = None, before_id: Optional[int] = None):
         return await conn.fetch(
-            'SELECT * FROM get_orders_by_user($1);',
-            user_id
+            'SELECT * FROM get_orders_by_user($1, $2, $3, $4, $5, $6);',
+            user_id,
+            from_date,
+            to_date,
+            limit,
+            before_date,
+            before_id
         )
 
     async def create_order(self, conn: Connection, username: str, car_name: str, shipment_method_name: str):
@@ -80,6 +384,16 @@ class Database:
             shipment_method_name
         )
 
+    async def checkout(self, conn: Connection, user_id: int, product_ids: List[int], shipment_method_id: int,
+                       idempotency_key: Optional[str] = None):
+        return await conn.fetch(
+            'SELECT * FROM checkout($1, $2, $3, $4);',
+            user_id,
+            product_ids,
+            shipment_method_id,
+            idempotency_key
+        )
+
     async def create_backup(self, conn: Connection):
         await conn.execute(
             'CALL create_backup();'
@@ -91,9 +405,52 @@ class Database:
             backup_file
         )
 
-    async def search_cars(self, conn: Connection, name: Optional[str] = None):
-        query = 'SELECT * FROM search_cars($1);'
-        return await conn.fetch(query, name)
+    async def create_database(self, conn: Connection, database: str):
+        await conn.execute(f'CREATE DATABASE {quote_ident(database)} TEMPLATE template0')
+
+    async def drop_database(self, conn: Connection, database: str):
+        await conn.execute(f'DROP DATABASE IF EXISTS {quote_ident(database)}')
+
+    async def swap_databases(self, conn: Connection, live: str, replacement: str, retired: str):
+        # nobody can reconnect between terminating the sessions and the rename
+        await conn.execute(f'ALTER DATABASE {quote_ident(live)} WITH ALLOW_CONNECTIONS false')
+        try:
+            await conn.execute(
+                'SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+                'WHERE datname = $1 AND pid <> pg_backend_pid()',
+                live
+            )
+            async with conn.transaction():
+                await conn.execute(f'ALTER DATABASE {quote_ident(live)} RENAME TO {quote_ident(retired)}')
+                await conn.execute(f'ALTER DATABASE {quote_ident(replacement)} RENAME TO {quote_ident(live)}')
+        except BaseException:
+            await conn.execute(f'ALTER DATABASE {quote_ident(live)} WITH ALLOW_CONNECTIONS true')
+            raise
+
+    async def get_table_overview(self, conn: Connection, count_rows: bool = True) -> Dict[str, dict]:
+        # plain catalog queries: a restored database may predate the stored functions
+        tables = await conn.fetch(
+            """
+            SELECT c.relname AS table_name, array_agg(a.attname::text ORDER BY a.attnum) AS column_names
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+            WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+            GROUP BY c.relname
+            """
+        )
+        overview = {}
+        for table in tables:
+            rows = None
+            if count_rows:
+                rows = await conn.fetchval(f'SELECT count(*) FROM {quote_ident(table["table_name"])}')
+            overview[table['table_name']] = {'columns': list(table['column_names']), 'rows': rows}
+        return overview
+
+    async def search_cars(self, conn: Connection, name: Optional[str] = None, limit: int = 20,
+                          after_rank: Optional[float] = None, after_id: Optional[int] = None):
+        query = 'SELECT * FROM search_cars($1, $2, $3, $4);'
+        return await conn.fetch(query, name, limit, after_rank, after_id)
     
     async def get_tables(self, conn: Connection):
         return await conn.fetch(
@@ -106,12 +463,136 @@ class Database:
             table_name
         )
     
-    async def get_full_table(self, conn: Connection, table_name: str):
+    async def get_schema_catalog(self, conn: Connection):
         return await conn.fetch(
-            'SELECT * FROM get_full_table($1);',
+            'SELECT * FROM get_schema_catalog();'
+        )
+
+    async def get_full_table(self, conn: Connection, table_name: str, after_id: Optional[int] = None,
+                             limit: Optional[int] = None):
+        return await conn.fetch(
+            'SELECT * FROM get_full_table($1, $2, $3);',
+            table_name,
+            after_id,
+            limit
+        )
+
+    async def get_full_table_json(self, conn: Connection, table_name: str, after_id: Optional[int] = None,
+                                  limit: Optional[int] = None):
+        return await conn.fetchrow(
+            'SELECT * FROM get_full_table_json($1, $2, $3);',
+            table_name,
+            after_id,
+            limit
+        )
+
+    async def get_table_primary_key(self, conn: Connection, table_name: str) -> Optional[str]:
+        return await conn.fetchval(
+            'SELECT get_table_primary_key($1);',
             table_name
         )
+
+    async def stream_full_table(self, conn: Connection, table_name: str, primary_key: Optional[str],
+                                after_id: Optional[int] = None, prefetch: int = 1000):
+        # server-side cursor: only `prefetch` rows are held in memory at a time
+        query = f'SELECT row_to_json(t)::text AS result FROM {quote_ident(table_name)} t'
+        args = []
+        # tables without a primary key (views) are streamed unordered and cannot be resumed
+        if primary_key is not None:
+            primary_key = quote_ident(primary_key)
+            if after_id is not None:
+                query += f' WHERE t.{primary_key} > $1'
+                args.append(after_id)
+            query += f' ORDER BY t.{primary_key}'
+        async with conn.transaction(readonly=True):
+            async for record in conn.cursor(query, *args, prefetch=prefetch):
+                yield record['result']
     
+    async def copy_table_csv(self, conn: Connection, table_name: str, columns: Optional[List[str]], output):
+        # a query rather than the table itself: COPY cannot read a partitioned table (log) directly
+        selected = ', '.join(quote_ident(column) for column in columns) if columns else '*'
+        await conn.copy_from_query(
+            f'SELECT {selected} FROM {quote_ident(table_name)}',
+            output=output,
+            format='csv',
+            header=True
+        )
+
+    async def copy_table_ndjson(self, conn: Connection, table_name: str, columns: Optional[List[str]], output):
+        selected = ', '.join(quote_ident(column) for column in columns) if columns else '*'
+        # csv with control-character quote/delimiter passes row_to_json output through unescaped
+        await conn.copy_from_query(
+            f'SELECT row_to_json(t) FROM (SELECT {selected} FROM {quote_ident(table_name)}) t',
+            output=output,
+            format='csv',
+            quote='\x01',
+            delimiter='\x02'
+        )
+
+    async def create_import_stage(self, conn: Connection, table_name: str, stage_name: str, columns: List[str]):
+        selected = ', '.join(quote_ident(column) for column in columns)
+        await conn.execute(
+            f'CREATE TEMP TABLE {quote_ident(stage_name)} ON COMMIT DROP AS '
+            f'SELECT {selected} FROM {quote_ident(table_name)} WITH NO DATA'
+        )
+
+    async def merge_import_stage(self, conn: Connection, table_name: str, stage_name: str, columns: List[str],
+                                 conflict_key: List[str], primary_key: List[str]) -> int:
+        # conflict_key is the primary key or a natural key with a unique index, so a re-imported
+        # file updates its rows instead of adding them again
+        table, stage = quote_ident(table_name), quote_ident(stage_name)
+        selected = ', '.join(quote_ident(column) for column in columns)
+        key = ', '.join(quote_ident(column) for column in conflict_key)
+        updates = ', '.join(
+            f'{quote_ident(column)} = EXCLUDED.{quote_ident(column)}'
+            for column in columns if column not in conflict_key and column not in primary_key
+        )
+        conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        # the last occurrence of a key in the file wins
+        status = await conn.execute(
+            f'INSERT INTO {table} ({selected}) OVERRIDING SYSTEM VALUE '
+            f'SELECT DISTINCT ON ({key}) {selected} FROM {stage} ORDER BY {key}, ctid DESC '
+            f'ON CONFLICT ({key}) {conflict}'
+        )
+        if primary_key and set(primary_key) <= set(columns):
+            await conn.execute(
+                f"SELECT setval(pg_get_serial_sequence($1, $2), (SELECT max({quote_ident(primary_key[0])}) FROM {table}))",
+                table_name,
+                primary_key[0]
+            )
+        return int(status.split()[-1])
+
+    async def get_backup_tables(self, conn: Connection):
+        return await conn.fetch(
+            'SELECT * FROM get_backup_tables();'
+        )
+
+    async def copy_table_rows(self, conn: Connection, table_name: str, columns: List[str], output):
+        # a query rather than the table itself: COPY cannot read a partitioned table directly
+        selected = ', '.join(quote_ident(column) for column in columns)
+        await conn.copy_from_query(
+            f'SELECT {selected} FROM {quote_ident(table_name)}',
+            output=output
+        )
+
+    async def restore_table_rows(self, conn: Connection, table_name: str, columns: List[str], source):
+        await conn.copy_to_table(
+            table_name,
+            source=source,
+            columns=columns
+        )
+
+    async def truncate_tables(self, conn: Connection, table_names: List[str]):
+        await conn.execute(
+            'TRUNCATE ' + ', '.join(quote_ident(table_name) for table_name in table_names)
+        )
+
+    async def reset_table_sequences(self, conn: Connection, table_name: str):
+        await conn.execute(
+            'SELECT reset_table_sequences($1);',
+            table_name
+        )
+
     async def update_value(self, conn: Connection, table_name: str, column_name: str, new_value: str, id: int):
         await conn.execute(
             'SELECT update_value($1, $2, $3, $4);',
@@ -140,3 +621,53 @@ class Database:
         return await conn.fetch(
             'SELECT * FROM order_summary;'
         )
+
+    async def get_sales_series(self, conn: Connection, from_date: date, to_date: date, bucket: str = 'day',
+                               shipment_method_id: Optional[int] = None):
+        return await conn.fetch(
+            'SELECT * FROM get_sales_series($1, $2, $3, $4);',
+            from_date,
+            to_date,
+            bucket,
+            shipment_method_id
+        )
+
+    async def get_top_products(self, conn: Connection, from_date: date, to_date: date, limit: int = 10,
+                               order_by: str = 'revenue'):
+        return await conn.fetch(
+            'SELECT * FROM get_top_products($1, $2, $3, $4);',
+            from_date,
+            to_date,
+            limit,
+            order_by
+        )
+
+    async def get_shipment_breakdown(self, conn: Connection, from_date: date, to_date: date):
+        return await conn.fetch(
+            'SELECT * FROM get_shipment_breakdown($1, $2);',
+            from_date,
+            to_date
+        )
+
+    async def rebuild_sales_rollups(self, conn: Connection):
+        await conn.execute(
+            'SELECT rebuild_sales_rollups();'
+        )
+
+    async def get_statement_stats(self, conn: Connection, limit: int = 20, order_by: str = 'total_time'):
+        try:
+            return await conn.fetch(
+                'SELECT * FROM get_statement_stats($1, $2);',
+                limit,
+                order_by
+            )
+        except STATEMENT_STATS_ERRORS:
+            raise RuntimeError("pg_stat_statements is not available.")
+
+    async def reset_statement_stats(self, conn: Connection):
+        try:
+            await conn.execute(
+                'SELECT pg_stat_statements_reset();'
+            )
+        except STATEMENT_STATS_ERRORS:
+            raise RuntimeError("pg_stat_statements is not available.")
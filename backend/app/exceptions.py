@@ -107,5 +107,125 @@ class NonUniqueBackupNameHTTP(HTTPException):
             detail="Backup with this name already exists."
         )
     
+    def __str__(self):
+        return self.detail
+
+class ServiceBusyHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is busy, try again later."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class InvalidCursorHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class ImportRejectedHTTP(HTTPException):
+    def __init__(self, detail: str = "Import rejected."):
+        super().__init__(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=detail
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class BackupBusyHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Backup is in use by a running job."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class InvalidBackupNameHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Backup name must stay inside the backup directory."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class BackupJobNotFoundHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Backup job not found."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class CheckoutItemNotFoundHTTP(HTTPException):
+    def __init__(self, detail: str = "Checkout item not found."):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=detail
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class IdempotencyKeyReusedHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency key was already used for a different checkout."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class InvalidDateRangeHTTP(HTTPException):
+    def __init__(self, detail: str = "Invalid date range."):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=detail
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class ProfileNotFoundHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class StatementStatsUnavailableHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="pg_stat_statements is not available."
+        )
+    
+    def __str__(self):
+        return self.detail
+
+class TablePagingUnsupportedHTTP(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Table has no integer primary key: after_id and limit are not supported."
+        )
+    
     def __str__(self):
         return self.detail
\ No newline at end of file
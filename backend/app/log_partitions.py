@@ -0,0 +1,46 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from database import Database
+
+
+class LogPartitionManager:
+    def __init__(self, db: Database, config_path: str):
+        with open(config_path, 'r') as config_file:
+            config = json.load(config_file).get('log_partitions', {})
+        self.db = db
+        self.months_ahead = config.get('months_ahead', 3)
+        self.retention_months = config.get('retention_months', 12)
+        self.detach_only = config.get('detach_only', False)
+        self.check_interval = config.get('check_interval_hours', 24) * 3600
+        self.logger = logging.getLogger(__name__)
+        self.__task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.maintain()
+        self.__task = asyncio.ensure_future(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def maintain(self):
+        async with self.db.pool.acquire() as conn:
+            created = await self.db.ensure_log_partitions(conn, self.months_ahead)
+            expired = await self.db.drop_expired_log_partitions(conn, self.retention_months, self.detach_only)
+        if created or expired:
+            action = 'detached' if self.detach_only else 'dropped'
+            self.logger.info(
+                f"Log partitions: {created} created, {action} {[record[0] for record in expired]}"
+            )
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                self.logger.error(f"Log partition maintenance failed: {e}")
@@ -1,29 +1,96 @@
+import asyncio
+import json
 import logging
+import queue
 from datetime import datetime
-from typing import Optional
-from asyncpg import Connection, exceptions
-from database import Database 
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional, Tuple
+from asyncpg import exceptions
+from database import Database
+
+LogRecord = Tuple[str, datetime, Optional[int]]
+
+OVERFLOW_POLICIES = ('drop', 'block', 'spill')
+
 
 class DatabaseLogger:
-    def __init__(self, db: Database):
-        self.db = db  
+    def __init__(self, db: Database, config_path: Optional[str] = None):
+        config = {}
+        if config_path is not None:
+            with open(config_path, 'r') as config_file:
+                config = json.load(config_file).get('logging', {})
+        self.db = db
+        self.queue_size = config.get('queue_size', 10000)
+        self.batch_size = config.get('batch_size', 500)
+        self.flush_interval = config.get('flush_interval_seconds', 1.0)
+        self.overflow_policy = config.get('overflow_policy', 'drop')
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown log overflow policy: {self.overflow_policy}")
+        self.dropped = 0
+        self.spilled = 0
+        self.flushed = 0
+
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
 
-        handler = logging.FileHandler('app.log') 
+        # the file is written by the listener thread, never on the event loop
+        handler = logging.FileHandler(config.get('file', 'app.log'))
         handler.setLevel(logging.DEBUG)
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        records_queue = queue.SimpleQueue()
+        self.__file_handler = handler
+        self.__queue_handler = QueueHandler(records_queue)
+        self.logger.addHandler(self.__queue_handler)
+        self.__listener = QueueListener(records_queue, handler, respect_handler_level=True)
 
-    async def log_to_db(self, action_title: str, user_id: Optional[int] = None):
-        try:
-            async with self.db.pool.acquire() as conn:
-                await self.db.add_action_log(conn, action_title, user_id)
-                self.logger.info(f"Logged action: {action_title} for user_id: {user_id}")
-        except exceptions.PostgresError as e:
-            self.logger.error(f"Failed to log to database: {e}")
+        self.__queue: Optional[asyncio.Queue] = None
+        self.__wakeup: Optional[asyncio.Event] = None
+        self.__needed = self.batch_size
+        self.__flusher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.__listener.start()
+        self.__queue = asyncio.Queue(maxsize=self.queue_size)
+        self.__wakeup = asyncio.Event()
+        self.__flusher = asyncio.ensure_future(self.__run())
 
+    async def stop(self):
+        if self.__flusher is not None:
+            # the sentinel is queued behind pending records, so they are flushed first
+            await self.__queue.put(None)
+            self.__wakeup.set()
+            await self.__flusher
+            self.__flusher = None
+            # records that arrived behind the sentinel, and any logged from now on, go to the file
+            leftover = []
+            while not self.__queue.empty():
+                leftover.append(self.__queue.get_nowait())
+            self.__queue = None
+            self.__spill(leftover)
+        self.__listener.stop()
+        # with the listener thread gone, write to the file directly
+        self.logger.removeHandler(self.__queue_handler)
+        self.logger.addHandler(self.__file_handler)
+
+    async def log_to_db(self, action_title: str, user_id: Optional[int] = None):
+        record = (action_title, datetime.now(), user_id if user_id is not None and user_id > 0 else None)
+        if self.__queue is None:
+            self.__spill([record])
+            return
+        if self.overflow_policy == 'block':
+            await self.__queue.put(record)
+        else:
+            try:
+                self.__queue.put_nowait(record)
+            except asyncio.QueueFull:
+                if self.overflow_policy == 'spill':
+                    self.__spill([record])
+                else:
+                    self.dropped += 1
+                return
+        if self.__queue.qsize() >= self.__needed:
+            self.__wakeup.set()
 
     def log_to_file(self, action_title: str, user_id: Optional[int] = None):
         self.logger.info(f"Action: {action_title}, User ID: {user_id}")
@@ -32,3 +99,61 @@ class DatabaseLogger:
         if to_db:
             await self.log_to_db(action_title, user_id)
         self.log_to_file(action_title, user_id)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.__queue.qsize() if self.__queue is not None else 0,
+            "queue_size": self.queue_size,
+            "overflow_policy": self.overflow_policy,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+        }
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        running = True
+        while running:
+            record = await self.__queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.__queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    self.__needed = self.batch_size - len(batch)
+                    self.__wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.__wakeup.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    continue
+                if record is None:
+                    running = False
+                    break
+                batch.append(record)
+            self.__needed = self.batch_size
+            await self.__flush(batch)
+
+    async def __flush(self, batch: List[LogRecord]):
+        try:
+            async with self.db.pool.acquire() as conn:
+                try:
+                    await self.db.copy_action_logs(conn, batch)
+                except exceptions.ForeignKeyViolationError:
+                    # one record points to a deleted user; keep the batch, unlinking that record
+                    await self.db.add_action_logs(conn, batch)
+            self.flushed += len(batch)
+        except Exception as e:
+            self.logger.error(f"Failed to log {len(batch)} actions to database: {e}")
+            self.__spill(batch)
+
+    def __spill(self, batch: List[LogRecord]):
+        self.spilled += len(batch)
+        for action_title, timestamp, user_id in batch:
+            self.logger.warning(f"Unlogged action: {action_title}, User ID: {user_id}, At: {timestamp.isoformat()}")
@@ -0,0 +1,196 @@
+import functools
+import inspect
+import json
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.__values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labels, value in self.__values.items():
+            lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (last one is +Inf)..., sum]
+        self.__series: Dict[Labels, List[float]] = {}
+
+    def observe(self, labels: Labels, value: float):
+        series = self.__series.get(labels)
+        if series is None:
+            series = self.__series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        for labels, series in self.__series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                label_text = _format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{label_text} {cumulative}')
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class CallbackMetric:
+    def __init__(self, name: str, documentation: str, metric_type: str, callback: Callable[[], Iterable[Sample]]):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for labels, value in self.callback():
+            lines.append(f'{self.name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, config_path: Optional[str] = None):
+        config = {}
+        if config_path is not None:
+            with open(config_path, 'r') as config_file:
+                config = json.load(config_file).get('metrics', {})
+        self.enabled = config.get('enabled', True)
+        self.scrape_token = config.get('scrape_token')
+        self.buckets = tuple(config.get('buckets', DEFAULT_BUCKETS))
+        self.__metrics = []
+        self.request_duration = self.register(Histogram(
+            'http_request_duration_seconds', 'HTTP request latency by route template, method and status.',
+            ('route', 'method', 'status'), self.buckets
+        ))
+        self.query_duration = self.register(Histogram(
+            'db_query_duration_seconds', 'Latency of Database methods.', ('method',), self.buckets
+        ))
+        self.query_errors = self.register(Counter(
+            'db_query_errors_total', 'Database method calls that raised, by exception type.', ('method', 'error')
+        ))
+        self.pool_acquire_wait = self.register(Histogram(
+            'db_pool_acquire_wait_seconds', 'Time spent waiting for a pooled connection.', (), self.buckets
+        ))
+
+    def register(self, metric):
+        self.__metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], Iterable[Sample]]):
+        return self.register(CallbackMetric(name, documentation, 'gauge', callback))
+
+    def counter(self, name: str, documentation: str, callback: Callable[[], Iterable[Sample]]):
+        return self.register(CallbackMetric(name, documentation, 'counter', callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.__metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+    def instrument(self, target, exclude: Iterable[str] = ()):
+        excluded = set(exclude)
+        for name, method in inspect.getmembers(target, inspect.iscoroutinefunction):
+            if name.startswith('_') or name in excluded:
+                continue
+            setattr(target, name, self.__timed(name, method))
+
+    def __timed(self, name: str, method):
+        labels = (name,)
+        observe = self.query_duration.observe
+        count_error = self.query_errors.inc
+
+        @functools.wraps(method)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except Exception as e:
+                count_error((name, type(e).__name__))
+                raise
+            finally:
+                observe(labels, time.perf_counter() - started)
+        return timed
+
+
+# timed until the last body chunk, so streamed responses count in full
+class MetricsMiddleware:
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+        self.__route_paths: Optional[Dict[Callable, str]] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = ['500']
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = str(message['status'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.registry.request_duration.observe(
+                (self.__route(scope), scope['method'], status[0]),
+                time.perf_counter() - started
+            )
+
+    def __route(self, scope) -> str:
+        # label by route template rather than raw path, so ids in paths do not multiply the series
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if self.__route_paths is None:
+            self.__route_paths = {
+                route.endpoint: route.path
+                for route in scope['app'].routes if hasattr(route, 'endpoint')
+            }
+        return self.__route_paths.get(endpoint, 'unmatched')
@@ -1,5 +1,5 @@
-from typing import Optional, List
-from pydantic import BaseModel
+from typing import Optional, List, Literal
+from pydantic import BaseModel, conlist, confloat, constr
 from datetime import datetime, date
 from decimal import Decimal
 
@@ -16,6 +16,16 @@ class Product(BaseModel):
     price: Decimal
     photo_url: str
 
+class ProductSummary(BaseModel):
+    product_id: int
+    product_name: str
+    price: Decimal
+    photo_url: str
+
+class ProductSuggestion(BaseModel):
+    product_id: int
+    product_name: str
+
 # Модель для таблицы role
 class Role(BaseModel):
     role_id: int
@@ -52,11 +62,28 @@ class PurchaseOrderMain(BaseModel):
     shipment_method_name: str
 
 class PurchaseOrderOut(BaseModel):
+    order_id: Optional[int] = None
     order_date: date
     car_name: str
     total_amount: Decimal  
     shipment_method: str
 
+class CheckoutIn(BaseModel):
+    product_ids: conlist(int, min_items=1, max_items=100)
+    shipment_method_id: int
+
+class CheckoutItem(BaseModel):
+    order_id: int
+    product_id: int
+    product_name: str
+    price: Decimal
+    order_date: date
+
+class CheckoutOut(BaseModel):
+    orders: List[CheckoutItem]
+    total_amount: Decimal
+    replayed: bool
+
 # Модель для таблицы log_table
 class LogTable(BaseModel):
     log_id: int
@@ -79,5 +106,35 @@ class InsertRowData(BaseModel):
     columns: List[str]
     values: List[str]
 
+class BatchOperation(BaseModel):
+    op: Literal['update', 'delete', 'insert']
+    table_name: str
+    id: Optional[int]
+    column_name: Optional[str]
+    new_value: Optional[str]
+    columns: Optional[List[str]]
+    values: Optional[List[str]]
+
+class BatchData(BaseModel):
+    operations: conlist(BatchOperation, min_items=1, max_items=5000)
+    atomic: bool = True
+
+class BatchOperationResult(BaseModel):
+    index: int
+    status: Literal['ok', 'error', 'rolled_back', 'skipped']
+    detail: Optional[str]
+
+class BatchResult(BaseModel):
+    committed: bool
+    results: List[BatchOperationResult]
+
+# имя становится именем файла в каталоге бэкапов: без разделителей пути и без "." / ".."
+BACKUP_NAME_PATTERN = r'^(?!\.+$)[A-Za-z0-9_.-]+$'
+
 class BackupIn(BaseModel):
-    backup_name: str
+    backup_name: constr(regex=BACKUP_NAME_PATTERN, max_length=200)
+    backup_format: Literal['custom', 'directory'] = 'custom'
+
+class ProfilingSettingsIn(BaseModel):
+    sample_rate: confloat(ge=0, le=1) = 0.0
+    path_prefix: Optional[str]
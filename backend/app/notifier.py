@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Union
+
+from asyncpg import Connection
+
+from database import Database
+
+Callback = Callable[[str], Union[None, Awaitable[None]]]
+
+
+class DatabaseNotifier:
+    def __init__(self, db: Database, reconnect_delay: float = 1.0):
+        self.db = db
+        self.reconnect_delay = reconnect_delay
+        self.logger = logging.getLogger(__name__)
+        self.__conn: Connection = None
+        self.__channels: Dict[str, List[Callback]] = {}
+        self.__reset_callbacks: List[Callable[[], None]] = []
+        self.__reconnect_task: asyncio.Task = None
+        self.__closed = False
+
+    def subscribe(self, channel: str, callback: Callback):
+        self.__channels.setdefault(channel, []).append(callback)
+
+    def on_reset(self, callback: Callable[[], None]):
+        self.__reset_callbacks.append(callback)
+
+    def reset(self):
+        # for changes made with triggers disabled, which send no notifications
+        self.__reset()
+
+    async def start(self):
+        self.__closed = False
+        await self.__connect()
+
+    async def stop(self):
+        self.__closed = True
+        if self.__reconnect_task is not None:
+            self.__reconnect_task.cancel()
+        if self.__conn is not None and not self.__conn.is_closed():
+            await self.__conn.close()
+        self.__conn = None
+
+    async def __connect(self):
+        self.__conn = await self.db.create_connection()
+        self.__conn.add_termination_listener(self.__on_termination)
+        for channel in self.__channels:
+            await self.__conn.add_listener(channel, self.__dispatch)
+
+    def __dispatch(self, conn: Connection, pid: int, channel: str, payload: str):
+        for callback in self.__channels.get(channel, []):
+            try:
+                result = callback(payload)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception as e:
+                self.logger.error(f"Notification handler for {channel} failed: {e}")
+
+    def __on_termination(self, conn: Connection):
+        if self.__closed:
+            return
+        # notifications sent while we were disconnected are lost
+        self.__reset()
+        self.__reconnect_task = asyncio.ensure_future(self.__reconnect())
+
+    def __reset(self):
+        for callback in self.__reset_callbacks:
+            callback()
+
+    async def __reconnect(self):
+        while not self.__closed:
+            try:
+                await self.__connect()
+                self.__reset()
+                return
+            except Exception as e:
+                self.logger.error(f"Notification listener reconnect failed: {e}")
+                await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,26 @@
+from typing import List, Optional, Tuple
+
+from asyncpg import exceptions
+
+from database import Database
+
+
+class OrderService:
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def checkout(self, user_id: int, product_ids: List[int], shipment_method_id: int,
+                       idempotency_key: Optional[str] = None) -> Tuple[list, bool]:
+        async with self.db.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    rows = await self.db.checkout(conn, user_id, product_ids, shipment_method_id, idempotency_key)
+                await self.db.record_write(conn, user_id)
+            except exceptions.NoDataFoundError as e:
+                raise LookupError(e.message)
+            except exceptions.UniqueViolationError as e:
+                raise ValueError(e.message)
+            except exceptions.PostgresError:
+                raise RuntimeError("An unexpected error occurred.")
+        replayed = bool(rows) and rows[0]['replayed']
+        return rows, replayed
@@ -0,0 +1,101 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+from passlib.context import CryptContext
+
+_contexts: Dict[int, CryptContext] = {}
+
+
+def _get_context(rounds: int) -> CryptContext:
+    context = _contexts.get(rounds)
+    if context is None:
+        context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        _contexts[rounds] = context
+    return context
+
+
+def _hash(password: str, rounds: int) -> str:
+    return _get_context(rounds).hash(password)
+
+
+def _verify(password: str, hashed_password: str, rounds: int) -> Tuple[bool, bool]:
+    context = _get_context(rounds)
+    if not context.verify(password, hashed_password):
+        return False, False
+    return True, context.needs_update(hashed_password)
+
+
+class HasherBusyError(RuntimeError):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, workers: int = 2, max_queue: int = 64):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+        self.__latency = {
+            "hash": {"count": 0, "total": 0.0, "max": 0.0},
+            "verify": {"count": 0, "total": 0.0, "max": 0.0},
+        }
+        self.__executor: ProcessPoolExecutor = None
+
+    def start(self):
+        self.__executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+            self.__executor = None
+
+    async def hash(self, password: str) -> str:
+        return await self.__submit("hash", _hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, bool]:
+        return await self.__submit("verify", _verify, password, hashed_password, self.rounds)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "queue_depth": self.pending,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "latency": {
+                operation: {
+                    "count": data["count"],
+                    "avg_seconds": data["total"] / data["count"] if data["count"] else 0.0,
+                    "max_seconds": data["max"],
+                }
+                for operation, data in self.__latency.items()
+            },
+        }
+
+    async def __submit(self, operation: str, fn, *args):
+        if self.__executor is None:
+            raise RuntimeError("Password hasher is not started.")
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            raise HasherBusyError("Too many password operations in progress.")
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.__record(operation, time.perf_counter() - started)
+
+    def __record(self, operation: str, elapsed: float):
+        data = self.__latency[operation]
+        data["count"] += 1
+        data["total"] += elapsed
+        data["max"] = max(data["max"], elapsed)
@@ -1,4 +1,6 @@
-from models import User, Token, Product, PurchaseOrderMain, LogTable, PurchaseOrderOut
+from decimal import Decimal
+
+from models import User, Token, Product, ProductSummary, PurchaseOrderMain, LogTable, PurchaseOrderOut, CheckoutItem, CheckoutOut
 
 def prepare_token(token: str):
     return Token(
@@ -38,9 +40,21 @@ def prepare_products(products: list[dict]) -> list[Product]:
         for product in products
     ]
 
+def prepare_product_summaries(products: list[dict]) -> list[ProductSummary]:
+    return [
+        ProductSummary(
+            product_id=product['car_id'],
+            product_name=product['car_name'],
+            price=product['price'],
+            photo_url=product['photo_url']
+        )
+        for product in products
+    ]
+
 def prepare_orders(orders):
     return [
         PurchaseOrderOut(
+            order_id = order['order_id'],
             order_date = order['order_date'],
             car_name = order['car_name'],
             total_amount = order['total_amount'],
@@ -49,6 +63,23 @@ def prepare_orders(orders):
         for order in orders
     ]
 
+def prepare_checkout(rows, replayed: bool):
+    items = [
+        CheckoutItem(
+            order_id = row['order_id'],
+            product_id = row['product_id'],
+            product_name = row['product_name'],
+            price = row['price'],
+            order_date = row['order_date']
+        )
+        for row in rows
+    ]
+    return CheckoutOut(
+        orders = items,
+        total_amount = sum((item.price for item in items), Decimal(0)),
+        replayed = replayed
+    )
+
 def prepare_purchase_order(purchase_order: dict):
     return PurchaseOrderMain(
         order_id=purchase_order['order_id'],
@@ -63,5 +94,6 @@ def prepare_log(log: dict):
     return LogTable(
         log_id=log['log_id'],
         action_type=log['action_type'],
-        action_timestamp=log['action_timestamp']
+        action_timestamp=log['action_timestamp'],
+        user_id=log['user_id']
     )
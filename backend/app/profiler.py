@@ -0,0 +1,246 @@
+import asyncio
+import cProfile
+import json
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+PROFILE_HEADER = b'x-profile'
+PROFILE_ID_HEADER = b'x-profile-id'
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+    return label.replace(';', ',')
+
+
+def _await_chain(coro) -> List[str]:
+    labels = []
+    current = coro
+    while current is not None:
+        if isinstance(current, _ProfiledCoroutine):
+            current = current.coro
+            continue
+        frame = getattr(current, 'cr_frame', None) or getattr(current, 'gi_frame', None) \
+            or getattr(current, 'ag_frame', None)
+        if frame is None:
+            labels.append(f'<await {type(current).__name__}>')
+            break
+        labels.append(_frame_label(frame))
+        current = getattr(current, 'cr_await', None) or getattr(current, 'gi_yieldfrom', None) \
+            or getattr(current, 'ag_await', None)
+    return labels
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.status: Optional[int] = None
+        self.started_at = time.time()
+        self.wall_seconds = 0.0
+        self.loop_cpu_seconds = 0.0
+        self.samples: Dict[str, int] = {}
+        self.stats = b''
+        self.recording = False
+
+    def to_dict(self) -> dict:
+        return {
+            "profile_id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "status": self.status,
+            "started_at": self.started_at,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "loop_cpu_seconds": round(self.loop_cpu_seconds, 6),
+            "samples": sum(self.samples.values()),
+        }
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.items())
+
+
+# cProfile sees everything the loop thread runs, so it is only enabled while this request's own
+# coroutine runs a step; the time between steps belongs to other tasks and is left to the sampler
+class _ProfiledCoroutine:
+    def __init__(self, coro, profiler: cProfile.Profile):
+        self.coro = coro
+        self.profiler = profiler
+        self.cpu_seconds = 0.0
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        return self.__step(self.coro.send, value)
+
+    def throw(self, *args):
+        return self.__step(self.coro.throw, *args)
+
+    def close(self):
+        self.coro.close()
+
+    def __step(self, method, *args):
+        started = time.thread_time()
+        self.profiler.enable()
+        try:
+            return method(*args)
+        finally:
+            self.profiler.disable()
+            self.cpu_seconds += time.thread_time() - started
+
+
+# a running task is sampled from the loop thread's stack, a suspended one from its await
+# chain, so time spent waiting on asyncpg or the bcrypt pool shows up too
+class _StackSampler(threading.Thread):
+    def __init__(self, task: asyncio.Task, loop_thread_id: int, interval: float, samples: Dict[str, int]):
+        super().__init__(daemon=True)
+        self.task = task
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.samples = samples
+        self.stopped = threading.Event()
+
+    def run(self):
+        coro = self.task.get_coro()
+        while not self.stopped.wait(self.interval):
+            stack = self.__running_stack(coro)
+            if stack is None:
+                stack = _await_chain(coro)
+                stack[-1:] = [stack[-1] + ' [await]'] if stack else []
+            key = ';'.join(stack)
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def __running_stack(self, coro) -> Optional[List[str]]:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        task_frame = getattr(coro, 'cr_frame', None)
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            if frame is task_frame:
+                return [_frame_label(f) for f in reversed(frames)]
+            frame = frame.f_back
+        return None
+
+
+class RequestProfiler:
+    def __init__(self, config_path: Optional[str] = None):
+        config = {}
+        if config_path is not None:
+            with open(config_path, 'r') as config_file:
+                config = json.load(config_file).get('profiling', {})
+        self.sample_interval = config.get('sample_interval_ms', 5) / 1000
+        self.sample_rate = config.get('sample_rate', 0.0)
+        self.path_prefix: Optional[str] = config.get('path_prefix')
+        self.max_profiles = config.get('max_profiles', 20)
+        self.__profiles: deque = deque(maxlen=self.max_profiles)
+        self.__active = False
+
+    def configure(self, sample_rate: Optional[float] = None, path_prefix: Optional[str] = None):
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        self.path_prefix = path_prefix or None
+
+    def settings(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "path_prefix": self.path_prefix,
+            "sample_interval_ms": self.sample_interval * 1000,
+            "max_profiles": self.max_profiles,
+            "stored": len(self.__profiles),
+        }
+
+    def get_all_profiles(self) -> List[RequestProfile]:
+        return list(self.__profiles)
+
+    def get_profile(self, profile_id: str) -> RequestProfile:
+        for profile in self.__profiles:
+            if profile.id == profile_id:
+                return profile
+        raise LookupError(f"Profile {profile_id} does not exist.")
+
+    def clear(self):
+        self.__profiles.clear()
+
+    def should_sample(self, path: str) -> bool:
+        if self.sample_rate <= 0 or (self.path_prefix is not None and not path.startswith(self.path_prefix)):
+            return False
+        return random.random() < self.sample_rate
+
+    async def run(self, profile: RequestProfile, call: Callable[[], Awaitable[None]]):
+        # one request is profiled at a time to bound the overhead; others run unprofiled
+        if self.__active:
+            await call()
+            return
+        self.__active = profile.recording = True
+        sampler = _StackSampler(asyncio.current_task(), threading.get_ident(), self.sample_interval, profile.samples)
+        profiler = cProfile.Profile()
+        steps = _ProfiledCoroutine(call(), profiler)
+        wall_started = time.perf_counter()
+        sampler.start()
+        try:
+            await steps
+        finally:
+            sampler.stopped.set()
+            profile.wall_seconds = time.perf_counter() - wall_started
+            # cpu of this request's own steps on the loop thread, not of the tasks that ran in between
+            profile.loop_cpu_seconds = steps.cpu_seconds
+            self.__active = False
+            sampler.join()
+            profiler.create_stats()
+            # the same layout pstats.Stats.dump_stats writes, loadable with pstats.Stats(path)
+            profile.stats = marshal.dumps(profiler.stats)
+            self.__profiles.append(profile)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: RequestProfiler, is_admin: Callable[[str], Awaitable[bool]]):
+        self.app = app
+        self.profiler = profiler
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        reason = await self.__reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile(scope['method'], scope['path'], reason)
+
+        async def send_with_profile_id(message):
+            if message['type'] == 'http.response.start':
+                profile.status = message['status']
+                if profile.recording:
+                    message['headers'] = list(message.get('headers', [])) + [(PROFILE_ID_HEADER, profile.id.encode())]
+            await send(message)
+
+        await self.profiler.run(profile, lambda: self.app(scope, receive, send_with_profile_id))
+
+    async def __reason(self, scope) -> Optional[str]:
+        headers = dict(scope.get('headers', []))
+        if headers.get(PROFILE_HEADER) == b'1':
+            authorization = headers.get(b'authorization', b'').decode('latin-1')
+            if authorization.startswith('Bearer ') and await self.is_admin(authorization[7:]):
+                return 'header'
+            return None
+        if self.profiler.should_sample(scope['path']):
+            return 'sampled'
+        return None
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from asyncpg import Connection, connect, exceptions
+
+# the lsn as a byte position, so it can be compared in Python
+CURRENT_LSN_QUERY = "SELECT pg_current_wal_lsn() - '0/0'"
+
+# errors that mean the replica cannot serve right now; reads then go to the primary
+REPLICA_ERRORS = (OSError, asyncio.TimeoutError, exceptions.PostgresError, exceptions.InterfaceError)
+
+
+class Replica:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        address = urlsplit(dsn)
+        # host:port only, the dsn may carry a password
+        self.name = f"{address.hostname}:{address.port or 5432}"
+        self.pool = None
+        self.monitor: Optional[Connection] = None
+        self.healthy = False
+        self.replay_lsn = 0
+        self.lag_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.active = 0
+        self.reads = 0
+
+    def mark_down(self, error: BaseException):
+        self.healthy = False
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        return {
+            "replica": self.name,
+            "healthy": self.healthy,
+            "replay_lsn": self.replay_lsn,
+            "lag_seconds": self.lag_seconds,
+            "active": self.active,
+            "reads": self.reads,
+            "error": self.error,
+        }
+
+
+# read-your-writes: a user's reads only go to replicas that had replayed their last write
+class ReplicaSet:
+    def __init__(self, dsns: List[str], config: dict,
+                 create_pool: Callable[[str], Awaitable[object]]):
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.selection = config.get('selection', 'least_busy')
+        self.check_interval = config.get('check_interval_seconds', 2)
+        self.check_timeout = config.get('check_timeout_seconds', 2)
+        self.max_lag = config.get('max_lag_seconds', 5)
+        self.acquire_timeout = config.get('acquire_timeout_seconds', 1)
+        self.primary_reads = 0
+        self.logger = logging.getLogger(__name__)
+        self.__create_pool = create_pool
+        self.primary = None
+        self.__written: Dict[int, int] = {}
+        self.__required_lsn = 0
+        self.__suspended = False
+        self.__next = 0
+        self.__task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    async def start(self, primary):
+        self.primary = primary
+        if not self.enabled:
+            return
+        for replica in self.replicas:
+            replica.pool = await self.__create_pool(replica.dsn)
+        await self.check()
+        self.__task = asyncio.ensure_future(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        for replica in self.replicas:
+            if replica.monitor is not None:
+                replica.monitor.terminate()
+                replica.monitor = None
+            if replica.pool is not None:
+                await replica.pool.close()
+                replica.pool = None
+
+    def acquire(self, user_id: Optional[int] = None):
+        return _ReadAcquire(self, user_id)
+
+    def choose(self, user_id: Optional[int] = None) -> Optional[Replica]:
+        if self.__suspended:
+            return None
+        required_lsn = max(self.__required_lsn, self.__written.get(user_id, 0))
+        candidates = [
+            replica for replica in self.replicas
+            if replica.healthy and replica.pool is not None and replica.replay_lsn >= required_lsn
+        ]
+        if not candidates:
+            return None
+        if self.selection == 'round_robin':
+            self.__next = (self.__next + 1) % len(candidates)
+            return candidates[self.__next]
+        return min(candidates, key=lambda replica: replica.active)
+
+    async def record_write(self, conn: Connection, user_id: int):
+        # called on the primary connection after the write has committed
+        if not self.enabled:
+            return
+        lsn = int(await conn.fetchval(CURRENT_LSN_QUERY))
+        self.__written[user_id] = max(self.__written.get(user_id, 0), lsn)
+
+    def suspend(self):
+        self.__suspended = True
+
+    async def resume(self):
+        # pooled replica connections still point at the retired database after a swap
+        try:
+            if self.enabled:
+                async with self.primary.acquire() as conn:
+                    self.__required_lsn = int(await conn.fetchval(CURRENT_LSN_QUERY))
+                for replica in self.replicas:
+                    if replica.pool is not None:
+                        await replica.pool.expire_connections()
+        finally:
+            self.__suspended = False
+
+    async def check(self):
+        async with self.primary.acquire() as conn:
+            primary_lsn = int(await conn.fetchval(CURRENT_LSN_QUERY))
+        await asyncio.gather(*(self.__check_replica(replica, primary_lsn) for replica in self.replicas))
+        # a write no longer constrains routing once every replica has replayed it
+        replayed = min(replica.replay_lsn for replica in self.replicas)
+        self.__written = {user_id: lsn for user_id, lsn in self.__written.items() if lsn > replayed}
+
+    def stats(self) -> dict:
+        return {
+            "selection": self.selection,
+            "primary_reads": self.primary_reads,
+            "pending_writes": len(self.__written),
+            "replicas": [replica.to_dict() for replica in self.replicas],
+        }
+
+    async def __check_replica(self, replica: Replica, primary_lsn: int):
+        was_healthy = replica.healthy
+        try:
+            # a connection of its own, so the check does not wait behind busy pooled connections
+            if replica.monitor is None or replica.monitor.is_closed():
+                replica.monitor = await connect(replica.dsn, timeout=self.check_timeout)
+            status = await replica.monitor.fetchrow(
+                '''
+                SELECT pg_is_in_recovery() AS in_recovery,
+                       pg_last_wal_replay_lsn() - '0/0' AS replay_lsn,
+                       extract(epoch FROM now() - pg_last_xact_replay_timestamp()) AS lag_seconds
+                ''',
+                timeout=self.check_timeout
+            )
+        except REPLICA_ERRORS as e:
+            if replica.monitor is not None:
+                replica.monitor.terminate()
+                replica.monitor = None
+            replica.mark_down(e)
+        else:
+            if not status['in_recovery'] or status['replay_lsn'] is None:
+                # promoted or not a standby at all: its data no longer follows the primary
+                replica.mark_down(RuntimeError("Server is not in recovery."))
+            else:
+                replica.replay_lsn = int(status['replay_lsn'])
+                # the replay timestamp stands still while the primary is idle, so caught up means no lag
+                caught_up = replica.replay_lsn >= primary_lsn
+                replica.lag_seconds = 0.0 if caught_up else float(status['lag_seconds'] or 0)
+                replica.healthy = caught_up or replica.lag_seconds <= self.max_lag
+                replica.error = None if replica.healthy else f"Replica is {replica.lag_seconds:.1f}s behind."
+        if replica.healthy != was_healthy:
+            state = 'healthy' if replica.healthy else f'unhealthy ({replica.error})'
+            self.logger.warning(f"Replica {replica.name} is {state}")
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                self.logger.error(f"Replica health check failed: {e}")
+
+
+class _ReadAcquire:
+    def __init__(self, replicas: ReplicaSet, user_id: Optional[int]):
+        self.replicas = replicas
+        self.user_id = user_id
+        self.replica: Optional[Replica] = None
+        self.context = None
+
+    async def __aenter__(self) -> Connection:
+        replica = self.replicas.choose(self.user_id)
+        if replica is not None:
+            replica.active += 1
+            try:
+                self.context = replica.pool.acquire(timeout=self.replicas.acquire_timeout)
+                conn = await self.context.__aenter__()
+            except REPLICA_ERRORS as e:
+                replica.active -= 1
+                # a replica that refuses connections is out until the next check finds it back
+                if not isinstance(e, asyncio.TimeoutError):
+                    replica.mark_down(e)
+            else:
+                self.replica = replica
+                replica.reads += 1
+                return conn
+        self.replicas.primary_reads += 1
+        self.context = self.replicas.primary.acquire()
+        return await self.context.__aenter__()
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self.context.__aexit__(*exc_info)
+        finally:
+            if self.replica is not None:
+                self.replica.active -= 1
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from database import Database
+
+SCHEMA_CHANGES_CHANNEL = 'schema_changes'
+
+
+class SchemaCatalog:
+    def __init__(self, db: Database):
+        self.db = db
+        self.logger = logging.getLogger(__name__)
+        self.tables: Set[str] = set()
+        self.columns: Dict[str, List[str]] = {}
+        self.column_types: Dict[str, Dict[str, str]] = {}
+        self.nullable: Dict[str, Set[str]] = {}
+        self.primary_keys: Dict[str, List[str]] = {}
+        self.reloads = 0
+        self.__reload_task: Optional[asyncio.Task] = None
+        self.__dirty = False
+
+    async def load(self):
+        async with self.db.pool.acquire() as conn:
+            records = await self.db.get_schema_catalog(conn)
+        columns: Dict[str, List[str]] = {}
+        column_types: Dict[str, Dict[str, str]] = {}
+        nullable: Dict[str, Set[str]] = {}
+        primary_keys: Dict[str, List[str]] = {}
+        for record in records:
+            table_name, column_name = record['table_name'], record['column_name']
+            columns.setdefault(table_name, []).append(column_name)
+            column_types.setdefault(table_name, {})[column_name] = record['data_type']
+            table_nullable = nullable.setdefault(table_name, set())
+            table_primary_key = primary_keys.setdefault(table_name, [])
+            if record['is_nullable']:
+                table_nullable.add(column_name)
+            if record['is_primary_key']:
+                table_primary_key.append(column_name)
+        self.tables = set(columns)
+        self.columns, self.column_types = columns, column_types
+        self.nullable, self.primary_keys = nullable, primary_keys
+        self.reloads += 1
+
+    def has_table(self, table_name: str) -> bool:
+        return table_name in self.tables
+
+    def has_column(self, table_name: str, column_name: str) -> bool:
+        return column_name in self.column_types.get(table_name, {})
+
+    def get_columns(self, table_name: str) -> List[str]:
+        return self.columns.get(table_name, [])
+
+    def on_schema_changed(self, payload: str = None):
+        # DDL usually comes in bursts (migrations); one reload covers all of them
+        self.__dirty = True
+        if self.__reload_task is None or self.__reload_task.done():
+            self.__reload_task = asyncio.ensure_future(self.__reload())
+
+    async def __reload(self):
+        while self.__dirty:
+            self.__dirty = False
+            try:
+                await self.load()
+            except Exception as e:
+                self.logger.error(f"Schema catalog reload failed: {e}")
+                return
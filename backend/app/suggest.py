@@ -0,0 +1,121 @@
+import asyncio
+import bisect
+import json
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+from database import Database
+
+PRODUCT_ROW_CHANGES_CHANNEL = 'product_row_changes'
+
+_TOKEN_START = re.compile(r'\w+')
+
+Entry = Tuple[str, int]
+
+
+class ProductSuggestIndex:
+    def __init__(self, db: Database):
+        self.db = db
+        self.logger = logging.getLogger(__name__)
+        self.__names: Dict[int, str] = {}
+        # full names and word-start suffixes, e.g. "c-class" -> "class"
+        self.__prefixes: List[Entry] = []
+        self.__tokens: List[Entry] = []
+        self.__pending: Optional[List[str]] = None
+
+    def __len__(self):
+        return len(self.__names)
+
+    async def rebuild(self):
+        # changes notified while the catalog is being read are replayed on top of it
+        self.__pending = []
+        try:
+            async with self.db.pool.acquire() as conn:
+                records = await self.db.fetch_cars(conn)
+        except Exception:
+            self.__pending = None
+            raise
+        names = {record['car_id']: record['car_name'] for record in records}
+        prefixes, tokens = [], []
+        for product_id, name in names.items():
+            prefix, product_tokens = self.__keys(product_id, name)
+            prefixes.append(prefix)
+            tokens.extend(product_tokens)
+        prefixes.sort()
+        tokens.sort()
+        self.__names, self.__prefixes, self.__tokens = names, prefixes, tokens
+        pending, self.__pending = self.__pending, None
+        for payload in pending:
+            self.on_row_changed(payload)
+
+    def upsert(self, product_id: int, name: str):
+        self.remove(product_id)
+        prefix, tokens = self.__keys(product_id, name)
+        bisect.insort(self.__prefixes, prefix)
+        for token in tokens:
+            bisect.insort(self.__tokens, token)
+        self.__names[product_id] = name
+
+    def remove(self, product_id: int):
+        name = self.__names.pop(product_id, None)
+        if name is None:
+            return
+        prefix, tokens = self.__keys(product_id, name)
+        self.__delete(self.__prefixes, prefix)
+        for token in tokens:
+            self.__delete(self.__tokens, token)
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[dict]:
+        prefix = prefix.strip().casefold()
+        if not prefix:
+            return []
+        found: Dict[int, None] = {}
+        # whole-name matches rank ahead of matches on a later word
+        for entries in (self.__prefixes, self.__tokens):
+            position = bisect.bisect_left(entries, (prefix,))
+            while position < len(entries) and len(found) < limit:
+                key, product_id = entries[position]
+                if not key.startswith(prefix):
+                    break
+                found.setdefault(product_id)
+                position += 1
+        return [
+            {'product_id': product_id, 'product_name': self.__names[product_id]}
+            for product_id in found
+        ]
+
+    def on_row_changed(self, payload: str):
+        if self.__pending is not None:
+            self.__pending.append(payload)
+        change = json.loads(payload)
+        if change['op'] == 'DELETE':
+            self.remove(change['id'])
+        else:
+            self.upsert(change['id'], change['name'])
+
+    def on_table_changed(self, payload: str = None):
+        # row triggers do not fire on TRUNCATE
+        if payload == 'TRUNCATE':
+            self.__names, self.__prefixes, self.__tokens = {}, [], []
+
+    def on_reset(self):
+        asyncio.ensure_future(self.__rebuild_quietly())
+
+    async def __rebuild_quietly(self):
+        try:
+            await self.rebuild()
+        except Exception as e:
+            self.logger.error(f"Product suggest index rebuild failed: {e}")
+
+    @staticmethod
+    def __keys(product_id: int, name: str) -> Tuple[Entry, List[Entry]]:
+        folded = name.casefold()
+        tokens = [(folded[match.start():], product_id) for match in _TOKEN_START.finditer(folded) if match.start() > 0]
+        return (folded, product_id), tokens
+
+    @staticmethod
+    def __delete(entries: List[Entry], entry: Entry):
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
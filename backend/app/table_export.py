@@ -0,0 +1,67 @@
+import asyncio
+import zlib
+from typing import AsyncIterator, List, Optional
+
+from database import Database
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+class TableExporter:
+    def __init__(self, db: Database, chunk_size: int = 64 * 1024, max_chunks: int = 16):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+
+    async def export(self, table_name: str, columns: Optional[List[str]], export_format: str,
+                     compress: bool = False) -> AsyncIterator[bytes]:
+        # bounded queue: COPY is paused when the client reads slower than Postgres writes
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_chunks)
+        copy_task = asyncio.ensure_future(self.__copy(queue, table_name, columns, export_format))
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        try:
+            while True:
+                if copy_task.done():
+                    # re-raises a COPY failure; otherwise the queue is drained up to the sentinel
+                    copy_task.result()
+                    chunk = await queue.get()
+                else:
+                    getter = asyncio.ensure_future(queue.get())
+                    done, _ = await asyncio.wait({getter, copy_task}, return_when=asyncio.FIRST_COMPLETED)
+                    if getter not in done:
+                        getter.cancel()
+                        continue
+                    chunk = getter.result()
+                if chunk is None:
+                    break
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                    if not chunk:
+                        continue
+                yield chunk
+            if compressor is not None:
+                yield compressor.flush()
+        finally:
+            if not copy_task.done():
+                copy_task.cancel()
+
+    async def __copy(self, queue: asyncio.Queue, table_name: str, columns: Optional[List[str]], export_format: str):
+        buffer = bytearray()
+
+        async def sink(data: bytes):
+            buffer.extend(data)
+            if len(buffer) >= self.chunk_size:
+                await queue.put(bytes(buffer))
+                buffer.clear()
+
+        async with self.db.acquire_read() as conn:
+            if export_format == 'csv':
+                await self.db.copy_table_csv(conn, table_name, columns, sink)
+            else:
+                await self.db.copy_table_ndjson(conn, table_name, columns, sink)
+        if buffer:
+            await queue.put(bytes(buffer))
+        await queue.put(None)
@@ -0,0 +1,201 @@
+import asyncio
+import codecs
+import csv
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional, Tuple
+
+from asyncpg import exceptions
+
+from database import Database
+from schema_catalog import SchemaCatalog
+
+# rows without the primary key are matched on these columns, each backed by a unique index
+IMPORTABLE_TABLES = {
+    'product': ['product_name'],
+    'shipment_method': ['method_name'],
+}
+
+_BOOLEANS = {'true': True, 't': True, '1': True, 'false': False, 'f': False, '0': False}
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    return _BOOLEANS[str(value).strip().lower()]
+
+
+def _to_datetime(value: Any) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _to_date(value: Any) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+def _converter(data_type: str) -> Callable[[Any], Any]:
+    if data_type in ('bigint', 'integer', 'smallint'):
+        return int
+    if data_type.startswith('numeric'):
+        return lambda value: Decimal(str(value))
+    if data_type in ('real', 'double precision'):
+        return float
+    if data_type == 'boolean':
+        return _to_bool
+    if data_type.startswith('timestamp'):
+        return _to_datetime
+    if data_type == 'date':
+        return _to_date
+    return str
+
+
+class ImportRejectedError(ValueError):
+    pass
+
+
+class TableImporter:
+    def __init__(self, db: Database, schema_catalog: SchemaCatalog, batch_size: int = 10000,
+                 max_rejected_samples: int = 100):
+        self.db = db
+        self.schema_catalog = schema_catalog
+        self.batch_size = batch_size
+        self.max_rejected_samples = max_rejected_samples
+
+    async def import_file(self, table_name: str, file: IO[bytes], import_format: str) -> dict:
+        started = time.perf_counter()
+        rows = self.__read_csv(file) if import_format == 'csv' else self.__read_ndjson(file)
+        try:
+            columns = await self.__run(next, rows)
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ImportRejectedError(f"Cannot read the header, the file must be UTF-8 {import_format}: {e}")
+        self.__check_columns(table_name, columns)
+        conflict_key = self.__conflict_key(table_name, columns)
+
+        column_types = self.schema_catalog.column_types[table_name]
+        nullable = self.schema_catalog.nullable[table_name]
+        converters = [_converter(column_types[column]) for column in columns]
+        rows_read, rejected, samples = 0, 0, []
+        stage = f'import_{table_name}'
+
+        async with self.db.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    await self.db.create_import_stage(conn, table_name, stage, columns)
+                    done = False
+                    while not done:
+                        batch, read, errors, done = await self.__run(
+                            self.__read_batch, rows, columns, converters, nullable
+                        )
+                        rows_read += read
+                        rejected += len(errors)
+                        samples.extend(errors[:self.max_rejected_samples - len(samples)])
+                        if batch:
+                            await conn.copy_records_to_table(stage, records=batch, columns=columns)
+                    merged = await self.db.merge_import_stage(
+                        conn, table_name, stage, columns, conflict_key, self.schema_catalog.primary_keys[table_name]
+                    )
+            except (exceptions.PostgresError, UnicodeDecodeError, csv.Error) as e:
+                raise ImportRejectedError(str(e))
+
+        elapsed = time.perf_counter() - started
+        return {
+            'table_name': table_name,
+            'rows_read': rows_read,
+            'rows_merged': merged,
+            'rows_rejected': rejected,
+            'rejected': samples,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(rows_read / elapsed) if elapsed else rows_read,
+        }
+
+    def __read_batch(self, rows: Iterator, columns: List[str], converters, nullable):
+        batch, read, errors = [], 0, []
+        for line, values in rows:
+            read += 1
+            try:
+                batch.append(self.__convert(columns, values, converters, nullable))
+            except (ValueError, TypeError, ArithmeticError, KeyError) as e:
+                errors.append({'line': line, 'error': str(e) or type(e).__name__})
+                continue
+            if len(batch) >= self.batch_size:
+                return batch, read, errors, False
+        return batch, read, errors, True
+
+    @staticmethod
+    async def __run(function, *args):
+        # decoding, parsing and converting the upload stay off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def __check_columns(self, table_name: str, columns: List[str]):
+        if table_name not in IMPORTABLE_TABLES:
+            raise ImportRejectedError(f"Import into {table_name} is not allowed.")
+        if not columns or len(set(columns)) != len(columns):
+            raise ImportRejectedError("Import file must name each column once.")
+        unknown = [column for column in columns if not self.schema_catalog.has_column(table_name, column)]
+        if unknown:
+            raise ImportRejectedError(f"Unknown columns: {', '.join(unknown)}.")
+
+    def __conflict_key(self, table_name: str, columns: List[str]) -> List[str]:
+        primary_key = self.schema_catalog.primary_keys[table_name]
+        for key in (primary_key, IMPORTABLE_TABLES[table_name]):
+            if key and set(key) <= set(columns):
+                return key
+        names = ' or '.join(', '.join(key) for key in (primary_key, IMPORTABLE_TABLES[table_name]) if key)
+        raise ImportRejectedError(f"Import file must include {names}, so rows can be matched on re-import.")
+
+    @staticmethod
+    def __convert(columns: List[str], values: List[Any], converters, nullable) -> Tuple:
+        if len(values) != len(columns):
+            raise ValueError(f"expected {len(columns)} values, got {len(values)}")
+        converted = []
+        for column, value, convert in zip(columns, values, converters):
+            if value is None or value == '':
+                if column not in nullable:
+                    raise ValueError(f"{column} must not be empty")
+                converted.append(None)
+            else:
+                converted.append(convert(value))
+        return tuple(converted)
+
+    @staticmethod
+    def __read_csv(file: IO[bytes]) -> Iterator:
+        # utf-8-sig drops the BOM spreadsheet tools put in front of the first column name
+        reader = csv.reader(codecs.iterdecode(file, 'utf-8-sig'))
+        try:
+            yield next(reader)
+        except StopIteration:
+            raise ImportRejectedError("Import file is empty.")
+        for values in reader:
+            if values:
+                yield reader.line_num, values
+
+    @staticmethod
+    def __read_ndjson(file: IO[bytes]) -> Iterator:
+        lines = enumerate(codecs.iterdecode(file, 'utf-8-sig'), start=1)
+        first: Optional[Dict[str, Any]] = None
+        for line, text in lines:
+            if text.strip():
+                try:
+                    first = json.loads(text)
+                except ValueError:
+                    raise ImportRejectedError("First NDJSON line is not a JSON object.")
+                if not isinstance(first, dict):
+                    raise ImportRejectedError("First NDJSON line is not a JSON object.")
+                first_line = line
+                break
+        if first is None:
+            raise ImportRejectedError("Import file is empty.")
+        columns = list(first)
+        yield columns
+        yield first_line, [first.get(column) for column in columns]
+        for line, text in lines:
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                yield line, []
+                continue
+            yield line, [record.get(column) for column in columns] if isinstance(record, dict) else []
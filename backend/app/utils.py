@@ -1,6 +1,10 @@
+import base64
+import binascii
 import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
 
-from exceptions import UserNotFoundHTTP, UnexpectedErrorHTTP, InvalidTokenHTTP, ExpiredTokenHTTP, ForbiddenAdminAccessHTTP, TableNotFoundHTTP, ColumnNotFoundHTTP
+from exceptions import UserNotFoundHTTP, UnexpectedErrorHTTP, InvalidTokenHTTP, ExpiredTokenHTTP, ForbiddenAdminAccessHTTP, TableNotFoundHTTP, ColumnNotFoundHTTP, InvalidCursorHTTP, InvalidDateRangeHTTP
 
 async def authorize(auth_service, token):
     try:
@@ -19,33 +23,43 @@ def check_admin_permission(auth_service, user):
     if not auth_service.check_admin_permission(user):
         raise ForbiddenAdminAccessHTTP()
 
-async def check_table_name(db, table_name):
-    try:
-        async with db.pool.acquire() as conn:
-            tables = await db.get_tables(conn)
-    except RuntimeError:
-        raise UnexpectedErrorHTTP()
-        
-    tables = [table['table_name'] for table in tables]
-
-    if table_name not in tables:
+def check_table_name(schema_catalog, table_name):
+    if not schema_catalog.has_table(table_name):
         raise TableNotFoundHTTP()
 
-async def check_column_name(db, table_name, column_name):
+def check_column_name(schema_catalog, table_name, column_name):
+    if not schema_catalog.has_column(table_name, column_name):
+        raise ColumnNotFoundHTTP()
+
+def encode_cursor(values: dict) -> str:
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, *keys: str) -> dict:
     try:
-        async with db.pool.acquire() as conn:
-            columns = await db.get_columns_by_table_name(conn, table_name)
-    except RuntimeError:
-        raise UnexpectedErrorHTTP()
-        
-    columns = [column['column_name'] for column in columns]
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursorHTTP()
+    if not isinstance(values, dict) or any(key not in values for key in keys):
+        raise InvalidCursorHTTP()
+    return values
 
-    if column_name not in columns:
-        raise ColumnNotFoundHTTP()
 
-def deserialize_json_objects(json_strings_list):
-    deserialized_objects_list = []
-    for json_string in json_strings_list:
-        obj = json.loads(json_string['result'])
-        deserialized_objects_list.append(obj)
-    return deserialized_objects_list
\ No newline at end of file
+def to_naive_utc(value: datetime) -> datetime:
+    # timestamp columns are stored without time zone, in server (UTC) time
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+MAX_ANALYTICS_DAYS = 3660
+
+def resolve_date_range(from_date: Optional[date], to_date: Optional[date], default_days: int = 30):
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=default_days - 1)
+    if from_date > to_date:
+        raise InvalidDateRangeHTTP("from_date must not be after to_date.")
+    if (to_date - from_date).days > MAX_ANALYTICS_DAYS:
+        raise InvalidDateRangeHTTP(f"Date range must not exceed {MAX_ANALYTICS_DAYS} days.")
+    return from_date, to_date
@@ -0,0 +1,78 @@
+"""Admin table read: per-row jsonb + json.loads + json.dumps vs. server-side json_agg passthrough.
+
+Seeds log rows inside a transaction that is rolled back at the end:
+
+    python bench/admin_read_benchmark.py --rows 200000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import asyncpg
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'app', 'config.json')
+
+
+async def decode_encode_path(conn, table_name: str) -> bytes:
+    rows = await conn.fetch('SELECT * FROM get_full_table($1);', table_name)
+    objects = [json.loads(row['result']) for row in rows]
+    return json.dumps(objects).encode('utf-8')
+
+
+async def passthrough_path(conn, table_name: str) -> bytes:
+    page = await conn.fetchrow('SELECT * FROM get_full_table_json($1);', table_name)
+    return page['rows_json'].encode('utf-8')
+
+
+async def measure(conn, path, table_name: str, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = await path(conn, table_name)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'path': path.__name__,
+        'bytes': len(body),
+        'p50_ms': round(statistics.median(timings), 1),
+        'min_ms': round(min(timings), 1),
+    }
+
+
+async def main(args):
+    with open(args.config) as config_file:
+        config = json.load(config_file)['database']
+    conn = await asyncpg.connect(
+        user=config['user'],
+        password=config['password'],
+        database=config['dbname'],
+        host=args.host or config['host'],
+        port=config['port']
+    )
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        await conn.execute(
+            '''
+            INSERT INTO log (action_type, action_timestamp, user_id)
+            SELECT 'BENCHMARK_' || (i % 50), now() - (i || ' seconds')::interval, NULL
+            FROM generate_series(1, $1) AS i
+            ''',
+            args.rows
+        )
+        for path in (decode_encode_path, passthrough_path):
+            print(await measure(conn, path, 'log', args.repeat))
+    finally:
+        await transaction.rollback()
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--config', default=DEFAULT_CONFIG)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""Bulk-update overhead of the users/customer audit triggers.
+
+Compares the statement-level log_action (transition tables) with the previous
+FOR EACH ROW version, recreated here for reference. Everything runs in a
+transaction that is rolled back at the end:
+
+    python bench/audit_trigger_benchmark.py --rows 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import asyncpg
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'app', 'config.json')
+
+PER_ROW_TRIGGER = '''
+CREATE FUNCTION log_action_per_row()
+RETURNS TRIGGER AS $$
+DECLARE
+    log_user_id BIGINT;
+    user_exists BOOLEAN;
+BEGIN
+    IF TG_TABLE_NAME = 'customer' THEN
+        log_user_id := COALESCE(NEW.customer_id, OLD.customer_id);
+    ELSE
+        log_user_id := COALESCE(NEW.users_id, OLD.users_id);
+    END IF;
+    SELECT EXISTS (SELECT 1 FROM users WHERE users_id = log_user_id) INTO user_exists;
+    IF user_exists THEN
+        INSERT INTO log (action_type, user_id, action_timestamp)
+        VALUES (TG_TABLE_NAME || ' ' || TG_OP, log_user_id, CURRENT_TIMESTAMP);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER log_users_insert ON users;
+DROP TRIGGER log_users_update ON users;
+DROP TRIGGER log_users_delete ON users;
+
+CREATE TRIGGER log_users
+AFTER INSERT OR UPDATE OR DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION log_action_per_row();
+'''
+
+
+async def bulk_update(conn, label: str):
+    logged_before = await conn.fetchval('SELECT count(*) FROM log;')
+    started = time.perf_counter()
+    status = await conn.execute("UPDATE users SET email = email || '.x' WHERE username LIKE 'bench_%';")
+    elapsed = (time.perf_counter() - started) * 1000
+    logged = await conn.fetchval('SELECT count(*) FROM log;') - logged_before
+    print({'triggers': label, 'status': status, 'ms': round(elapsed, 1), 'log_rows': logged})
+
+
+async def main(args):
+    with open(args.config) as config_file:
+        config = json.load(config_file)['database']
+    conn = await asyncpg.connect(
+        user=config['user'],
+        password=config['password'],
+        database=config['dbname'],
+        host=args.host or config['host'],
+        port=config['port']
+    )
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        await conn.execute(
+            '''
+            INSERT INTO users (username, password_hash, email, role_id)
+            SELECT 'bench_' || i, 'x', 'bench_' || i || '@example.com', (SELECT min(roles_id) FROM roles)
+            FROM generate_series(1, $1) AS i
+            ''',
+            args.rows
+        )
+        await conn.execute('ANALYZE users;')
+        await bulk_update(conn, 'statement')
+        await conn.execute(PER_ROW_TRIGGER)
+        await bulk_update(conn, 'row')
+    finally:
+        await transaction.rollback()
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--config', default=DEFAULT_CONFIG)
+    asyncio.run(main(parser.parse_args()))
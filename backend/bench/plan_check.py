@@ -0,0 +1,215 @@
+"""Sequential-scan check for the statements inside the hot stored procedures.
+
+EXPLAIN on `SELECT * FROM get_orders_by_user(...)` only shows a Function Scan:
+plpgsql plans RETURN QUERY and EXECUTE statements on its own. So each
+procedure is called with auto_explain loaded in the session, logging every
+nested statement's plan in JSON back to the client as a NOTICE. A call fails
+the check when one of its plans does a Seq Scan on a table whose estimated
+row count is at least --min-rows.
+
+Seeds data inside a transaction that is rolled back at the end (auto_explain
+needs a superuser, as the docker-compose admin is) and exits with 1 if any
+call fails, so it can gate schema changes:
+
+    python bench/plan_check.py --rows 200000 --min-rows 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+
+import asyncpg
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'app', 'config.json')
+
+# (name, statement, arguments built from the seeded references)
+HOT_CALLS = [
+    ('get_user_by_username', 'SELECT * FROM get_user_by_username($1);', lambda r: (r['username'],)),
+    ('get_car_by_id', 'SELECT * FROM get_car_by_id($1);', lambda r: (r['product_id'],)),
+    ('get_cars_page (price)', 'SELECT * FROM get_cars_page($1, $2, $3, $4, $5, $6, $7, $8);',
+     lambda r: (None, None, 'price', False, 20, None, None, True)),
+    ('get_cars_page (price range)', 'SELECT * FROM get_cars_page($1, $2, $3, $4, $5, $6, $7, $8);',
+     lambda r: (Decimal('1000000'), Decimal('1100000'), 'price', False, 20, None, None, False)),
+    ('search_cars', 'SELECT * FROM search_cars($1, $2, $3, $4);', lambda r: ('Mercedes', 20, None, None)),
+    ('get_orders_by_user', 'SELECT * FROM get_orders_by_user($1, $2, $3, $4, $5, $6);',
+     lambda r: (r['user_id'], None, None, 50, None, None)),
+    ('get_orders_by_user (date range)', 'SELECT * FROM get_orders_by_user($1, $2, $3, $4, $5, $6);',
+     lambda r: (r['user_id'], r['from_date'], r['to_date'], 50, None, None)),
+    ('get_logs (user)', 'SELECT * FROM get_logs($1, $2, $3, $4, $5, $6, $7);',
+     lambda r: (r['user_id'], None, None, None, 100, None, None)),
+    ('get_logs (action type)', 'SELECT * FROM get_logs($1, $2, $3, $4, $5, $6, $7);',
+     lambda r: (None, 'PLAN_CHECK_1', None, None, 100, None, None)),
+    ('get_full_table (page)', 'SELECT * FROM get_full_table($1, $2, $3);',
+     lambda r: ('product', r['product_id'], 100)),
+    ('get_sales_series', 'SELECT * FROM get_sales_series($1, $2, $3, $4);',
+     lambda r: (r['from_date'], r['to_date'], 'day', None)),
+    ('get_top_products', 'SELECT * FROM get_top_products($1, $2, $3, $4);',
+     lambda r: (r['from_date'], r['to_date'], 10, 'revenue')),
+    ('create_order', 'SELECT create_order($1, $2, $3);',
+     lambda r: (r['username'], r['product_name'], r['shipment_method_name'])),
+    ('checkout', 'SELECT * FROM checkout($1, $2, $3, $4);',
+     lambda r: (r['user_id'], [r['product_id']], r['shipment_method_id'], None)),
+]
+
+
+async def seed(conn, rows: int) -> dict:
+    users = max(rows // 10, 1)
+    await conn.execute(
+        '''
+        INSERT INTO product (product_name, description, price, photo_url)
+        SELECT
+            'PlanCheck ' || (ARRAY['Mercedes-Benz', 'BMW', 'Audi', 'Volvo'])[1 + i % 4] || ' ' || i,
+            'Synthetic car number ' || i,
+            1000000 + (i % 9000000),
+            NULL
+        FROM generate_series(1, $1) AS i
+        ''',
+        rows
+    )
+    await conn.execute(
+        '''
+        INSERT INTO users (username, password_hash, email, role_id)
+        SELECT 'plan_check_' || i, 'x', 'plan_check_' || i || '@example.com',
+               (SELECT roles_id FROM roles ORDER BY roles_id LIMIT 1)
+        FROM generate_series(1, $1) AS i
+        ''',
+        users
+    )
+    await conn.execute(
+        '''
+        INSERT INTO customer (customer_id, customer_name, contact_email)
+        SELECT users_id, username, email FROM users WHERE username LIKE 'plan\\_check\\_%'
+        '''
+    )
+    if await conn.fetchval('SELECT count(*) FROM shipment_method') == 0:
+        await conn.execute("INSERT INTO shipment_method (method_name) VALUES ('Self-pickup')")
+    references = dict(await conn.fetchrow(
+        '''
+        SELECT
+            (SELECT min(product_id) FROM product WHERE product_name LIKE 'PlanCheck %') AS product_id,
+            (SELECT min(users_id) FROM users WHERE username LIKE 'plan\\_check\\_%') AS user_id,
+            (SELECT min(shipment_method_id) FROM shipment_method) AS shipment_method_id
+        '''
+    ))
+    await conn.execute(
+        '''
+        INSERT INTO orders (order_date, customer_id, shipment_method_id, product_id)
+        SELECT current_date - (i % 730), $2 + i % $3, $4, $5 + i % $1
+        FROM generate_series(1, $1) AS i
+        ''',
+        rows, references['user_id'], users, references['shipment_method_id'], references['product_id']
+    )
+    await conn.execute(
+        '''
+        INSERT INTO log (action_type, action_timestamp, user_id)
+        SELECT 'PLAN_CHECK_' || (i % 50), now() - (i || ' minutes')::interval, $2 + i % $3
+        FROM generate_series(1, $1) AS i
+        ''',
+        rows, references['user_id'], users
+    )
+    await conn.execute('ANALYZE product, users, customer, orders, log, sales_daily, sales_daily_product;')
+    references.update(await conn.fetchrow(
+        '''
+        SELECT
+            (SELECT username FROM users WHERE users_id = $1) AS username,
+            (SELECT product_name FROM product WHERE product_id = $2) AS product_name,
+            (SELECT method_name FROM shipment_method WHERE shipment_method_id = $3) AS shipment_method_name
+        ''',
+        references['user_id'], references['product_id'], references['shipment_method_id']
+    ))
+    references['to_date'] = date.today()
+    references['from_date'] = references['to_date'] - timedelta(days=30)
+    return references
+
+
+async def table_sizes(conn) -> dict:
+    rows = await conn.fetch(
+        '''
+        SELECT c.relname, c.reltuples
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'm')
+        '''
+    )
+    return {row['relname']: row['reltuples'] for row in rows}
+
+
+def seq_scans(plan: dict):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+async def check_call(conn, notices: list, sizes: dict, min_rows: int, statement: str, args: tuple):
+    notices.clear()
+    try:
+        # a savepoint per call, so a failing procedure does not abort the seeded transaction
+        async with conn.transaction():
+            await conn.execute(statement, *args)
+    except asyncpg.PostgresError as e:
+        return [f'error: {e}']
+    problems = []
+    for notice in notices:
+        plan_text = notice[notice.find('{'):]
+        try:
+            explained = json.loads(plan_text)
+        except ValueError:
+            continue
+        for table_name in seq_scans(explained['Plan']):
+            estimated_rows = sizes.get(table_name, 0)
+            if estimated_rows >= min_rows:
+                query = ' '.join(explained.get('Query Text', '').split())
+                problems.append(f'Seq Scan on {table_name} (~{int(estimated_rows)} rows) in: {query[:160]}')
+    return problems
+
+
+async def main(args) -> int:
+    with open(args.config) as config_file:
+        config = json.load(config_file)['database']
+    conn = await asyncpg.connect(
+        user=config['user'],
+        password=config['password'],
+        database=config['dbname'],
+        host=args.host or config['host'],
+        port=config['port']
+    )
+    notices = []
+    conn.add_log_listener(lambda _, message: notices.append(message.message))
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        references = await seed(conn, args.rows)
+        sizes = await table_sizes(conn)
+        await conn.execute("LOAD 'auto_explain';")
+        await conn.execute('SET auto_explain.log_min_duration = 0;')
+        await conn.execute('SET auto_explain.log_nested_statements = on;')
+        await conn.execute("SET auto_explain.log_format = 'json';")
+        await conn.execute("SET auto_explain.log_level = 'notice';")
+        await conn.execute(f"SET plan_cache_mode = '{args.plan_cache_mode}';")
+        failures = 0
+        for name, statement, build_args in HOT_CALLS:
+            problems = await check_call(conn, notices, sizes, args.min_rows, statement, build_args(references))
+            print(f"{'FAIL' if problems else 'ok  '} {name}")
+            for problem in problems:
+                print(f'     {problem}')
+            failures += bool(problems)
+    finally:
+        await transaction.rollback()
+        await conn.close()
+    print(f'{failures} of {len(HOT_CALLS)} calls failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--min-rows', type=int, default=10000)
+    parser.add_argument('--plan-cache-mode', default='auto',
+                        choices=['auto', 'force_custom_plan', 'force_generic_plan'])
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--config', default=DEFAULT_CONFIG)
+    sys.exit(asyncio.run(main(parser.parse_args())))
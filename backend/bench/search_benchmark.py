@@ -0,0 +1,95 @@
+"""Latency of search_cars against a synthetic catalog.
+
+Seeds N products inside a transaction that is rolled back at the end, so it
+can be pointed at a development database without leaving data behind:
+
+    python bench/search_benchmark.py --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import asyncpg
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'app', 'config.json')
+QUERIES = ['Mercedes', 'benz c-class', 'luxury sedan', 'GLC', 'zzz-no-match']
+
+
+async def seed(conn, rows: int):
+    await conn.execute(
+        '''
+        INSERT INTO product (product_name, description, price, photo_url)
+        SELECT
+            (ARRAY['Mercedes-Benz', 'BMW', 'Audi', 'Volvo', 'Toyota'])[1 + i % 5]
+                || ' ' || md5(i::text)::varchar(8) || ' ' || (ARRAY['Sedan', 'Coupe', 'GLC', 'Wagon'])[1 + i % 4],
+            'Synthetic ' || (ARRAY['luxury', 'compact', 'family', 'sport'])[1 + i % 4]
+                || ' car number ' || i || ' ' || md5((i * 7)::text),
+            1000000 + (i % 9000000),
+            NULL
+        FROM generate_series(1, $1) AS i
+        ''',
+        rows
+    )
+    await conn.execute('ANALYZE product;')
+
+
+async def measure(conn, query: str, repeat: int, limit: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        page = await conn.fetch('SELECT * FROM search_cars($1, $2, NULL, NULL);', query, limit)
+        timings.append((time.perf_counter() - started) * 1000)
+    if page:
+        last = page[-1]
+        started = time.perf_counter()
+        await conn.fetch(
+            'SELECT * FROM search_cars($1, $2, $3, $4);',
+            query, limit, last['search_rank'], last['product_id']
+        )
+        next_page = (time.perf_counter() - started) * 1000
+    else:
+        next_page = 0.0
+    timings.sort()
+    return {
+        'query': query,
+        'rows': len(page),
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 2),
+        'next_page_ms': round(next_page, 2),
+    }
+
+
+async def main(args):
+    with open(args.config) as config_file:
+        config = json.load(config_file)['database']
+    conn = await asyncpg.connect(
+        user=config['user'],
+        password=config['password'],
+        database=config['dbname'],
+        host=args.host or config['host'],
+        port=config['port']
+    )
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        started = time.perf_counter()
+        await seed(conn, args.rows)
+        print(f"seeded {args.rows} products in {time.perf_counter() - started:.1f}s")
+        for query in QUERIES:
+            print(await measure(conn, query, args.repeat, args.limit))
+    finally:
+        await transaction.rollback()
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--config', default=DEFAULT_CONFIG)
+    asyncio.run(main(parser.parse_args()))
@@ -1,3 +1,7 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+-- Статистика запросов (сервер должен загружать pg_stat_statements через shared_preload_libraries)
+CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
+
 -- Создание таблицы product
 CREATE TABLE product (
     product_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -7,6 +11,22 @@ CREATE TABLE product (
     photo_url TEXT
 );
 
+-- Поисковый вектор товара: совпадения в названии весят больше, чем в описании
+CREATE OR REPLACE FUNCTION product_search_vector(name_input TEXT, description_input TEXT)
+RETURNS tsvector
+AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(name_input, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(description_input, '')), 'B');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE INDEX index_product_search_vector ON product USING GIN (product_search_vector(product_name, description));
+CREATE INDEX index_product_name_trgm ON product USING GIN (product_name gin_trgm_ops);
+-- Индексы для сортировки и keyset-пагинации каталога
+CREATE INDEX index_product_price ON product(price, product_id);
+CREATE INDEX index_product_name ON product(product_name, product_id);
+-- Название товара - естественный ключ: по нему create_order ищет товар, а импорт сливает строки без product_id
+CREATE UNIQUE INDEX index_product_name_unique ON product(product_name);
+
 -- Таблица ролей
 CREATE TABLE roles (
     roles_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY, -- Уникальный идентификатор роли
@@ -38,6 +58,8 @@ CREATE TABLE shipment_method (
     shipment_method_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
     method_name TEXT NOT NULL
 );
+-- Поиск метода доставки по названию в create_order; название - естественный ключ для импорта
+CREATE UNIQUE INDEX index_shipment_method_name ON shipment_method(method_name);
 
 -- Создание таблицы purchase_order_main
 CREATE TABLE orders (
@@ -46,16 +68,77 @@ CREATE TABLE orders (
     customer_id BIGINT,  -- Здесь связываем заказ с покупателем
     shipment_method_id BIGINT,
     product_id BIGINT,
+    unit_price DECIMAL(10, 2),  -- Цена товара на момент заказа (заполняется триггером, если не задана)
     FOREIGN KEY (product_id) REFERENCES product(product_id) ON DELETE CASCADE,
     FOREIGN KEY (customer_id) REFERENCES customer(customer_id) ON DELETE CASCADE, -- Связь с таблицей customer
     FOREIGN KEY (shipment_method_id) REFERENCES shipment_method(shipment_method_id) ON DELETE CASCADE -- Связь с таблицей shipment_method
 );
 
--- Создание таблицы для логирования действий
+-- История заказов покупателя: фильтр и keyset-пагинация по (order_date, orders_id) без обращения к таблице
+CREATE INDEX index_orders_customer_date ON orders(customer_id, order_date DESC, orders_id DESC)
+    INCLUDE (product_id, shipment_method_id);
+
+-- Ключи идемпотентности оформления заказа: повтор запроса с тем же ключом возвращает уже созданные заказы
+CREATE TABLE checkout_request (
+    customer_id BIGINT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    product_ids BIGINT[] NOT NULL,
+    shipment_method_id BIGINT NOT NULL,
+    order_ids BIGINT[],
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (customer_id, idempotency_key),
+    FOREIGN KEY (customer_id) REFERENCES customer(customer_id) ON DELETE CASCADE
+);
+
+-- Агрегаты продаж: поддерживаются триггерами на orders (03_triggers.sql), заказы без товара не учитываются.
+-- Все строки разбиты на 8 шардов по сеансу, чтобы параллельные заказы не ждали друг друга
+-- на одной строке; читатели суммируют по шардам
+CREATE TABLE sales_total (
+    shard SMALLINT PRIMARY KEY CHECK (shard BETWEEN 0 AND 7),
+    orders_count BIGINT NOT NULL DEFAULT 0,
+    total_amount DECIMAL NOT NULL DEFAULT 0
+);
+INSERT INTO sales_total (shard) SELECT generate_series(0, 7);
+
+CREATE TABLE sales_daily (
+    order_date DATE NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    orders_count BIGINT NOT NULL,
+    total_amount DECIMAL NOT NULL,
+    PRIMARY KEY (order_date, shard)
+);
+
+CREATE TABLE sales_daily_product (
+    order_date DATE NOT NULL,
+    product_id BIGINT NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    orders_count BIGINT NOT NULL,
+    total_amount DECIMAL NOT NULL,
+    PRIMARY KEY (order_date, product_id, shard)
+);
+
+CREATE TABLE sales_daily_shipment (
+    order_date DATE NOT NULL,
+    shipment_method_id BIGINT NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    orders_count BIGINT NOT NULL,
+    total_amount DECIMAL NOT NULL,
+    PRIMARY KEY (order_date, shipment_method_id, shard)
+);
+
+-- Создание таблицы для логирования действий (помесячные партиции по action_timestamp)
 CREATE TABLE log (
-    log_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    log_id BIGINT GENERATED ALWAYS AS IDENTITY,
     action_type TEXT NOT NULL,       -- Название таблицы
-    action_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- Время выполнения действия
+    action_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- Время выполнения действия
     user_id BIGINT,
+    PRIMARY KEY (log_id, action_timestamp),
     FOREIGN KEY (user_id) REFERENCES users(users_id) ON DELETE CASCADE
-);
+) PARTITION BY RANGE (action_timestamp);
+
+-- Записи вне созданных партиций (например, из далёкого прошлого) попадают сюда
+CREATE TABLE log_default PARTITION OF log DEFAULT;
+
+CREATE INDEX index_log_action_timestamp ON log USING BRIN (action_timestamp);
+CREATE INDEX index_log_user_id ON log(user_id, action_timestamp);
+CREATE INDEX index_log_action_type ON log(action_type text_pattern_ops, action_timestamp);
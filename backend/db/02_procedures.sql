@@ -58,6 +58,17 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Процедура для замены хеша пароля (перехеширование с новой стоимостью bcrypt)
+CREATE OR REPLACE FUNCTION update_password_hash(user_id_input BIGINT, password_hash_input TEXT)
+RETURNS VOID
+AS $$
+BEGIN
+    UPDATE users
+    SET password_hash = password_hash_input
+    WHERE users_id = user_id_input;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Процедура для логирования действий пользователя
 CREATE OR REPLACE FUNCTION add_action_log(action_title TEXT, user_id_input BIGINT)
 RETURNS VOID
@@ -77,6 +88,136 @@ $$ LANGUAGE plpgsql;
 
 
 
+-- Пакетная запись логов: записи удалённых пользователей сохраняются без привязки к пользователю
+CREATE OR REPLACE FUNCTION add_action_logs(action_titles TEXT[], action_timestamps TIMESTAMP[], user_ids BIGINT[])
+RETURNS VOID
+AS $$
+BEGIN
+    INSERT INTO log (action_type, action_timestamp, user_id)
+    SELECT l.action_type, l.action_timestamp, u.users_id
+    FROM unnest(action_titles, action_timestamps, user_ids) AS l(action_type, action_timestamp, user_id)
+    LEFT JOIN users u ON u.users_id = l.user_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Создание помесячных партиций log от текущего месяца на months_ahead месяцев вперёд.
+-- Строки этого месяца, уже попавшие в log_default (например, вставленные заранее),
+-- переносятся в новую партицию: иначе CREATE ... PARTITION OF завершится ошибкой
+CREATE OR REPLACE FUNCTION ensure_log_partitions(months_ahead INT DEFAULT 3)
+RETURNS INT
+AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    moved BIGINT;
+    created INT := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := (date_trunc('month', CURRENT_DATE) + make_interval(months => i))::DATE;
+        month_end := (month_start + INTERVAL '1 month')::DATE;
+        partition_name := 'log_y' || to_char(month_start, 'YYYY') || 'm' || to_char(month_start, 'MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            IF to_regclass('pg_temp.log_moved') IS NULL THEN
+                CREATE TEMP TABLE log_moved (LIKE log) ON COMMIT DROP;
+            END IF;
+            WITH removed AS (
+                DELETE FROM log_default
+                WHERE action_timestamp >= month_start AND action_timestamp < month_end
+                RETURNING *
+            )
+            INSERT INTO log_moved SELECT * FROM removed;
+            GET DIAGNOSTICS moved = ROW_COUNT;
+
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF log FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            IF moved > 0 THEN
+                INSERT INTO log OVERRIDING SYSTEM VALUE SELECT * FROM log_moved;
+                TRUNCATE log_moved;
+            END IF;
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_log_partitions(3);
+
+-- Удаление (или отсоединение) партиций log старше retention_months месяцев
+CREATE OR REPLACE FUNCTION drop_expired_log_partitions(retention_months INT DEFAULT 12, detach_only BOOLEAN DEFAULT FALSE)
+RETURNS SETOF TEXT
+AS $$
+DECLARE
+    partition_name TEXT;
+    cutoff TEXT := 'log_y' || to_char(date_trunc('month', CURRENT_DATE) - make_interval(months => retention_months), 'YYYY"m"MM');
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname::TEXT
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'log'::regclass
+            AND c.relname ~ '^log_y[0-9]{4}m[0-9]{2}$'
+            AND c.relname < cutoff
+        ORDER BY c.relname
+    LOOP
+        IF detach_only THEN
+            EXECUTE format('ALTER TABLE log DETACH PARTITION %I', partition_name);
+        ELSE
+            EXECUTE format('DROP TABLE %I', partition_name);
+        END IF;
+        RETURN NEXT partition_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Выборка логов с фильтрами и keyset-пагинацией от новых к старым.
+-- Запрос собирается динамически только из заданных условий, чтобы планировщик
+-- отсекал партиции и выбирал индекс по фактическим значениям
+CREATE OR REPLACE FUNCTION get_logs(
+    user_id_input BIGINT DEFAULT NULL,
+    action_type_prefix TEXT DEFAULT NULL,
+    from_timestamp TIMESTAMP DEFAULT NULL,
+    until_timestamp TIMESTAMP DEFAULT NULL,
+    limit_input INT DEFAULT 100,
+    before_timestamp TIMESTAMP DEFAULT NULL,
+    before_id BIGINT DEFAULT NULL
+)
+RETURNS TABLE(log_id BIGINT, action_type TEXT, action_timestamp TIMESTAMP, user_id BIGINT)
+AS $$
+DECLARE
+    query TEXT := 'SELECT l.log_id, l.action_type, l.action_timestamp, l.user_id FROM log l WHERE TRUE';
+BEGIN
+    IF user_id_input IS NOT NULL THEN
+        query := query || ' AND l.user_id = $1';
+    END IF;
+    IF action_type_prefix IS NOT NULL THEN
+        query := query || ' AND l.action_type LIKE $2';
+    END IF;
+    IF from_timestamp IS NOT NULL THEN
+        query := query || ' AND l.action_timestamp >= $3';
+    END IF;
+    IF until_timestamp IS NOT NULL THEN
+        query := query || ' AND l.action_timestamp < $4';
+    END IF;
+    IF before_timestamp IS NOT NULL THEN
+        query := query || ' AND (l.action_timestamp, l.log_id) < ($5, $6)';
+    END IF;
+    query := query || ' ORDER BY l.action_timestamp DESC, l.log_id DESC LIMIT $7';
+
+    RETURN QUERY EXECUTE query USING
+        user_id_input,
+        replace(replace(replace(action_type_prefix, '\', '\\'), '%', '\%'), '_', '\_') || '%',
+        from_timestamp,
+        until_timestamp,
+        before_timestamp,
+        before_id,
+        limit_input;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Процедура для получения списка автомобилей
 CREATE OR REPLACE FUNCTION get_cars()
 RETURNS TABLE(car_id BIGINT, car_name TEXT, description TEXT, price DECIMAL, photo_url TEXT)
@@ -86,6 +227,60 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Страница каталога: фильтр по цене, сортировка по цене/названию/ID, keyset-пагинация
+-- по паре (ключ сортировки, product_id); with_description = FALSE отдаёт краткую проекцию
+CREATE OR REPLACE FUNCTION get_cars_page(
+    min_price DECIMAL DEFAULT NULL,
+    max_price DECIMAL DEFAULT NULL,
+    sort_key TEXT DEFAULT 'id',
+    sort_desc BOOLEAN DEFAULT FALSE,
+    limit_input INT DEFAULT 20,
+    after_value TEXT DEFAULT NULL,
+    after_id BIGINT DEFAULT NULL,
+    with_description BOOLEAN DEFAULT TRUE
+)
+RETURNS TABLE(car_id BIGINT, car_name TEXT, description TEXT, price DECIMAL, photo_url TEXT)
+AS $$
+DECLARE
+    query TEXT;
+    sort_column TEXT;
+    sort_type TEXT;
+    direction TEXT := CASE WHEN sort_desc THEN 'DESC' ELSE 'ASC' END;
+    comparison TEXT := CASE WHEN sort_desc THEN '<' ELSE '>' END;
+BEGIN
+    IF sort_key = 'price' THEN
+        sort_column := 'price';
+        sort_type := 'numeric';
+    ELSIF sort_key = 'name' THEN
+        sort_column := 'product_name';
+        sort_type := 'text';
+    ELSIF sort_key <> 'id' THEN
+        RAISE EXCEPTION 'Unsupported sort key: %', sort_key;
+    END IF;
+
+    query := format(
+        'SELECT p.product_id, p.product_name::TEXT, %s, p.price, p.photo_url FROM product p'
+        ' WHERE ($1 IS NULL OR p.price >= $1) AND ($2 IS NULL OR p.price <= $2)',
+        CASE WHEN with_description THEN 'p.description' ELSE 'NULL::TEXT' END
+    );
+
+    IF sort_column IS NULL THEN
+        IF after_id IS NOT NULL THEN
+            query := query || format(' AND p.product_id %s $4', comparison);
+        END IF;
+        query := query || format(' ORDER BY p.product_id %s', direction);
+    ELSE
+        IF after_id IS NOT NULL THEN
+            query := query || format(' AND (p.%I, p.product_id) %s ($3::%s, $4)', sort_column, comparison, sort_type);
+        END IF;
+        query := query || format(' ORDER BY p.%I %s, p.product_id %s', sort_column, direction, direction);
+    END IF;
+
+    RETURN QUERY EXECUTE query || ' LIMIT $5'
+        USING min_price, max_price, after_value, after_id, limit_input;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Процедура для получения автомобиля по ID
 CREATE OR REPLACE FUNCTION get_car_by_id(car_id_input BIGINT)
 RETURNS TABLE(car_id BIGINT, car_name TEXT, description TEXT, price DECIMAL)
@@ -107,29 +302,49 @@ END;
 $$ LANGUAGE plpgsql;
 
 -- Процедура для получения заказов пользователя
-CREATE OR REPLACE FUNCTION get_orders_by_user(user_id_input BIGINT)
+CREATE OR REPLACE FUNCTION get_orders_by_user(
+    user_id_input BIGINT,
+    from_date DATE DEFAULT NULL,
+    to_date DATE DEFAULT NULL,
+    limit_input INT DEFAULT NULL,
+    before_date DATE DEFAULT NULL,
+    before_id BIGINT DEFAULT NULL
+)
 RETURNS TABLE(
+    order_id BIGINT,
     order_date DATE, 
     car_name TEXT,  
     shipment_method TEXT,  
     total_amount DECIMAL
 )
 AS $$
+DECLARE
+    -- Условия добавляются только заданные, чтобы план шёл по index_orders_customer_date
+    query TEXT := 'SELECT pom.orders_id, pom.order_date, p.product_name::text, sm.method_name::text, coalesce(pom.unit_price, p.price) '
+        'FROM orders pom '
+        'JOIN product p ON pom.product_id = p.product_id '
+        'JOIN shipment_method sm ON pom.shipment_method_id = sm.shipment_method_id '
+        'WHERE pom.customer_id = $1';
 BEGIN
-    RETURN QUERY 
-    SELECT
-        pom.order_date,
-        p.product_name::text AS car_name,  -- Приведение типа
-        sm.method_name::text AS shipment_method,  -- Приведение типа
-        p.price AS total_amount
-    FROM
-        orders pom
-    JOIN
-        product p ON pom.product_id = p.product_id
-    JOIN
-        shipment_method sm ON pom.shipment_method_id = sm.shipment_method_id
-    WHERE
-        pom.customer_id = user_id_input;
+    IF from_date IS NOT NULL THEN
+        query := query || ' AND pom.order_date >= $2';
+    END IF;
+    IF to_date IS NOT NULL THEN
+        query := query || ' AND pom.order_date <= $3';
+    END IF;
+    IF before_date IS NOT NULL THEN
+        query := query || ' AND (pom.order_date, pom.orders_id) < ($4, $5)';
+    END IF;
+    -- Новые заказы первыми, keyset-пагинация по паре (order_date, orders_id)
+    query := query || ' ORDER BY pom.order_date DESC, pom.orders_id DESC LIMIT $6';
+
+    RETURN QUERY EXECUTE query USING
+        user_id_input,
+        from_date,
+        to_date,
+        before_date,
+        before_id,
+        limit_input;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -211,26 +426,156 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-- Оформление заказа по ID товаров: проверка, вставка всех строк одним запросом и идемпотентность по ключу
+CREATE OR REPLACE FUNCTION checkout(
+    p_user_id BIGINT,
+    p_product_ids BIGINT[],
+    p_shipment_method_id BIGINT,
+    p_idempotency_key TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    order_id BIGINT,
+    product_id BIGINT,
+    product_name TEXT,
+    price DECIMAL(10, 2),
+    order_date DATE,
+    replayed BOOLEAN
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_missing BIGINT[];
+    v_order_ids BIGINT[];
+    v_previous checkout_request%ROWTYPE;
+BEGIN
+    -- Покупатель создаётся из пользователя при первом заказе
+    INSERT INTO customer (customer_id, customer_name, contact_email)
+    SELECT u.users_id, u.username, u.email
+    FROM users u
+    WHERE u.users_id = p_user_id
+    ON CONFLICT DO NOTHING;
+
+    IF NOT EXISTS (SELECT 1 FROM customer c WHERE c.customer_id = p_user_id) THEN
+        RAISE EXCEPTION 'User % does not exist', p_user_id USING ERRCODE = 'no_data_found';
+    END IF;
+
+    IF p_idempotency_key IS NOT NULL THEN
+        -- Параллельный запрос с тем же ключом ждёт здесь завершения первого
+        INSERT INTO checkout_request (customer_id, idempotency_key, product_ids, shipment_method_id)
+        VALUES (p_user_id, p_idempotency_key, p_product_ids, p_shipment_method_id)
+        ON CONFLICT DO NOTHING;
+
+        IF NOT FOUND THEN
+            SELECT * INTO v_previous
+            FROM checkout_request r
+            WHERE r.customer_id = p_user_id AND r.idempotency_key = p_idempotency_key;
+
+            IF v_previous.product_ids IS DISTINCT FROM p_product_ids
+                OR v_previous.shipment_method_id IS DISTINCT FROM p_shipment_method_id THEN
+                RAISE EXCEPTION 'Idempotency key % was used for a different checkout', p_idempotency_key
+                    USING ERRCODE = 'unique_violation';
+            END IF;
+
+            RETURN QUERY
+            SELECT o.orders_id, o.product_id, p.product_name::TEXT, o.unit_price, o.order_date, TRUE
+            FROM orders o
+            JOIN product p ON p.product_id = o.product_id
+            WHERE o.orders_id = ANY(v_previous.order_ids)
+            ORDER BY o.orders_id;
+            RETURN;
+        END IF;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM shipment_method sm WHERE sm.shipment_method_id = p_shipment_method_id) THEN
+        RAISE EXCEPTION 'Shipment method % does not exist', p_shipment_method_id USING ERRCODE = 'no_data_found';
+    END IF;
+
+    SELECT array_agg(DISTINCT item.id) INTO v_missing
+    FROM unnest(p_product_ids) AS item(id)
+    WHERE NOT EXISTS (SELECT 1 FROM product p WHERE p.product_id = item.id);
+
+    IF v_missing IS NOT NULL THEN
+        RAISE EXCEPTION 'Products % do not exist', array_to_string(v_missing, ', ') USING ERRCODE = 'no_data_found';
+    END IF;
+
+    -- Все позиции корзины одной вставкой, в порядке корзины
+    WITH inserted AS (
+        INSERT INTO orders AS o (order_date, customer_id, product_id, shipment_method_id, unit_price)
+        SELECT CURRENT_DATE, p_user_id, item.id, p_shipment_method_id, p.price
+        FROM unnest(p_product_ids) WITH ORDINALITY AS item(id, position)
+        JOIN product p ON p.product_id = item.id
+        ORDER BY item.position
+        RETURNING o.orders_id
+    )
+    SELECT array_agg(inserted.orders_id ORDER BY inserted.orders_id) INTO v_order_ids
+    FROM inserted;
+
+    IF p_idempotency_key IS NOT NULL THEN
+        UPDATE checkout_request r
+        SET order_ids = v_order_ids
+        WHERE r.customer_id = p_user_id AND r.idempotency_key = p_idempotency_key;
+    END IF;
+
+    RETURN QUERY
+    SELECT o.orders_id, o.product_id, p.product_name::TEXT, o.unit_price, o.order_date, FALSE
+    FROM orders o
+    JOIN product p ON p.product_id = o.product_id
+    WHERE o.orders_id = ANY(v_order_ids)
+    ORDER BY o.orders_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Поиск автомобилей: полнотекстовый поиск по названию и описанию плюс подстрока в названии
+-- (оба условия обслуживаются GIN-индексами), сортировка по релевантности,
+-- keyset-пагинация по паре (search_rank, product_id)
 CREATE OR REPLACE FUNCTION search_cars(
-    search_name TEXT
-) 
+    search_name TEXT,
+    limit_input INT DEFAULT 20,
+    after_rank REAL DEFAULT NULL,
+    after_id BIGINT DEFAULT NULL
+)
 RETURNS TABLE (
     product_id BIGINT,
     product_name TEXT,
     description TEXT,
-    price DECIMAL(10, 2)
-) 
+    price DECIMAL(10, 2),
+    photo_url TEXT,
+    search_rank REAL
+)
 AS $$
 BEGIN
+    IF search_name IS NULL OR btrim(search_name) = '' THEN
+        RETURN QUERY
+        SELECT p.product_id, p.product_name::TEXT, p.description, p.price, p.photo_url, 0::REAL
+        FROM product p
+        WHERE after_id IS NULL OR p.product_id > after_id
+        ORDER BY p.product_id
+        LIMIT limit_input;
+        RETURN;
+    END IF;
+
     RETURN QUERY
-    SELECT 
-        product_id,
-        product_name,
-        description,
-        price
-    FROM product
-    WHERE 
-        (search_name IS NULL OR product_name ILIKE '%' || search_name || '%');
+    WITH query AS (
+        SELECT websearch_to_tsquery('simple', search_name) AS tsq
+    ), matches AS (
+        SELECT
+            p.product_id,
+            p.product_name::TEXT AS product_name,
+            p.description,
+            p.price,
+            p.photo_url,
+            (ts_rank(product_search_vector(p.product_name, p.description), q.tsq)
+                + similarity(p.product_name, search_name))::REAL AS search_rank
+        FROM product p, query q
+        WHERE product_search_vector(p.product_name, p.description) @@ q.tsq
+            OR p.product_name ILIKE '%' || search_name || '%'
+    )
+    SELECT m.product_id, m.product_name, m.description, m.price, m.photo_url, m.search_rank
+    FROM matches m
+    WHERE after_rank IS NULL
+        OR m.search_rank < after_rank
+        OR (m.search_rank = after_rank AND m.product_id > after_id)
+    ORDER BY m.search_rank DESC, m.product_id
+    LIMIT limit_input;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -271,35 +616,100 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Get single table data
+-- Get all public tables with their columns in one pass over pg_catalog (schema cache of the app)
 
-CREATE OR REPLACE FUNCTION get_full_table(table_name text)
-RETURNS TABLE (result jsonb) AS $$
+CREATE OR REPLACE FUNCTION get_schema_catalog()
+RETURNS TABLE(
+    table_name TEXT,
+    column_name TEXT,
+    data_type TEXT,
+    is_nullable BOOLEAN,
+    is_primary_key BOOLEAN
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        c.relname::text,
+        a.attname::text,
+        format_type(a.atttypid, a.atttypmod),
+        NOT a.attnotnull,
+        coalesce(a.attnum = ANY(i.indkey), FALSE)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_index i ON i.indrelid = c.oid AND i.indisprimary
+    WHERE n.nspname = 'public'
+        AND c.relkind IN ('r', 'p', 'v', 'f')
+        AND NOT c.relispartition
+    ORDER BY c.relname, a.attnum;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Get primary key column of a table available in admin tools
+-- (первый столбец первичного ключа целого типа; NULL, если по нему нельзя листать — например, у представлений)
+
+CREATE OR REPLACE FUNCTION get_table_primary_key(table_name text)
+RETURNS TEXT AS $$
+    SELECT a.attname::TEXT
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = i.indkey[0]
+    WHERE i.indisprimary
+      AND n.nspname = 'public'
+      AND c.relname = table_name
+      AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+      -- в составном ключе первый столбец уникален сам по себе только если это identity (log_id)
+      AND (i.indnkeyatts = 1 OR a.attidentity <> '');
+$$ LANGUAGE sql STABLE;
+
+-- Get single table data (keyset page on primary key when after_id / limit_input are given;
+-- tables without a usable primary key are returned whole)
+
+CREATE OR REPLACE FUNCTION get_full_table(
+    table_name text,
+    after_id BIGINT DEFAULT NULL,
+    limit_input INT DEFAULT NULL
+)
+RETURNS TABLE (row_id BIGINT, result jsonb) AS $$
 DECLARE
     query text;
-    primary_key_column text;
-BEGIN
-    IF table_name = 'product' THEN
-        primary_key_column := 'product_id';
-    ELSIF table_name = 'roles' THEN
-        primary_key_column := 'roles_id';
-    ELSIF table_name = 'users' THEN
-        primary_key_column := 'users_id';
-    ELSIF table_name = 'customer' THEN
-        primary_key_column := 'customer_id';
-    ELSIF table_name = 'shipment_method' THEN
-        primary_key_column := 'shipment_method_id';
-    ELSIF table_name = 'orders' THEN
-        primary_key_column := 'orders_id';
-    ELSIF table_name = 'log' THEN
-        primary_key_column := 'log_id';
-    ELSE
-        RAISE EXCEPTION 'Unsupported table: %', table_name;
+    primary_key_column text := get_table_primary_key(table_name);
+BEGIN
+    IF primary_key_column IS NULL THEN
+        IF after_id IS NOT NULL OR limit_input IS NOT NULL THEN
+            RAISE EXCEPTION 'Table % has no primary key to page on', table_name
+                USING ERRCODE = 'feature_not_supported';
+        END IF;
+        RETURN QUERY EXECUTE 'SELECT NULL::BIGINT, row_to_json(t)::jsonb FROM ' || quote_ident(table_name) || ' t';
+        RETURN;
     END IF;
 
-    query := 'SELECT row_to_json(t)::jsonb FROM ' || quote_ident(table_name) || ' t ORDER BY t.' || quote_ident(primary_key_column);
-    
-    RETURN QUERY EXECUTE query;
+    query := 'SELECT t.' || quote_ident(primary_key_column) || '::BIGINT, row_to_json(t)::jsonb FROM ' || quote_ident(table_name) || ' t';
+    IF after_id IS NOT NULL THEN
+        query := query || ' WHERE t.' || quote_ident(primary_key_column) || ' > $1';
+    END IF;
+    query := query || ' ORDER BY t.' || quote_ident(primary_key_column) || ' LIMIT $2';
+
+    RETURN QUERY EXECUTE query USING after_id, limit_input;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Get single table page already aggregated into one JSON array (forwarded to the client as is)
+
+CREATE OR REPLACE FUNCTION get_full_table_json(
+    table_name text,
+    after_id BIGINT DEFAULT NULL,
+    limit_input INT DEFAULT NULL
+)
+RETURNS TABLE (rows_json TEXT, row_count BIGINT, last_id BIGINT) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        coalesce(json_agg(page.result ORDER BY page.row_id), '[]'::json)::text,
+        count(*),
+        max(page.row_id)
+    FROM get_full_table(table_name, after_id, limit_input) AS page;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -373,3 +783,199 @@ BEGIN
     END IF;
 END;
 $$ LANGUAGE plpgsql;
+
+-- Таблицы для снимков резервного хранилища: обычные и секционированные (без отдельных партиций),
+-- генерируемые столбцы пропускаются, так как COPY FROM не может их заполнить
+CREATE OR REPLACE FUNCTION get_backup_tables()
+RETURNS TABLE(
+    table_name TEXT,
+    column_names TEXT[]
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        c.relname::text,
+        array_agg(a.attname::text ORDER BY a.attnum)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = ''
+    WHERE n.nspname = 'public'
+        AND c.relkind IN ('r', 'p')
+        AND NOT c.relispartition
+    GROUP BY c.relname
+    ORDER BY c.relname;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Сдвиг identity/serial последовательностей таблицы за максимальное значение после восстановления
+CREATE OR REPLACE FUNCTION reset_table_sequences(table_name TEXT)
+RETURNS VOID AS $$
+DECLARE
+    column_record RECORD;
+    sequence_name TEXT;
+    max_value BIGINT;
+BEGIN
+    FOR column_record IN
+        SELECT a.attname
+        FROM pg_attribute a
+        WHERE a.attrelid = quote_ident(table_name)::regclass AND a.attnum > 0 AND NOT a.attisdropped
+    LOOP
+        sequence_name := pg_get_serial_sequence(quote_ident(table_name), column_record.attname);
+        CONTINUE WHEN sequence_name IS NULL;
+        EXECUTE format('SELECT max(%I) FROM %I', column_record.attname, table_name) INTO max_value;
+        PERFORM setval(sequence_name, coalesce(max_value, 0) + 1, FALSE);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полный пересчёт агрегатов продаж по orders (восстановление после ручных правок с отключёнными триггерами)
+CREATE OR REPLACE FUNCTION rebuild_sales_rollups()
+RETURNS VOID AS $$
+BEGIN
+    TRUNCATE sales_daily, sales_daily_product, sales_daily_shipment;
+
+    INSERT INTO sales_daily (order_date, orders_count, total_amount)
+    SELECT o.order_date, count(*), sum(coalesce(o.unit_price, 0))
+    FROM orders o
+    WHERE o.product_id IS NOT NULL
+    GROUP BY o.order_date;
+
+    INSERT INTO sales_daily_product (order_date, product_id, orders_count, total_amount)
+    SELECT o.order_date, o.product_id, count(*), sum(coalesce(o.unit_price, 0))
+    FROM orders o
+    WHERE o.product_id IS NOT NULL
+    GROUP BY o.order_date, o.product_id;
+
+    INSERT INTO sales_daily_shipment (order_date, shipment_method_id, orders_count, total_amount)
+    SELECT o.order_date, o.shipment_method_id, count(*), sum(coalesce(o.unit_price, 0))
+    FROM orders o
+    WHERE o.product_id IS NOT NULL AND o.shipment_method_id IS NOT NULL
+    GROUP BY o.order_date, o.shipment_method_id;
+
+    UPDATE sales_total
+    SET orders_count = CASE WHEN shard = 0 THEN (SELECT coalesce(sum(s.orders_count), 0) FROM sales_daily s) ELSE 0 END,
+        total_amount = CASE WHEN shard = 0 THEN (SELECT coalesce(sum(s.total_amount), 0) FROM sales_daily s) ELSE 0 END;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Продажи по периодам (день/неделя/месяц) из дневных агрегатов; периоды без продаж возвращаются с нулями
+CREATE OR REPLACE FUNCTION get_sales_series(
+    from_date DATE,
+    to_date DATE,
+    bucket TEXT DEFAULT 'day',
+    shipment_method_id_input BIGINT DEFAULT NULL
+)
+RETURNS TABLE(period_start DATE, orders_count BIGINT, total_amount DECIMAL)
+AS $$
+#variable_conflict use_column
+BEGIN
+    IF bucket NOT IN ('day', 'week', 'month') THEN
+        RAISE EXCEPTION 'Unsupported bucket: %', bucket USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+
+    RETURN QUERY
+    WITH periods AS (
+        SELECT generate_series(
+            date_trunc(bucket, from_date::TIMESTAMP),
+            date_trunc(bucket, to_date::TIMESTAMP),
+            ('1 ' || bucket)::INTERVAL
+        )::DATE AS period_start
+    ), sales AS (
+        SELECT date_trunc(bucket, s.order_date::TIMESTAMP)::DATE AS period_start,
+            sum(s.orders_count) AS orders_count,
+            sum(s.total_amount) AS total_amount
+        FROM sales_daily s
+        WHERE shipment_method_id_input IS NULL AND s.order_date BETWEEN from_date AND to_date
+        GROUP BY 1
+        UNION ALL
+        SELECT date_trunc(bucket, s.order_date::TIMESTAMP)::DATE,
+            sum(s.orders_count),
+            sum(s.total_amount)
+        FROM sales_daily_shipment s
+        WHERE s.shipment_method_id = shipment_method_id_input AND s.order_date BETWEEN from_date AND to_date
+        GROUP BY 1
+    )
+    SELECT p.period_start, coalesce(s.orders_count, 0)::BIGINT, coalesce(s.total_amount, 0)
+    FROM periods p
+    LEFT JOIN sales s ON s.period_start = p.period_start
+    ORDER BY p.period_start;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Топ товаров за период по выручке или по числу заказов
+CREATE OR REPLACE FUNCTION get_top_products(
+    from_date DATE,
+    to_date DATE,
+    limit_input INT DEFAULT 10,
+    order_by TEXT DEFAULT 'revenue'
+)
+RETURNS TABLE(product_id BIGINT, product_name TEXT, orders_count BIGINT, total_amount DECIMAL)
+AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    SELECT s.product_id, p.product_name::TEXT, sum(s.orders_count)::BIGINT, sum(s.total_amount)
+    FROM sales_daily_product s
+    LEFT JOIN product p ON p.product_id = s.product_id
+    WHERE s.order_date BETWEEN from_date AND to_date
+    GROUP BY s.product_id, p.product_name
+    HAVING sum(s.orders_count) > 0
+    ORDER BY
+        CASE WHEN order_by = 'orders' THEN sum(s.orders_count) ELSE sum(s.total_amount) END DESC,
+        s.product_id
+    LIMIT limit_input;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Продажи за период в разрезе способов доставки
+CREATE OR REPLACE FUNCTION get_shipment_breakdown(from_date DATE, to_date DATE)
+RETURNS TABLE(shipment_method_id BIGINT, method_name TEXT, orders_count BIGINT, total_amount DECIMAL)
+AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    SELECT s.shipment_method_id, sm.method_name, sum(s.orders_count)::BIGINT, sum(s.total_amount)
+    FROM sales_daily_shipment s
+    LEFT JOIN shipment_method sm ON sm.shipment_method_id = s.shipment_method_id
+    WHERE s.order_date BETWEEN from_date AND to_date
+    GROUP BY s.shipment_method_id, sm.method_name
+    HAVING sum(s.orders_count) > 0
+    ORDER BY sum(s.total_amount) DESC, s.shipment_method_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Самые тяжёлые запросы текущей базы по данным pg_stat_statements,
+-- включая запросы внутри функций (pg_stat_statements.track = all)
+CREATE OR REPLACE FUNCTION get_statement_stats(limit_input INT DEFAULT 20, order_by TEXT DEFAULT 'total_time')
+RETURNS TABLE(
+    query TEXT,
+    calls BIGINT,
+    total_ms DOUBLE PRECISION,
+    mean_ms DOUBLE PRECISION,
+    max_ms DOUBLE PRECISION,
+    rows_total BIGINT,
+    shared_blks_hit BIGINT,
+    shared_blks_read BIGINT,
+    toplevel BOOLEAN
+)
+AS $$
+#variable_conflict use_column
+BEGIN
+    IF order_by NOT IN ('total_time', 'mean_time', 'calls') THEN
+        RAISE EXCEPTION 'Unsupported order_by: %', order_by;
+    END IF;
+
+    RETURN QUERY
+    SELECT s.query, s.calls, s.total_exec_time, s.mean_exec_time, s.max_exec_time,
+           s.rows, s.shared_blks_hit, s.shared_blks_read, s.toplevel
+    FROM pg_stat_statements s
+    WHERE s.dbid = (SELECT d.oid FROM pg_database d WHERE d.datname = current_database())
+    ORDER BY
+        CASE order_by
+            WHEN 'mean_time' THEN s.mean_exec_time
+            WHEN 'calls' THEN s.calls::DOUBLE PRECISION
+            ELSE s.total_exec_time
+        END DESC
+    LIMIT limit_input;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,43 +1,248 @@
+-- Аудит изменений: один set-based INSERT в log на оператор вместо запроса на каждую строку.
+-- Изменённые строки берутся из transition-таблиц (new_rows / old_rows); как и раньше,
+-- на каждую строку пишется одна запись, если её пользователь существует в users
 CREATE OR REPLACE FUNCTION log_action()
 RETURNS TRIGGER AS $$
 DECLARE
-    log_user_id BIGINT;
-    user_exists BOOLEAN;
+    id_column TEXT := CASE WHEN TG_TABLE_NAME = 'customer' THEN 'customer_id' ELSE 'users_id' END;
+    rows_table TEXT := CASE WHEN TG_OP = 'DELETE' THEN 'old_rows' ELSE 'new_rows' END;
+    missing_count BIGINT;
 BEGIN
-    -- Определяем, какое поле использовать для логирования
-    IF TG_TABLE_NAME = 'customer' THEN
-        log_user_id := COALESCE(NEW.customer_id, OLD.customer_id);
-    ELSE
-        log_user_id := COALESCE(NEW.users_id, OLD.users_id);
+    EXECUTE format(
+        'WITH changed AS (
+            SELECT r.%I AS user_id FROM %I r
+        ), logged AS (
+            INSERT INTO log (action_type, user_id, action_timestamp)
+            SELECT $1, c.user_id, CURRENT_TIMESTAMP
+            FROM changed c
+            WHERE EXISTS (SELECT 1 FROM users u WHERE u.users_id = c.user_id)
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM changed) - (SELECT count(*) FROM logged)',
+        id_column, rows_table
+    ) INTO missing_count USING TG_TABLE_NAME || ' ' || TG_OP;
+
+    -- Одно предупреждение на оператор вместо предупреждения на каждую строку
+    IF missing_count > 0 THEN
+        RAISE WARNING '% % row(s) reference users that do not exist in users table', missing_count, TG_TABLE_NAME;
     END IF;
 
-    -- Проверяем, существует ли пользователь с таким user_id в таблице users
-    SELECT EXISTS (SELECT 1 FROM users WHERE users_id = log_user_id) INTO user_exists;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Триггеры с transition-таблицами допускают только одно событие, поэтому по триггеру на операцию
+CREATE TRIGGER log_users_insert
+AFTER INSERT ON users
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_action();
+
+CREATE TRIGGER log_users_update
+AFTER UPDATE ON users
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_action();
+
+CREATE TRIGGER log_users_delete
+AFTER DELETE ON users
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_action();
+
+CREATE TRIGGER log_customer_insert
+AFTER INSERT ON customer
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_action();
+
+CREATE TRIGGER log_customer_update
+AFTER UPDATE ON customer
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_action();
+
+CREATE TRIGGER log_customer_delete
+AFTER DELETE ON customer
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_action();
+
 
-    -- Если пользователь существует, вставляем запись в лог
-    IF user_exists THEN
-        INSERT INTO log (action_type, user_id, action_timestamp)
-        VALUES (TG_TABLE_NAME || ' ' || TG_OP, log_user_id, CURRENT_TIMESTAMP);
+-- Оповещение приложения об изменении пользователей и ролей (сброс кэша пользователей)
+CREATE OR REPLACE FUNCTION notify_user_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'users' THEN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM pg_notify('user_changes', OLD.username);
+        END IF;
+        IF TG_OP = 'UPDATE' AND NEW.username IS DISTINCT FROM OLD.username THEN
+            PERFORM pg_notify('user_changes', NEW.username);
+        END IF;
     ELSE
-        RAISE WARNING 'User with ID % does not exist in users table', log_user_id;
+        -- Изменение роли затрагивает всех её пользователей: пустой payload сбрасывает весь кэш
+        PERFORM pg_notify('user_changes', '');
     END IF;
 
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
+CREATE TRIGGER notify_users_changes
+AFTER UPDATE OR DELETE
+ON users
+FOR EACH ROW
+EXECUTE FUNCTION notify_user_changes();
 
+CREATE TRIGGER notify_roles_changes
+AFTER UPDATE OR DELETE
+ON roles
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_user_changes();
+
+-- Оповещение приложения об изменении каталога (пересборка снимка GET /products)
+CREATE OR REPLACE FUNCTION notify_product_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('product_changes', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_product_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+ON product
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_product_changes();
+
+-- Построчное оповещение об изменениях товаров (инкрементальное обновление индекса подсказок)
+CREATE OR REPLACE FUNCTION notify_product_row_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('product_row_changes', json_build_object('op', TG_OP, 'id', OLD.product_id)::text);
+    ELSIF TG_OP = 'INSERT' OR NEW.product_name IS DISTINCT FROM OLD.product_name THEN
+        PERFORM pg_notify('product_row_changes', json_build_object('op', TG_OP, 'id', NEW.product_id, 'name', NEW.product_name)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
--- Пример добавления триггера для таблицы users
-CREATE TRIGGER log_users
+CREATE TRIGGER notify_product_row_changes
 AFTER INSERT OR UPDATE OR DELETE
-ON users
+ON product
 FOR EACH ROW
-EXECUTE FUNCTION log_action();
+EXECUTE FUNCTION notify_product_row_changes();
 
--- Пример добавления триггера для других таблиц, где есть user_id
-CREATE TRIGGER log_customer
-AFTER INSERT OR UPDATE OR DELETE
-ON customer
+-- Оповещение приложения о DDL (обновление кэша схемы для проверок таблиц и колонок)
+CREATE OR REPLACE FUNCTION notify_schema_changes()
+RETURNS event_trigger AS $$
+BEGIN
+    PERFORM pg_notify('schema_changes', tg_tag);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE EVENT TRIGGER notify_schema_changes
+ON ddl_command_end
+EXECUTE FUNCTION notify_schema_changes();
+
+
+-- Цена заказа фиксируется при вставке, чтобы агрегаты продаж не зависели от последующей смены цены товара
+CREATE OR REPLACE FUNCTION set_order_unit_price()
+RETURNS TRIGGER AS $$
+BEGIN
+    SELECT p.price INTO NEW.unit_price
+    FROM product p
+    WHERE p.product_id = NEW.product_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER set_orders_unit_price
+BEFORE INSERT ON orders
 FOR EACH ROW
-EXECUTE FUNCTION log_action();
+WHEN (NEW.unit_price IS NULL AND NEW.product_id IS NOT NULL)
+EXECUTE FUNCTION set_order_unit_price();
+
+
+-- Инкрементальное обновление агрегатов продаж: изменения оператора превращаются в дельты
+-- (+1 для новых строк, -1 для старых) и добавляются к агрегатам одним запросом.
+-- Шард выбирается по сеансу: разные соединения пула пишут в разные строки итога и дней
+CREATE OR REPLACE FUNCTION maintain_sales_rollups()
+RETURNS TRIGGER AS $$
+DECLARE
+    session_shard SMALLINT := pg_backend_pid() % 8;
+    changed_rows TEXT := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT n.order_date, n.product_id, n.shipment_method_id, n.unit_price, 1 AS sign FROM new_rows n'
+        WHEN 'DELETE' THEN 'SELECT o.order_date, o.product_id, o.shipment_method_id, o.unit_price, -1 AS sign FROM old_rows o'
+        ELSE 'SELECT n.order_date, n.product_id, n.shipment_method_id, n.unit_price, 1 AS sign FROM new_rows n
+              UNION ALL
+              SELECT o.order_date, o.product_id, o.shipment_method_id, o.unit_price, -1 AS sign FROM old_rows o'
+    END;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE sales_daily, sales_daily_product, sales_daily_shipment;
+        UPDATE sales_total SET orders_count = 0, total_amount = 0;
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format(
+        'WITH delta AS (
+            SELECT c.order_date, c.product_id, c.shipment_method_id, c.sign, c.sign * coalesce(c.unit_price, 0) AS amount
+            FROM (%s) c
+            WHERE c.product_id IS NOT NULL
+        ), daily AS (
+            INSERT INTO sales_daily AS s (order_date, shard, orders_count, total_amount)
+            SELECT d.order_date, %2$s, sum(d.sign), sum(d.amount) FROM delta d GROUP BY d.order_date
+            ON CONFLICT (order_date, shard) DO UPDATE
+            SET orders_count = s.orders_count + EXCLUDED.orders_count, total_amount = s.total_amount + EXCLUDED.total_amount
+        ), by_product AS (
+            INSERT INTO sales_daily_product AS s (order_date, product_id, shard, orders_count, total_amount)
+            SELECT d.order_date, d.product_id, %2$s, sum(d.sign), sum(d.amount) FROM delta d GROUP BY d.order_date, d.product_id
+            ON CONFLICT (order_date, product_id, shard) DO UPDATE
+            SET orders_count = s.orders_count + EXCLUDED.orders_count, total_amount = s.total_amount + EXCLUDED.total_amount
+        ), by_shipment AS (
+            INSERT INTO sales_daily_shipment AS s (order_date, shipment_method_id, shard, orders_count, total_amount)
+            SELECT d.order_date, d.shipment_method_id, %2$s, sum(d.sign), sum(d.amount) FROM delta d
+            WHERE d.shipment_method_id IS NOT NULL
+            GROUP BY d.order_date, d.shipment_method_id
+            ON CONFLICT (order_date, shipment_method_id, shard) DO UPDATE
+            SET orders_count = s.orders_count + EXCLUDED.orders_count, total_amount = s.total_amount + EXCLUDED.total_amount
+        )
+        UPDATE sales_total
+        SET orders_count = orders_count + (SELECT coalesce(sum(d.sign), 0) FROM delta d),
+            total_amount = total_amount + (SELECT coalesce(sum(d.amount), 0) FROM delta d)
+        WHERE shard = %2$s',
+        changed_rows,
+        session_shard
+    );
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sales_rollups_insert
+AFTER INSERT ON orders
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION maintain_sales_rollups();
+
+CREATE TRIGGER sales_rollups_update
+AFTER UPDATE ON orders
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION maintain_sales_rollups();
+
+CREATE TRIGGER sales_rollups_delete
+AFTER DELETE ON orders
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION maintain_sales_rollups();
+
+CREATE TRIGGER sales_rollups_truncate
+AFTER TRUNCATE ON orders
+FOR EACH STATEMENT
+EXECUTE FUNCTION maintain_sales_rollups();
@@ -1,9 +1,8 @@
+-- Сводка по заказам суммирует 8 шардов агрегата sales_total, а не считается по всей истории заказов
 CREATE VIEW order_summary AS
 SELECT 
-    COUNT(po.orders_id) AS total_orders,  
-    SUM(p.price) AS total_amount,      
-    AVG(p.price) AS average_amount      
+    sum(orders_count)::BIGINT AS total_orders,  
+    sum(total_amount) AS total_amount,      
+    sum(total_amount) / NULLIF(sum(orders_count), 0) AS average_amount      
 FROM 
-    orders po
-JOIN 
-    product p ON po.product_id = p.product_id;
\ No newline at end of file
+    sales_total;
\ No newline at end of file